@@ -0,0 +1,568 @@
+"""Бенчмарк обработчиков бота на синтетическом каталоге.
+
+Гоняет настоящие обработчики из botAdmin.py (search_text, on_callback, add_photo, favs_keyboard)
+на сгенерированных Update'ах. Бот ненастоящий: запросы к Bot API только записываются, в сеть ничего
+не уходит. Для каждого сценария печатает p50/p99 задержки и сколько памяти выделяется за вызов.
+
+    python bench.py                          # каталоги 10/1k/100k, пользователей 1k/100k
+    python bench.py --full                   # плюс 1M рецептов и 1M пользователей (нужно несколько ГБ памяти)
+    python bench.py --save bench_baseline.json
+    python bench.py --compare bench_baseline.json
+    python bench.py --check-fuzzy 300        # нечёткий поиск против перебора словаря, плюс его p50/p99
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import asyncio
+import tracemalloc
+import gc
+from typing import Callable, Dict, List, Optional, Tuple
+
+os.environ["RECIPES_STORAGE"] = "json"   # каталог живёт в памяти (MemoryBackend), диск не трогаем
+
+from telegram import Update
+from telegram.ext import Application, CallbackContext
+from telegram.request import BaseRequest, RequestData
+
+import botAdmin
+from botAdmin import Recipe
+
+DEFAULT_RECIPES = [10, 1_000, 100_000]
+DEFAULT_USERS = [1_000, 100_000]
+FULL_RECIPES = [10, 1_000, 100_000, 1_000_000]
+FULL_USERS = [1_000, 100_000, 1_000_000]
+ITERATIONS = 300
+ALLOC_ITERATIONS = 50
+REGRESSION = 1.25   # во сколько раз p50 может вырасти относительно baseline, прежде чем считаем это регрессией
+
+USER_BASE = 10_000_000
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "bench"}
+
+FOOD_WORDS = (
+    "курица говядина свинина индейка рыба лосось тунец креветки яйца молоко сметана творог сыр масло "
+    "мука сахар соль перец рис гречка овсянка макароны картофель морковь лук чеснок капуста свекла "
+    "огурец помидор кабачок баклажан грибы шампиньоны фасоль горох чечевица яблоко банан ягоды мёд "
+    "укроп петрушка базилик лимон соус бульон тесто хлеб орехи изюм корица ваниль какао шоколад"
+).split()
+DISH_WORDS = "суп салат запеканка омлет каша рагу пирог блины сырники котлеты плов гуляш паста жаркое".split()
+SYLLABLES = "ка ро ми ле на то су ри па ве ло зу ни га ше мо ду ти ба ке".split()
+UNITS = ("г", "мл", "шт.", "ст. л.", "ч. л.")
+
+
+# ---- фейковый Bot API ----
+class RecordingRequest(BaseRequest):
+    # Отвечает на все методы Bot API правдоподобными заглушками и считает вызовы.
+    def __init__(self):
+        self.calls = 0
+        self._message_id = 0
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         read_timeout=None, write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls += 1
+        if endpoint == "getMe":
+            result = BOT_USER | {"username": "bench_bot"}
+        elif endpoint.startswith(("send", "edit")):
+            self._message_id += 1
+            result = {
+                "message_id": self._message_id,
+                "date": 0,
+                "chat": {"id": params.get("chat_id", 0), "type": "private"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            }
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode("utf-8")
+
+
+class MemoryBackend:
+    # Хранилище каталога для бенчмарка: синтетические рецепты в памяти, запись — пустая операция.
+    def __init__(self, recipes: List[Recipe]):
+        self.recipes = recipes
+
+    def __str__(self) -> str:
+        return "memory"
+
+    def changed(self) -> bool:
+        return False
+
+    def changes(self):
+        return None
+
+    def state(self):
+        return None
+
+    def adopt(self, state) -> None:
+        pass
+
+    def load(self, readonly: bool = False) -> Tuple[List[Recipe], int]:
+        return self.recipes, len(self.recipes) + 1
+
+    def reserve_ids(self, floor: int, n: int) -> int:
+        return floor
+
+    def record_add(self, r: Recipe, new: bool = False) -> None:
+        pass
+
+    def record_delete(self, rid: int) -> None:
+        pass
+
+    def prepare(self, store):
+        return lambda: None
+
+    def finish(self, ok: bool) -> None:
+        pass
+
+
+# ---- синтетические данные ----
+def make_vocabulary(rng: random.Random, n_recipes: int) -> List[str]:
+    # словарь растёт с каталогом, как в жизни: чем больше рецептов, тем больше редких слов
+    words = set(FOOD_WORDS)
+    target = len(words) + min(50_000, n_recipes // 2)
+    while len(words) < target:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def make_catalog(rng: random.Random, n: int, vocab: List[str]) -> List[Recipe]:
+    recipes = []
+    for rid in range(1, n + 1):
+        title = f"{rng.choice(DISH_WORDS).capitalize()} {' '.join(rng.sample(vocab, rng.randint(1, 3)))}"
+        ingredients = [
+            f"{rng.choice(vocab).capitalize()} ({rng.randint(1, 500)} {rng.choice(UNITS)})"
+            for _ in range(rng.randint(3, 10))
+        ]
+        steps = " ".join(f"{rng.choice(vocab).capitalize()} {rng.randint(1, 20)} минут." for _ in range(rng.randint(3, 12)))
+        photo = f"photo-{rid}" if rng.random() < 0.3 else None
+        recipes.append(Recipe(id=rid, title=title, ingredients=ingredients, steps=steps, photo_file_id=photo))
+    return recipes
+
+
+def fav_count(rng: random.Random) -> int:
+    # у большинства избранное пустое, у остальных — несколько рецептов, у редких — сотни
+    if rng.random() < 0.6:
+        return 0
+    return min(300, int(rng.expovariate(1 / 8)) + 1)
+
+
+def popular_recipe(rng: random.Random, n_recipes: int) -> int:
+    # популярность с длинным хвостом: маленькие id попадают в избранное заметно чаще
+    return min(n_recipes, int(n_recipes ** rng.random()))
+
+
+def fill_users(app: Application, rng: random.Random, n_users: int, n_recipes: int) -> List[int]:
+    with_favs = []
+    for k in range(n_users):
+        uid = USER_BASE + k
+        count = min(fav_count(rng), n_recipes)
+        favs = dict.fromkeys(popular_recipe(rng, n_recipes) for _ in range(count))
+        app.user_data[uid]["favs"] = favs
+        if favs:
+            with_favs.append(uid)
+    return with_favs
+
+
+# ---- апдейты ----
+class UpdateFactory:
+    def __init__(self, bot):
+        self.bot = bot
+        self._update_id = 0
+
+    def _next(self) -> int:
+        self._update_id += 1
+        return self._update_id
+
+    def message(self, uid: int, text: str) -> Update:
+        n = self._next()
+        return Update.de_json({
+            "update_id": n,
+            "message": {
+                "message_id": n,
+                "date": 0,
+                "chat": {"id": uid, "type": "private"},
+                "from": {"id": uid, "is_bot": False, "first_name": "u"},
+                "text": text,
+            },
+        }, self.bot)
+
+    def callback(self, uid: int, data: str) -> Update:
+        n = self._next()
+        return Update.de_json({
+            "update_id": n,
+            "callback_query": {
+                "id": str(n),
+                "chat_instance": "bench",
+                "from": {"id": uid, "is_bot": False, "first_name": "u"},
+                "data": data,
+                "message": {"message_id": n, "date": 0, "chat": {"id": uid, "type": "private"}, "from": BOT_USER, "text": "x"},
+            },
+        }, self.bot)
+
+    def inline_query(self, uid: int, query: str, offset: str = "") -> Update:
+        n = self._next()
+        return Update.de_json({
+            "update_id": n,
+            "inline_query": {
+                "id": str(n),
+                "from": {"id": uid, "is_bot": False, "first_name": "u"},
+                "query": query,
+                "offset": offset,
+            },
+        }, self.bot)
+
+
+# ---- сценарии ----
+# Сценарий готовит один вызов: возвращает корутину обработчика (её и замеряем)
+# и необязательную уборку после замера (вернуть удалённый рецепт и т.п.).
+Prepared = Tuple[Callable[[], object], Optional[Callable[[], None]]]
+
+
+class Bench:
+    def __init__(self, app: Application, request: RecordingRequest, rng: random.Random,
+                 vocab: List[str], users: List[int], with_favs: List[int]):
+        self.app = app
+        self.request = request
+        self.rng = rng
+        self.vocab = vocab
+        self.users = users
+        self.with_favs = with_favs or users
+        self.updates = UpdateFactory(app.bot)
+        self._fav_state: Dict[Tuple[int, int], bool] = {}
+
+    def _context(self, update: Update) -> CallbackContext:
+        return CallbackContext.from_update(update, self.app)
+
+    def _call(self, handler, update: Update):
+        context = self._context(update)
+        return lambda: handler(update, context)
+
+    def _random_rid(self) -> int:
+        return botAdmin.STORE.random().id
+
+    def _query(self) -> str:
+        rng = self.rng
+        roll = rng.random()
+        if roll < 0.5:
+            return rng.choice(self.vocab)
+        if roll < 0.8:
+            return " ".join(rng.sample(self.vocab, 2))
+        # опечатка: одна буква заменена
+        word = rng.choice(FOOD_WORDS)
+        i = rng.randrange(len(word))
+        return word[:i] + rng.choice("абвгдежзиклмнопрст") + word[i + 1:]
+
+    def search_text(self) -> Prepared:
+        uid = self.rng.choice(self.users)
+        return self._call(botAdmin.search_text, self.updates.message(uid, self._query())), None
+
+    def inline_query(self) -> Prepared:
+        # набор по буквам: каждый префикс запроса — отдельный апдейт; иногда — следующая порция
+        query = self._query()
+        prefix = query[:self.rng.randint(1, len(query))]
+        offset = str(botAdmin.INLINE_PAGE_SIZE) if self.rng.random() < 0.2 else ""
+        update = self.updates.inline_query(self.rng.choice(self.users), prefix, offset)
+        return self._call(botAdmin.inline_search, update), None
+
+    def pantry(self) -> Prepared:
+        items = self.rng.sample(FOOD_WORDS, self.rng.randint(2, 6)) + self.rng.sample(self.vocab, 2)
+        update = self.updates.message(self.rng.choice(self.users), ", ".join(items))
+        return self._call(botAdmin.cook_items, update), None
+
+    def catalog_page(self) -> Prepared:
+        pages = max(1, (len(botAdmin.STORE) + botAdmin.CAT_PAGE_SIZE - 1) // botAdmin.CAT_PAGE_SIZE)
+        data = f"{botAdmin.CB_CAT_PAGE}{self.rng.randint(1, pages)}"
+        return self._call(botAdmin.on_callback, self.updates.callback(self.rng.choice(self.users), data)), None
+
+    def show_recipe(self) -> Prepared:
+        data = f"{botAdmin.CB_CAT_SHOW}{self._random_rid()}"
+        return self._call(botAdmin.on_callback, self.updates.callback(self.rng.choice(self.users), data)), None
+
+    def similar_recipes(self) -> Prepared:
+        data = f"{botAdmin.CB_SIMILAR}{self._random_rid()}"
+        return self._call(botAdmin.on_callback, self.updates.callback(self.rng.choice(self.users), data)), None
+
+    def fav_toggle(self) -> Prepared:
+        uid = self.rng.choice(self.users)
+        rid = self._random_rid()
+        on = not self._fav_state.get((uid, rid), False)
+        self._fav_state[(uid, rid)] = on
+        data = f"{botAdmin.CB_FAV_ADD if on else botAdmin.CB_FAV_DEL}{rid}"
+        return self._call(botAdmin.on_callback, self.updates.callback(uid, data)), None
+
+    def favs_page(self) -> Prepared:
+        data = f"{botAdmin.CB_FAV_SHOW_PAGE}1"
+        return self._call(botAdmin.on_callback, self.updates.callback(self.rng.choice(self.with_favs), data)), None
+
+    def favs_keyboard(self) -> Prepared:
+        uid = self.rng.choice(self.with_favs)
+        ids = list(self.app.user_data[uid].get("favs") or ())
+        pages = max(1, (len(ids) + botAdmin.FAV_PAGE_SIZE - 1) // botAdmin.FAV_PAGE_SIZE)
+        page = self.rng.randint(1, pages)
+
+        async def run() -> None:
+            botAdmin.favs_keyboard(botAdmin.STORE, ids, page)
+        return run, None
+
+    def admin_delete(self) -> Prepared:
+        r = botAdmin.STORE.random()
+        update = self.updates.callback(botAdmin.ADMIN_ID, f"{botAdmin.CB_DEL_OK}{r.id}")
+        fans = set(botAdmin.FAVS._fans.get(r.id, ()))
+
+        def restore() -> None:
+            # возвращаем рецепт и избранное, чтобы каталог и пользователи не таяли от замера к замеру
+            botAdmin.STORE.add(r)
+            for uid in fans:
+                self.app.user_data[uid]["favs"][r.id] = None
+            if fans:
+                botAdmin.FAVS._fans[r.id] = fans
+        return self._call(botAdmin.on_callback, update), restore
+
+    def add_photo(self) -> Prepared:
+        uid = botAdmin.ADMIN_ID
+        update = self.updates.message(uid, "-")
+        context = self._context(update)
+        context.user_data.update(
+            new_recipe_title=f"{self.rng.choice(DISH_WORDS).capitalize()} {self.rng.choice(self.vocab)}",
+            new_recipe_ingredients=[self.rng.choice(self.vocab) for _ in range(5)],
+            new_recipe_steps="Смешать и запечь.",
+        )
+        added = botAdmin.STORE.next_id
+
+        def restore() -> None:
+            botAdmin.STORE.delete(added)
+        return (lambda: botAdmin.add_photo(update, context)), restore
+
+
+# сценарии, которым важен размер базы пользователей; остальные гоняем один раз на каталог
+USER_SCENARIOS = ("fav_toggle", "favs_page", "favs_keyboard", "admin_delete")
+SCENARIOS = ("search_text", "inline_query", "pantry", "catalog_page", "show_recipe", "similar_recipes",
+             "fav_toggle", "favs_page", "favs_keyboard", "admin_delete", "add_photo")
+
+
+async def measure(bench: Bench, name: str, iterations: int) -> dict:
+    prepare = getattr(bench, name)
+    for _ in range(min(20, iterations)):   # прогрев: кэши, ленивые структуры
+        run, restore = prepare()
+        await run()
+        if restore:
+            restore()
+
+    gc.collect()
+    timings = []
+    calls_before = bench.request.calls
+    for _ in range(iterations):
+        run, restore = prepare()
+        started = time.perf_counter_ns()
+        await run()
+        timings.append(time.perf_counter_ns() - started)
+        if restore:
+            restore()
+    api_calls = (bench.request.calls - calls_before) / iterations
+
+    # память отдельным проходом: tracemalloc сам по себе сильно замедляет код
+    allocated = []
+    tracemalloc.start()
+    for _ in range(min(ALLOC_ITERATIONS, iterations)):
+        run, restore = prepare()
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        await run()
+        allocated.append(tracemalloc.get_traced_memory()[1] - before)
+        if restore:
+            restore()
+    tracemalloc.stop()
+
+    timings.sort()
+    allocated.sort()
+    return {
+        "p50_us": timings[len(timings) // 2] / 1000,
+        "p99_us": timings[min(len(timings) - 1, len(timings) * 99 // 100)] / 1000,
+        "alloc_kib": allocated[len(allocated) // 2] / 1024,
+        "api_calls": api_calls,
+    }
+
+
+async def run_catalog(n_recipes: int, user_sizes: List[int], scenarios: List[str],
+                      iterations: int, seed: int) -> Dict[str, dict]:
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    vocab = make_vocabulary(rng, n_recipes)
+    # память самих рецептов (вместе с пополнением словаря ингредиентов), без индексов
+    tracemalloc.start()
+    catalog = make_catalog(rng, n_recipes, vocab)
+    per_recipe = tracemalloc.get_traced_memory()[0] / n_recipes
+    tracemalloc.stop()
+    botAdmin.STORE.backend = MemoryBackend(catalog)
+    # кэш старта (STARTUP_CACHE из окружения) подсунул бы вместо синтетического каталога настоящий
+    botAdmin.STORE.cache = None
+    del catalog
+    botAdmin.STORE.load()
+    print(f"каталог {n_recipes}: построен за {time.perf_counter() - started:.1f} с, "
+          f"{per_recipe:.0f} байт на рецепт", file=sys.stderr)
+
+    results = {}
+    for i, n_users in enumerate(user_sizes):
+        request = RecordingRequest()
+        app = Application.builder().token("123456:bench").request(request).updater(None).build()
+        await app.initialize()
+        botAdmin.FAVS = botAdmin.UserDataFavourites()
+        with_favs = fill_users(app, rng, n_users, n_recipes)
+        await botAdmin.FAVS.attach(app)
+        users = [USER_BASE + k for k in range(n_users)]
+        bench = Bench(app, request, rng, vocab, users, with_favs)
+
+        for name in scenarios:
+            if i and name not in USER_SCENARIOS:
+                continue
+            key = f"{name}@{n_recipes}x{n_users}"
+            results[key] = await measure(bench, name, iterations)
+            print_row(key, results[key])
+        await app.shutdown()
+        del app, bench, users, with_favs
+        gc.collect()
+    return results
+
+
+# ---- проверка нечёткого поиска ----
+def levenshtein(a: str, b: str) -> int:
+    row = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        prev, row[0] = row[0], i
+        for j, cb in enumerate(b, 1):
+            prev, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, prev + (ca != cb))
+    return row[-1]
+
+
+def make_typo(rng: random.Random, word: str) -> str:
+    i = rng.randrange(len(word))
+    c = rng.choice("абвгдежзиклмнопрст")
+    roll = rng.random()
+    if roll < 0.4:
+        return word[:i] + c + word[i + 1:]
+    if roll < 0.7:
+        return word[:i] + word[i + 1:]
+    return word[:i] + c + word[i:]
+
+
+def check_fuzzy(n_queries: int, seed: int) -> bool:
+    # SearchIndex._fuzzy_terms против перебора всего словаря: расстояние до слова целиком или до его
+    # префикса длины запроса. Обход не должен вернуть слово дальше бюджета или с неверным расстоянием,
+    # а лучшее найденное расстояние — совпадать с перебором. Допустимый пропуск — только слова с двумя
+    # опечатками в первой половине запроса (их обход не ищет намеренно).
+    rng = random.Random(seed)
+    vocab = make_vocabulary(rng, 100_000)
+    index = botAdmin.SearchIndex()
+    index._vocab = vocab
+    ok = True
+    for name, source in (("словарь", vocab), ("продукты", FOOD_WORDS + DISH_WORDS)):
+        # короткие слова (бюджет 0) ищутся только точно и по префиксу
+        queries = []
+        while len(queries) < n_queries:
+            q = make_typo(rng, rng.choice(source))
+            if botAdmin.typo_budget(q):
+                queries.append(q)
+        timings, skipped = [], 0
+        for q in queries:
+            started = time.perf_counter_ns()
+            got = index._fuzzy_terms(q)
+            timings.append(time.perf_counter_ns() - started)
+            budget = botAdmin.typo_budget(q)
+            truth = {}
+            for t in vocab:
+                d = min(levenshtein(q, t), levenshtein(q, t[:len(q)]))
+                if d <= budget:
+                    truth[t] = d
+            best = min(truth.values(), default=None)
+            wrong = [(d, t) for d, t in got if truth.get(t) != d]
+            if wrong or (got and got[0][0] != best) or (not got and best is not None and best < 2):
+                print(f"{q!r}: найдено {got[:5]}, перебором лучшее {best}, неверные {wrong[:5]}")
+                ok = False
+            elif not got and best is not None:
+                skipped += 1
+        timings.sort()
+        print(f"fuzzy {name:<10} p50 {timings[len(timings) // 2] / 1000:>8.1f} мкс  "
+              f"p99 {timings[len(timings) * 99 // 100] / 1000:>8.1f} мкс  "
+              f"пропущено (две опечатки в начале): {skipped}/{len(queries)}", flush=True)
+    return ok
+
+
+def print_row(key: str, row: dict, baseline: Optional[dict] = None) -> None:
+    line = (f"{key:<36} p50 {row['p50_us']:>9.1f} мкс  p99 {row['p99_us']:>9.1f} мкс  "
+            f"{row['alloc_kib']:>8.1f} КиБ  API {row['api_calls']:.1f}")
+    if baseline is not None:
+        ratio = row["p50_us"] / baseline["p50_us"] if baseline["p50_us"] else 1.0
+        line += f"  x{ratio:.2f}" + ("  РЕГРЕССИЯ" if ratio > REGRESSION else "")
+    print(line, flush=True)
+
+
+def parse_sizes(text: str) -> List[int]:
+    return [int(x.replace("_", "")) for x in text.split(",") if x.strip()]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Бенчмарк обработчиков botAdmin.py")
+    parser.add_argument("--recipes", type=parse_sizes, help="размеры каталога через запятую")
+    parser.add_argument("--users", type=parse_sizes, help="размеры базы пользователей через запятую")
+    parser.add_argument("--full", action="store_true", help="включить 1M рецептов и 1M пользователей")
+    parser.add_argument("--only", help="только эти сценарии (через запятую): " + ", ".join(SCENARIOS))
+    parser.add_argument("--iterations", type=int, default=ITERATIONS)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", metavar="PATH", help="сохранить результаты как baseline")
+    parser.add_argument("--compare", metavar="PATH", help="сравнить с сохранённым baseline")
+    parser.add_argument("--check-fuzzy", type=int, metavar="N",
+                        help="сверить нечёткий поиск с перебором словаря на N запросах с опечаткой и выйти")
+    args = parser.parse_args()
+
+    if args.check_fuzzy:
+        sys.exit(0 if check_fuzzy(args.check_fuzzy, args.seed) else 1)
+
+    recipe_sizes = args.recipes or (FULL_RECIPES if args.full else DEFAULT_RECIPES)
+    user_sizes = args.users or (FULL_USERS if args.full else DEFAULT_USERS)
+    scenarios = args.only.split(",") if args.only else list(SCENARIOS)
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"неизвестные сценарии: {', '.join(sorted(unknown))}")
+
+    results: Dict[str, dict] = {}
+    for n_recipes in recipe_sizes:
+        results.update(asyncio.run(run_catalog(n_recipes, user_sizes, scenarios, args.iterations, args.seed)))
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        print(f"\nсравнение с {args.compare}:")
+        regressions = 0
+        for key, row in results.items():
+            if key in baseline:
+                print_row(key, row, baseline[key])
+                regressions += row["p50_us"] > baseline[key]["p50_us"] * REGRESSION
+        if regressions:
+            print(f"регрессий: {regressions}")
+            sys.exit(1)
+
+    if args.save:
+        botAdmin.atomic_write_json(args.save, {
+            "python": sys.version.split()[0],
+            "iterations": args.iterations,
+            "seed": args.seed,
+            "results": results,
+        }, indent=2)
+
+
+if __name__ == "__main__":
+    main()
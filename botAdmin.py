@@ -1,548 +1,4274 @@
-import os
-import json
-import random
-from dataclasses import dataclass, asdict
-from typing import List, Optional, Tuple
-
-from telegram import (
-    Update,
-    ReplyKeyboardMarkup,
-    ReplyKeyboardRemove,
-    InlineKeyboardMarkup,
-    InlineKeyboardButton,
-)
-from telegram.ext import (
-    Application,
-    CommandHandler,
-    MessageHandler,
-    ConversationHandler,
-    CallbackQueryHandler,
-    ContextTypes,
-    PicklePersistence,
-    filters,
-)
-
-DATA_FILE = "recipes.json"
-PERSISTENCE_FILE = "bot_data_persistence.pkl"
-
-# ВАЖНО: поставь сюда свой user_id (можно узнать командой /myid)
-ADMIN_ID = 1224613559
-
-MAIN_KB = ReplyKeyboardMarkup(
-    [["📚 Каталог", "🍲 Случайный рецепт", "🔎 Поиск"],
-     ["➕ Добавить рецепт", "⭐ Избранное"]],
-    resize_keyboard=True,
-)
-
-ADD_TITLE, ADD_INGR, ADD_STEPS, ADD_PHOTO = range(4)
-
-# callback_data (короткие префиксы)
-CB_FAV_ADD = "fa:"          # fa:<rid>
-CB_FAV_DEL = "fd:"          # fd:<rid>
-
-CB_CAT_PAGE = "cp:"         # cp:<page>
-CB_CAT_SHOW = "cs:"         # cs:<rid>
-
-CB_FAV_SHOW_PAGE = "fp:"    # fp:<page>
-CB_FAV_SHOW_ITEM = "fs:"    # fs:<rid>
-
-CB_DEL_ASK = "da:"          # da:<rid> запрос подтверждения
-CB_DEL_OK = "do:"           # do:<rid> подтверждение
-CB_DEL_NO = "dn:"           # dn:<rid> отмена
-
-CAT_PAGE_SIZE = 5
-FAV_PAGE_SIZE = 5
-
-
-@dataclass
-class Recipe:
-    id: int
-    title: str
-    ingredients: List[str]
-    steps: str
-    photo_file_id: Optional[str] = None
-
-
-def load_recipes() -> List[Recipe]:
-    if not os.path.exists(DATA_FILE):
-        return [
-            Recipe(
-                id=1,
-                title="Омлет",
-                ingredients=["Яйца (2 шт.)", "Молоко (50 мл)", "Соль", "Масло"],
-                steps="Взбей яйца с молоком и солью. Обжарь на сковороде 3–5 минут.",
-            ),
-            Recipe(
-                id=2,
-                title="Овсянка",
-                ingredients=["Овсяные хлопья (50 г)", "Вода/молоко (200 мл)", "Соль/сахар"],
-                steps="Доведи жидкость до кипения, всыпь хлопья и вари 3–5 минут.",
-            ),
-            Recipe(
-                id=3,
-                title="Гречка",
-                ingredients=["Гречка (1 стакан)", "Вода (2 стакана)", "Соль", "Масло (по желанию)"],
-                steps="Промой гречку. Залей водой, посоли, доведи до кипения и вари под крышкой 15–20 минут.",
-            ),
-            Recipe(
-                id=4,
-                title="Макароны с сыром",
-                ingredients=["Макароны (150 г)", "Сыр (50–80 г)", "Соль", "Масло (по желанию)"],
-                steps="Отвари макароны в подсоленной воде. Слей воду, добавь сыр, перемешай до расплавления.",
-            ),
-            Recipe(
-                id=5,
-                title="Салат из огурцов и помидоров",
-                ingredients=["Огурец (1–2 шт.)", "Помидор (1–2 шт.)", "Лук (по желанию)", "Соль", "Масло/сметана"],
-                steps="Нарежь овощи, посоли, заправь маслом или сметаной, перемешай.",
-            ),
-            Recipe(
-                id=6,
-                title="Картофельное пюре",
-                ingredients=["Картофель (500 г)", "Молоко (100 мл)", "Масло (30 г)", "Соль"],
-                steps="Отвари картофель до мягкости, слей воду. Разомни, добавь масло и горячее молоко, посоли.",
-            ),
-            Recipe(
-                id=7,
-                title="Курица на сковороде",
-                ingredients=["Куриное филе (300 г)", "Соль", "Перец", "Масло"],
-                steps="Нарежь филе, посоли/поперчи. Обжарь 8–12 минут до готовности.",
-            ),
-            Recipe(
-                id=8,
-                title="Рис с овощами",
-                ingredients=["Рис (1 стакан)", "Овощи замороженные (200 г)", "Соль", "Масло/соевый соус (по желанию)"],
-                steps="Отвари рис. Прогрей овощи 5–7 минут, смешай, посоли.",
-            ),
-            Recipe(
-                id=9,
-                title="Сырники (простые)",
-                ingredients=["Творог (300 г)", "Яйцо (1 шт.)", "Сахар (1–2 ст. л.)", "Мука (3–4 ст. л.)", "Масло"],
-                steps="Смешай всё, сформируй сырники и обжарь по 2–3 минуты с каждой стороны.",
-            ),
-            Recipe(
-                id=10,
-                title="Блины (базовые)",
-                ingredients=["Молоко (500 мл)", "Яйца (2 шт.)", "Мука (200–250 г)", "Сахар (1 ст. л.)", "Соль", "Масло"],
-                steps="Смешай, добавь муку, жарь тонкие блины на смазанной сковороде.",
-            ),
-        ]
-
-    with open(DATA_FILE, "r", encoding="utf-8") as f:
-        raw = json.load(f)
-
-    recipes: List[Recipe] = []
-    for item in raw:
-        recipes.append(
-            Recipe(
-                id=int(item.get("id", 0)),
-                title=item.get("title", ""),
-                ingredients=item.get("ingredients", []),
-                steps=item.get("steps", ""),
-                photo_file_id=item.get("photo_file_id"),
-            )
-        )
-
-    # совместимость со старым файлом без id
-    if any(r.id == 0 for r in recipes):
-        for i, r in enumerate(recipes, start=1):
-            r.id = i
-        save_recipes(recipes)
-
-    return recipes
-
-
-def save_recipes(recipes: List[Recipe]) -> None:
-    with open(DATA_FILE, "w", encoding="utf-8") as f:
-        json.dump([asdict(r) for r in recipes], f, ensure_ascii=False, indent=2)
-
-
-def next_recipe_id(recipes: List[Recipe]) -> int:
-    return max((r.id for r in recipes), default=0) + 1
-
-
-def ensure_favs(context: ContextTypes.DEFAULT_TYPE) -> List[int]:
-    favs = context.user_data.get("favs")
-    if not isinstance(favs, list):
-        context.user_data["favs"] = []
-    return context.user_data["favs"]
-
-
-def find_recipe_by_id(recipes: List[Recipe], rid: int) -> Optional[Recipe]:
-    for r in recipes:
-        if r.id == rid:
-            return r
-    return None
-
-
-def format_recipe(r: Recipe) -> str:
-    ingr = "\n".join(f"• {x}" for x in r.ingredients)
-    return f"🍽 {r.title}\n\n🧾 Ингредиенты:\n{ingr}\n\n👩‍🍳 Шаги:\n{r.steps}"
-
-
-def paginate(items: List[Recipe], page: int, page_size: int) -> Tuple[List[Recipe], int, int]:
-    if page < 1:
-        page = 1
-    total_pages = max(1, (len(items) + page_size - 1) // page_size)
-    if page > total_pages:
-        page = total_pages
-    start = (page - 1) * page_size
-    end = start + page_size
-    return items[start:end], total_pages, page
-
-
-def recipe_actions_keyboard(recipe_id: int, is_fav: bool, is_admin: bool) -> InlineKeyboardMarkup:
-    fav_btn = (
-        InlineKeyboardButton("❌ Убрать из избранного", callback_data=f"{CB_FAV_DEL}{recipe_id}")
-        if is_fav
-        else InlineKeyboardButton("⭐ В избранное", callback_data=f"{CB_FAV_ADD}{recipe_id}")
-    )
-
-    rows = [[fav_btn]]
-
-    if is_admin:
-        rows.append([InlineKeyboardButton("🗑 Удалить рецепт", callback_data=f"{CB_DEL_ASK}{recipe_id}")])
-
-    rows.append([
-        InlineKeyboardButton("📚 Каталог", callback_data=f"{CB_CAT_PAGE}1"),
-        InlineKeyboardButton("⭐ Избранное", callback_data=f"{CB_FAV_SHOW_PAGE}1"),
-    ])
-    return InlineKeyboardMarkup(rows)
-
-
-def catalog_keyboard(recipes: List[Recipe], page: int) -> InlineKeyboardMarkup:
-    page_items, total_pages, page = paginate(recipes, page, CAT_PAGE_SIZE)
-
-    rows = []
-    for r in page_items:
-        rows.append([InlineKeyboardButton(r.title, callback_data=f"{CB_CAT_SHOW}{r.id}")])
-
-    nav = []
-    if page > 1:
-        nav.append(InlineKeyboardButton("⬅️", callback_data=f"{CB_CAT_PAGE}{page-1}"))
-    nav.append(InlineKeyboardButton(f"{page}/{total_pages}", callback_data="noop"))
-    if page < total_pages:
-        nav.append(InlineKeyboardButton("➡️", callback_data=f"{CB_CAT_PAGE}{page+1}"))
-    rows.append(nav)
-
-    return InlineKeyboardMarkup(rows)
-
-
-def favs_keyboard(recipes: List[Recipe], fav_ids: List[int], page: int) -> InlineKeyboardMarkup:
-    fav_set = set(fav_ids)
-    fav_recipes = [r for r in recipes if r.id in fav_set]
-
-    page_items, total_pages, page = paginate(fav_recipes, page, FAV_PAGE_SIZE)
-
-    rows = []
-    for r in page_items:
-        rows.append([InlineKeyboardButton(r.title, callback_data=f"{CB_FAV_SHOW_ITEM}{r.id}")])
-
-    nav = []
-    if page > 1:
-        nav.append(InlineKeyboardButton("⬅️", callback_data=f"{CB_FAV_SHOW_PAGE}{page-1}"))
-    nav.append(InlineKeyboardButton(f"{page}/{total_pages}", callback_data="noop"))
-    if page < total_pages:
-        nav.append(InlineKeyboardButton("➡️", callback_data=f"{CB_FAV_SHOW_PAGE}{page+1}"))
-    rows.append(nav)
-
-    rows.append([InlineKeyboardButton("📚 Каталог", callback_data=f"{CB_CAT_PAGE}1")])
-    return InlineKeyboardMarkup(rows)
-
-
-async def send_recipe_message(chat_id: int, context: ContextTypes.DEFAULT_TYPE, r: Recipe, is_admin: bool) -> None:
-    favs = ensure_favs(context)
-    kb = recipe_actions_keyboard(r.id, is_fav=(r.id in favs), is_admin=is_admin)
-    text = format_recipe(r)
-
-    # Фото отдельно, текст отдельно (из-за лимита caption у медиа) [web:9]
-    if r.photo_file_id:
-        await context.bot.send_photo(chat_id=chat_id, photo=r.photo_file_id)
-    await context.bot.send_message(chat_id=chat_id, text=text, reply_markup=kb)
-
-
-# ---- handlers ----
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    context.application.bot_data["recipes"] = load_recipes()
-    ensure_favs(context)
-    await update.message.reply_text("Привет! Выбирай действие 👇", reply_markup=MAIN_KB)
-
-
-async def myid(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    await update.message.reply_text(f"Ваш user_id: {update.effective_user.id}")
-
-
-async def random_recipe(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    recipes: List[Recipe] = context.application.bot_data.get("recipes", load_recipes())
-    r = random.choice(recipes)
-    await send_recipe_message(update.effective_chat.id, context, r, is_admin=(update.effective_user.id == ADMIN_ID))
-    await update.message.reply_text("Что дальше?", reply_markup=MAIN_KB)
-
-
-async def show_catalog(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    recipes: List[Recipe] = context.application.bot_data.get("recipes", load_recipes())
-    await update.message.reply_text(
-        "📚 Каталог рецептов: выбери рецепт или листай страницы.",
-        reply_markup=catalog_keyboard(recipes, page=1),
-    )
-
-
-async def show_favs(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    recipes: List[Recipe] = context.application.bot_data.get("recipes", load_recipes())
-    favs = ensure_favs(context)
-    if not favs:
-        await update.message.reply_text("Избранное пустое. Добавь рецепт кнопкой ⭐.", reply_markup=MAIN_KB)
-        return
-    await update.message.reply_text("⭐ Избранное:", reply_markup=favs_keyboard(recipes, favs, page=1))
-
-
-async def search_hint(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    await update.message.reply_text(
-        "Напиши запрос: название или ингредиент (например: 'курица' или 'омлет').",
-        reply_markup=ReplyKeyboardRemove(),
-    )
-
-
-async def search_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    q = (update.message.text or "").strip().lower()
-    recipes: List[Recipe] = context.application.bot_data.get("recipes", load_recipes())
-
-    hits: List[Recipe] = []
-    for r in recipes:
-        if q in r.title.lower() or any(q in ing.lower() for ing in r.ingredients):
-            hits.append(r)
-
-    if not hits:
-        await update.message.reply_text("Ничего не нашлось. Попробуй другой запрос.", reply_markup=MAIN_KB)
-        return
-
-    await send_recipe_message(update.effective_chat.id, context, hits[0], is_admin=(update.effective_user.id == ADMIN_ID))
-    await update.message.reply_text(f"Нашлось: {len(hits)}. Открой 📚 Каталог, чтобы выбрать другие.", reply_markup=MAIN_KB)
-
-
-# ---- add recipe conversation ----
-async def add_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    await update.message.reply_text("Название рецепта?", reply_markup=ReplyKeyboardRemove())
-    return ADD_TITLE
-
-
-async def add_title(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    context.user_data["new_recipe_title"] = (update.message.text or "").strip()
-    await update.message.reply_text("Ингредиенты через запятую:")
-    return ADD_INGR
-
-
-async def add_ingredients(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    text = (update.message.text or "").strip()
-    context.user_data["new_recipe_ingredients"] = [x.strip() for x in text.split(",") if x.strip()]
-    await update.message.reply_text("Шаги приготовления (текстом):")
-    return ADD_STEPS
-
-
-async def add_steps(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    context.user_data["new_recipe_steps"] = (update.message.text or "").strip()
-    await update.message.reply_text("Пришли фото блюда (или напиши '-' чтобы пропустить):")
-    return ADD_PHOTO
-
-
-async def add_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    title = context.user_data.get("new_recipe_title", "").strip()
-    ingredients = context.user_data.get("new_recipe_ingredients", [])
-    steps = context.user_data.get("new_recipe_steps", "").strip()
-
-    if not title or not ingredients or not steps:
-        await update.message.reply_text("Не хватает данных. Начни заново: /start", reply_markup=MAIN_KB)
-        return ConversationHandler.END
-
-    photo_file_id = None
-    if update.message.photo:
-        photo_file_id = update.message.photo[-1].file_id
-    else:
-        text = (update.message.text or "").strip()
-        if text != "-":
-            await update.message.reply_text("Пришли именно фото, или '-' чтобы пропустить.")
-            return ADD_PHOTO
-
-    recipes: List[Recipe] = context.application.bot_data.get("recipes", load_recipes())
-    rid = next_recipe_id(recipes)
-    recipes.append(Recipe(id=rid, title=title, ingredients=ingredients, steps=steps, photo_file_id=photo_file_id))
-    context.application.bot_data["recipes"] = recipes
-    save_recipes(recipes)
-
-    await update.message.reply_text("Рецепт добавлен ✅", reply_markup=MAIN_KB)
-    return ConversationHandler.END
-
-
-async def add_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    await update.message.reply_text("Отменено.", reply_markup=MAIN_KB)
-    return ConversationHandler.END
-
-
-# ---- callbacks ----
-async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    query = update.callback_query
-    await query.answer()
-
-    data = query.data or ""
-    chat_id = query.message.chat_id if query.message else None
-    if chat_id is None:
-        return
-
-    recipes: List[Recipe] = context.application.bot_data.get("recipes", load_recipes())
-    favs = ensure_favs(context)
-
-    if data == "noop":
-        return
-
-    # ---- Каталог ----
-    if data.startswith(CB_CAT_PAGE):
-        page = int(data.replace(CB_CAT_PAGE, "") or "1")
-        await query.edit_message_text(
-            text="📚 Каталог рецептов: выбери рецепт или листай страницы.",
-            reply_markup=catalog_keyboard(recipes, page=page),
-        )
-        return
-
-    if data.startswith(CB_CAT_SHOW):
-        rid = int(data.replace(CB_CAT_SHOW, ""))
-        r = find_recipe_by_id(recipes, rid)
-        if r:
-            await send_recipe_message(chat_id, context, r, is_admin=(query.from_user.id == ADMIN_ID))
-        else:
-            await context.bot.send_message(chat_id=chat_id, text="Рецепт не найден (возможно удалён).")
-        return
-
-    # ---- Избранное ----
-    if data.startswith(CB_FAV_SHOW_PAGE):
-        page = int(data.replace(CB_FAV_SHOW_PAGE, "") or "1")
-        if not favs:
-            await context.bot.send_message(chat_id=chat_id, text="Избранное пустое.")
-            return
-        await query.edit_message_text(text="⭐ Избранное:", reply_markup=favs_keyboard(recipes, favs, page=page))
-        return
-
-    if data.startswith(CB_FAV_SHOW_ITEM):
-        rid = int(data.replace(CB_FAV_SHOW_ITEM, ""))
-        r = find_recipe_by_id(recipes, rid)
-        if r:
-            await send_recipe_message(chat_id, context, r, is_admin=(query.from_user.id == ADMIN_ID))
-        else:
-            await context.bot.send_message(chat_id=chat_id, text="Рецепт не найден (возможно удалён).")
-        return
-
-    # ---- Добавить/убрать избранное ----
-    if data.startswith(CB_FAV_ADD):
-        rid = int(data.replace(CB_FAV_ADD, ""))
-        if rid not in favs:
-            favs.append(rid)
-        await context.bot.send_message(chat_id=chat_id, text="Добавлено в избранное ⭐")
-        return
-
-    if data.startswith(CB_FAV_DEL):
-        rid = int(data.replace(CB_FAV_DEL, ""))
-        if rid in favs:
-            favs.remove(rid)
-        await context.bot.send_message(chat_id=chat_id, text="Убрано из избранного ❌")
-        return
-
-    # ---- Удаление (только админ) ----
-    if data.startswith(CB_DEL_ASK):
-        if query.from_user.id != ADMIN_ID:
-            await context.bot.send_message(chat_id=chat_id, text="Нет прав (только админ).")
-            return
-
-        rid = int(data.replace(CB_DEL_ASK, ""))
-        r = find_recipe_by_id(recipes, rid)
-        if not r:
-            await context.bot.send_message(chat_id=chat_id, text="Рецепт уже удалён.")
-            return
-
-        confirm_kb = InlineKeyboardMarkup([
-            [
-                InlineKeyboardButton("✅ Да, удалить", callback_data=f"{CB_DEL_OK}{rid}"),
-                InlineKeyboardButton("❌ Отмена", callback_data=f"{CB_DEL_NO}{rid}"),
-            ]
-        ])
-        await context.bot.send_message(chat_id=chat_id, text=f"Удалить рецепт «{r.title}»?", reply_markup=confirm_kb)
-        return
-
-    if data.startswith(CB_DEL_NO):
-        await context.bot.send_message(chat_id=chat_id, text="Ок, не удаляю.")
-        return
-
-    if data.startswith(CB_DEL_OK):
-        if query.from_user.id != ADMIN_ID:
-            await context.bot.send_message(chat_id=chat_id, text="Нет прав (только админ).")
-            return
-
-        rid = int(data.replace(CB_DEL_OK, ""))
-        r = find_recipe_by_id(recipes, rid)
-        if not r:
-            await context.bot.send_message(chat_id=chat_id, text="Рецепт уже удалён.")
-            return
-
-        # Удаляем рецепт и сохраняем
-        recipes = [x for x in recipes if x.id != rid]
-        context.application.bot_data["recipes"] = recipes
-        save_recipes(recipes)
-
-        # Вычищаем из избранного у всех пользователей (user_data хранится persistence)
-        for _uid, udata in context.application.user_data.items():
-            uf = udata.get("favs")
-            if isinstance(uf, list) and rid in uf:
-                uf[:] = [x for x in uf if x != rid]
-
-        await context.bot.send_message(chat_id=chat_id, text=f"Удалено ✅: {r.title}")
-        return
-
-
-async def unknown(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    await update.message.reply_text("Не понял. Нажми кнопку или /start.", reply_markup=MAIN_KB)
-
-
-def main() -> None:
-    token = os.environ.get("8282470852:AAGrIZ0tO9fRrLlocqO50EF-unbHoJ4taC4") or "8282470852:AAGrIZ0tO9fRrLlocqO50EF-unbHoJ4taC4"
-
-    persistence = PicklePersistence(filepath=PERSISTENCE_FILE)
-    app = Application.builder().token(token).persistence(persistence).build()
-
-    add_conv = ConversationHandler(
-        entry_points=[MessageHandler(filters.Regex("^➕ Добавить рецепт$"), add_start)],
-        states={
-            ADD_TITLE: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_title)],
-            ADD_INGR: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_ingredients)],
-            ADD_STEPS: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_steps)],
-            ADD_PHOTO: [
-                MessageHandler(filters.PHOTO, add_photo),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, add_photo),
-            ],
-        },
-        fallbacks=[CommandHandler("cancel", add_cancel)],
-    )
-
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("myid", myid))
-
-    app.add_handler(MessageHandler(filters.Regex("^📚 Каталог$"), show_catalog))
-    app.add_handler(CommandHandler("catalog", show_catalog))
-
-    app.add_handler(MessageHandler(filters.Regex("^🍲 Случайный рецепт$"), random_recipe))
-    app.add_handler(CommandHandler("random", random_recipe))
-
-    app.add_handler(MessageHandler(filters.Regex("^⭐ Избранное$"), show_favs))
-    app.add_handler(CommandHandler("favs", show_favs))
-
-    app.add_handler(MessageHandler(filters.Regex("^🔎 Поиск$"), search_hint))
-    app.add_handler(add_conv)
-
-    app.add_handler(CallbackQueryHandler(on_callback))
-
-    # Поиск по любому тексту
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, search_text))
-    app.add_handler(MessageHandler(filters.COMMAND, unknown))
-
-    app.run_polling()
-
-
-if __name__ == "__main__":
-    main()
+import os
+import re
+import sys
+import json
+import time
+import random
+import bisect
+import copy
+import heapq
+import math
+import mmap
+import zlib
+import struct
+import marshal
+import itertools
+import pickle
+import signal
+import sqlite3
+import tempfile
+import asyncio
+import logging
+import functools
+import threading
+from array import array
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from contextvars import ContextVar
+from urllib.parse import urlparse
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Dict, Iterator, List, Optional, Set, Tuple, TypeVar
+
+# отсчёт для отчёта о старте (StartupReport): дальше самое дорогое — импорт telegram
+STARTED_AT = time.perf_counter()
+
+from telegram import (
+    Bot,
+    Update,
+    ReplyKeyboardMarkup,
+    ReplyKeyboardRemove,
+    InlineKeyboardMarkup,
+    InlineKeyboardButton,
+    InlineQueryResultArticle,
+    InlineQueryResultCachedPhoto,
+    InputTextMessageContent,
+)
+from telegram.constants import FileSizeLimit, MessageLimit
+from telegram.error import BadRequest, RetryAfter
+from telegram.ext import (
+    Application,
+    BaseRateLimiter,
+    CommandHandler,
+    MessageHandler,
+    ConversationHandler,
+    CallbackQueryHandler,
+    InlineQueryHandler,
+    ContextTypes,
+    BasePersistence,
+    BaseUpdateProcessor,
+    PersistenceInput,
+    TypeHandler,
+    filters,
+)
+
+DATA_FILE = "recipes.json"
+META_FILE = "recipes_meta.json"  # счётчик id, чтобы id удалённых рецептов не выдавались повторно
+PERSISTENCE_FILE = "bot_data_persistence.pkl"   # старый формат (PicklePersistence), импортируется при первом старте
+STATE_FILE = "bot_state.db"                     # user_data/chat_data/bot_data — по строке на пользователя/чат
+
+# режим хранения рецептов: "json" — весь recipes.json целиком, "journal" — снимок + журнал изменений,
+# "sqlite" — база recipes.db (рецепты и избранное; перенести старые данные: python botAdmin.py migrate-sqlite)
+STORAGE_MODE = os.environ.get("RECIPES_STORAGE", "json")
+SQLITE_FILE = "recipes.db"
+SNAPSHOT_FILE = "recipes.snapshot.json"
+JOURNAL_FILE = "recipes.journal"
+# журнал сворачивается в новый снимок, когда разрастается больше любого из порогов
+JOURNAL_MAX_ENTRIES = 1000
+JOURNAL_MAX_BYTES = 1024 * 1024
+# импорт: файл читается кусками, в памяти — кусок и одна запись (запись больше лимита — ошибка файла)
+IMPORT_CHUNK = 64 * 1024
+IMPORT_MAX_RECORD = 1024 * 1024
+IMPORT_MAX_ERRORS = 10   # сколько проблемных записей перечислять в отчёте
+
+# Кэш холодного старта (по желанию): путь к бинарному файлу с каталогом и готовыми индексами;
+# пусто — выключен. Пересобирается отдельным процессом через STARTUP_CACHE_DELAY секунд
+# после последнего изменения каталога.
+STARTUP_CACHE = os.environ.get("STARTUP_CACHE", "")
+STARTUP_CACHE_DELAY = 60.0
+STARTUP_CACHE_EAGER = 256      # словарь индекса меньше этого читается из кэша целиком, больший — по ключу
+STARTUP_CACHE_LOCK_TTL = 600   # замок сборки старше этого считаем брошенным упавшим процессом
+# отчёт о старте: версия бота для сравнения релизов и файл, куда дописывать строку JSON на каждый старт
+BOT_VERSION = os.environ.get("BOT_VERSION", "")
+STARTUP_LOG = os.environ.get("STARTUP_LOG", "")
+
+# сколько последних изменений каталога помнит recipes.db для других процессов;
+# кто отстал сильнее — перечитывает каталог целиком
+CHANGES_KEEP = 1000
+
+# ВАЖНО: поставь сюда свой user_id (можно узнать командой /myid)
+ADMIN_ID = 1224613559
+
+# как получать апдейты: "polling" (по умолчанию) или "webhook" (нужен пакет python-telegram-bot[webhooks])
+BOT_MODE = os.environ.get("BOT_MODE", "polling")
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")                 # публичный https-адрес, на который шлёт Telegram
+WEBHOOK_LISTEN = os.environ.get("WEBHOOK_LISTEN", "127.0.0.1")  # локальный HTTP-сервер (за reverse proxy)
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8443"))
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET")               # сверяется с X-Telegram-Bot-Api-Secret-Token
+# сколько апдейтов обрабатывать одновременно (апдейты одного пользователя всё равно идут по очереди)
+UPDATE_WORKERS = int(os.environ.get("UPDATE_WORKERS", "16"))
+
+# Несколько процессов (python botAdmin.py front): front принимает webhook и раздаёт апдейты
+# BOT_WORKERS воркерам через unix-сокеты в WORKER_SOCKET_DIR. Работает только с RECIPES_STORAGE=sqlite.
+BOT_WORKERS = int(os.environ.get("BOT_WORKERS", str(os.cpu_count() or 2)))
+WORKER_SOCKET_DIR = os.environ.get("WORKER_SOCKET_DIR", "workers")
+# front отвечает Telegram'у 200, только когда воркер обработал апдейт; не дождались — 503, и Telegram повторит
+WORKER_ACK_TIMEOUT = 30.0
+MAX_HTTP_BODY = 1 << 20   # апдейты Telegram — единицы КиБ; больше не читаем, отвечаем 413
+
+# лимиты Telegram на исходящие сообщения: ~30/сек на бота, ~1/сек в личный чат, ~20/мин в группу
+GLOBAL_SEND_RATE = 30.0
+CHAT_SEND_RATE = 1.0
+CHAT_SEND_BURST = 3
+GROUP_SEND_RATE = 20 / 60
+SEND_MAX_RETRIES = 3
+
+# Метрики (по умолчанию выключены — тогда обработчики и хранилище ничем не обёрнуты):
+# METRICS_PORT — отдавать /metrics в формате Prometheus на METRICS_LISTEN:METRICS_PORT
+# (воркер номер i — на METRICS_PORT + i); SLOW_UPDATE_MS — писать в лог апдейты дольше порога
+# с разбивкой по фазам.
+METRICS_LISTEN = os.environ.get("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+SLOW_UPDATE_MS = float(os.environ.get("SLOW_UPDATE_MS", "0"))
+METRICS_ENABLED = bool(METRICS_PORT or SLOW_UPDATE_MS)
+
+MAIN_KB = ReplyKeyboardMarkup(
+    [["📚 Каталог", "🍲 Случайный рецепт", "🔎 Поиск"],
+     ["➕ Добавить рецепт", "⭐ Избранное", "🧺 Что приготовить?"]],
+    resize_keyboard=True,
+)
+
+ADD_TITLE, ADD_INGR, ADD_STEPS, ADD_PHOTO = range(4)
+COOK_ITEMS = 4
+
+# callback_data (короткие префиксы)
+CB_FAV_ADD = "fa:"          # fa:<rid>
+CB_FAV_DEL = "fd:"          # fd:<rid>
+
+CB_CAT_PAGE = "cp:"         # cp:<page>; с recipes.db — cp:<page>><id> / cp:<page><<id> (страница после/до id)
+CB_CAT_SHOW = "cs:"         # cs:<rid>
+
+CB_FAV_SHOW_PAGE = "fp:"    # fp:<page>
+CB_FAV_SHOW_ITEM = "fs:"    # fs:<rid>
+
+CB_DEL_ASK = "da:"          # da:<rid> запрос подтверждения
+CB_DEL_OK = "do:"           # do:<rid> подтверждение
+CB_DEL_NO = "dn:"           # dn:<rid> отмена
+
+CB_SEARCH_PAGE = "sp:"      # sp:<page> (сам запрос лежит в user_data["search_q"])
+
+CB_SIMILAR = "sm:"          # sm:<rid> похожие рецепты
+
+CALLBACK_PREFIXES = (
+    CB_FAV_ADD, CB_FAV_DEL, CB_CAT_PAGE, CB_CAT_SHOW, CB_FAV_SHOW_PAGE, CB_FAV_SHOW_ITEM,
+    CB_DEL_ASK, CB_DEL_OK, CB_DEL_NO, CB_SEARCH_PAGE, CB_SIMILAR,
+)
+
+CAT_PAGE_SIZE = 5
+FAV_PAGE_SIZE = 5
+SEARCH_PAGE_SIZE = 5
+
+# сколько готовых текстов/клавиатур держать в памяти
+RENDER_CACHE_SIZE = 2048
+
+# inline-режим (@bot запрос): результатов на порцию (Telegram принимает до 50),
+# сколько секунд ответ кэширует Telegram и сколько — сам бот (запрос приходит на каждую букву)
+INLINE_PAGE_SIZE = 20
+INLINE_MAX_RESULTS = 500   # дальше по короткому запросу всё равно не листают, а список id держим в кэше
+INLINE_CACHE_TIME = 30
+INLINE_CACHE_TTL = 30.0
+INLINE_CACHE_SIZE = 1024
+
+# как часто (сек) проверять, не поменяли ли recipes.json на диске руками
+RELOAD_CHECK_INTERVAL = 2.0
+# изменения каталога копятся столько секунд и пишутся на диск одной записью
+SAVE_DEBOUNCE = 1.0
+# ошибки записи, после которых изменения остаются в очереди и пишутся при следующей попытке
+# (sqlite3.Error — например, база занята другим процессом дольше таймаута)
+STORAGE_ERRORS = (OSError, sqlite3.Error)
+
+logger = logging.getLogger(__name__)
+
+
+# ---- metrics ----
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# фазы текущего апдейта: (название, секунды); None — апдейт не трассируется
+_TRACE: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("trace", default=None)
+
+
+def trace_phase(name: str, seconds: float) -> None:
+    trace = _TRACE.get()
+    if trace is not None:
+        trace.append((name, seconds))
+
+
+def _label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: tuple, extra: str = "") -> str:
+    parts = [f'{k}="{_label_value(v)}"' for k, v in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Metrics:
+    # Счётчики и гистограммы в памяти процесса, render() — текстовый формат Prometheus.
+    # Метки — кортеж пар (имя, значение), чтобы быть ключом словаря.
+    # Гистограмма — список: счётчик на каждый бакет LATENCY_BUCKETS, потом +Inf, последним — сумма.
+    def __init__(self):
+        self._meta: Dict[str, Tuple[str, str]] = {}   # имя -> (тип, описание)
+        self._counters: Dict[Tuple[str, tuple], float] = {}
+        self._histograms: Dict[Tuple[str, tuple], list] = {}
+        self._collectors: list = []
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    def describe(self, name: str, kind: str, text: str) -> None:
+        self._meta[name] = (kind, text)
+
+    def collect(self, fn) -> None:
+        # fn() -> [(имя, метки, значение)] — значения, которые и так где-то считаются (кэш, размер каталога)
+        self._collectors.append(fn)
+
+    def inc(self, name: str, labels: tuple = (), value: float = 1.0) -> None:
+        key = (name, labels)
+        self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name: str, labels: tuple, seconds: float, phase: Optional[str] = None) -> None:
+        h = self._histograms.get((name, labels))
+        if h is None:
+            h = self._histograms[(name, labels)] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+        h[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        h[-1] += seconds
+        if phase:
+            trace_phase(phase, seconds)
+
+    def render(self) -> str:
+        series: Dict[str, List[str]] = {}
+        for (name, labels), value in list(self._counters.items()):
+            series.setdefault(name, []).append(f"{name}{_labels(labels)} {value:g}")
+        for fn in self._collectors:
+            for name, labels, value in fn():
+                series.setdefault(name, []).append(f"{name}{_labels(labels)} {value:g}")
+        for (name, labels), h in list(self._histograms.items()):
+            lines = series.setdefault(name, [])
+            total = 0
+            for bound, count in zip(LATENCY_BUCKETS + (float("inf"),), h):
+                total += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                le_label = f'le="{le}"'
+                lines.append(f"{name}_bucket{_labels(labels, le_label)} {total}")
+            lines.append(f"{name}_sum{_labels(labels)} {h[-1]:.6f}")
+            lines.append(f"{name}_count{_labels(labels)} {total}")
+        out = []
+        for name in sorted(series):
+            kind, text = self._meta.get(name, ("untyped", ""))
+            out.append(f"# HELP {name} {text}")
+            out.append(f"# TYPE {name} {kind}")
+            out.extend(series[name])
+        return "\n".join(out) + "\n"
+
+    async def _handle(self, method: str, target: str, headers: Dict[str, str], body: bytes) -> Tuple[str, bytes]:
+        if method == "GET" and urlparse(target).path == "/metrics":
+            return "200 OK", self.render().encode("utf-8")
+        return "404 Not Found", b""
+
+    async def start_server(self, host: str, port: int) -> None:
+        self.server = await asyncio.start_server(
+            lambda reader, writer: serve_http(reader, writer, self._handle, "text/plain; version=0.0.4; charset=utf-8"),
+            host, port,
+        )
+
+    def stop_server(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+
+
+METRICS = Metrics()
+METRICS.describe("bot_update_seconds", "histogram", "Время обработки апдейта целиком, включая ожидание очереди")
+METRICS.describe("bot_handler_seconds", "histogram", "Время обработчика (для кнопок — по префиксу callback_data)")
+METRICS.describe("bot_storage_seconds", "histogram", "Время операций хранилища, поиска и persistence")
+METRICS.describe("bot_api_seconds", "histogram", "Время вызовов Bot API без ожидания лимитов")
+METRICS.describe("bot_api_calls_total", "counter", "Вызовы Bot API по методу и результату")
+METRICS.describe("bot_send_wait_seconds", "histogram", "Ожидание лимита перед отправкой")
+METRICS.describe("bot_cache_requests_total", "counter", "Обращения к кэшу отрисовки")
+METRICS.describe("bot_recipes", "gauge", "Рецептов в каталоге")
+
+
+def timed(op: str):
+    # время операции -> bot_storage_seconds{op}; без метрик функция возвращается как есть
+    def wrap(fn):
+        if not METRICS_ENABLED:
+            return fn
+        labels = (("op", op),)
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    METRICS.observe("bot_storage_seconds", labels, time.perf_counter() - started, op)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                METRICS.observe("bot_storage_seconds", labels, time.perf_counter() - started, op)
+        return wrapper
+    return wrap
+
+
+def callback_prefix(update: object) -> str:
+    query = update.callback_query if isinstance(update, Update) else None
+    if query is None:
+        return ""
+    data = query.data or ""
+    for prefix in CALLBACK_PREFIXES:
+        if data.startswith(prefix):
+            return prefix
+    return "noop" if data == "noop" else "other"
+
+
+def instrumented(fn):
+    # обработчик -> bot_handler_seconds{handler, callback}; без метрик не оборачивается
+    if not METRICS_ENABLED:
+        return fn
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await fn(update, context)
+        finally:
+            labels = (("handler", name), ("callback", callback_prefix(update)))
+            METRICS.observe("bot_handler_seconds", labels, time.perf_counter() - started, name)
+    return wrapper
+
+
+def update_kind(update: object) -> str:
+    if isinstance(update, Update):
+        for kind in ("message", "callback_query", "edited_message", "inline_query", "chosen_inline_result",
+                     "my_chat_member", "channel_post"):
+            if getattr(update, kind) is not None:
+                return kind
+    return "other"
+
+
+def log_slow_update(update: object, total: float, trace: List[Tuple[str, float]]) -> None:
+    # фазы вложены (обработчик включает свои вызовы API и хранилища), одинаковые — суммируем
+    phases: Dict[str, float] = {}
+    for name, seconds in trace:
+        phases[name] = phases.get(name, 0.0) + seconds
+    kind = update_kind(update)
+    prefix = callback_prefix(update)
+    logger.warning(
+        "Медленный апдейт %s (%s%s): %.1f мс — %s",
+        getattr(update, "update_id", "?"), kind, f" {prefix}" if prefix else "", total * 1000,
+        ", ".join(f"{name} {seconds * 1000:.1f}" for name, seconds in phases.items()) or "без фаз",
+    )
+
+
+async def read_http_request(reader: asyncio.StreamReader) -> Tuple[str, str, Dict[str, str], Optional[bytes]]:
+    # тело None — оно больше MAX_HTTP_BODY и не прочитано
+    head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+    method, target, _ = head[0].split(" ", 2)
+    headers = {}
+    for line in head[1:]:
+        name, sep, value = line.partition(":")
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", "0"))
+    if length > MAX_HTTP_BODY:
+        return method, target, headers, None
+    body = await reader.readexactly(length)
+    return method, target, headers, body
+
+
+async def serve_http(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, handle,
+                     content_type: str = "text/plain") -> None:
+    # минимальный HTTP/1.1 с keep-alive для webhook'а front'а и /metrics:
+    # handle(method, target, headers, body) -> (статус, тело ответа)
+    try:
+        while True:
+            method, target, headers, body = await read_http_request(reader)
+            if body is None:
+                # непрочитанное тело осталось в сокете — после ответа соединение закрываем
+                status, payload = "413 Payload Too Large", b""
+            else:
+                status, payload = await handle(method, target, headers, body)
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(payload)}\r\n\r\n"
+                .encode("ascii") + payload
+            )
+            await writer.drain()
+            if body is None or headers.get("connection", "").lower() == "close":
+                break
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+class IngredientVocab:
+    # Интернированные строки ингредиентов: каждая различная строка хранится один раз — utf-8 подряд
+    # в общем bytearray, без объекта str на строку; рецепт держит только номера (4 байта на ингредиент).
+    # Номер по строке — открытая адресация по crc32 в array: он не зависит от процесса, поэтому
+    # словарь целиком ложится в кэш старта. Строки не удаляются — от удалённых рецептов они
+    # остаются до перезапуска. Рецепты создаются и в потоках (импорт), поэтому пополнение под замком.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._blob = bytearray()
+        self._ends = array("I")            # конец i-й строки в _blob
+        self._crcs = array("I")
+        self._table = array("i", [-1]) * 8   # слот -> номер строки, -1 — пусто; заполнено не больше половины
+
+    def __len__(self) -> int:
+        return len(self._ends)
+
+    def _raw(self, vid: int) -> bytes:
+        return self._blob[self._ends[vid - 1] if vid else 0:self._ends[vid]]
+
+    def text(self, vid: int) -> str:
+        return self._raw(vid).decode("utf-8")
+
+    def _slot(self, table: array, crc: int, raw: Optional[bytes]) -> int:
+        # слот с этой строкой или первый свободный (raw=None — только свободный, при перестройке)
+        mask = len(table) - 1
+        i = crc & mask
+        while True:
+            vid = table[i]
+            if vid < 0 or (raw is not None and self._crcs[vid] == crc and self._raw(vid) == raw):
+                return i
+            i = (i + 1) & mask
+
+    def intern(self, text: str) -> int:
+        raw = text.encode("utf-8")
+        crc = zlib.crc32(raw)
+        with self._lock:
+            slot = self._slot(self._table, crc, raw)
+            vid = self._table[slot]
+            if vid < 0:
+                vid = self._table[slot] = len(self._ends)
+                self._blob += raw
+                self._ends.append(len(self._blob))
+                self._crcs.append(crc)
+                if 2 * len(self._ends) > len(self._table):
+                    table = array("i", [-1]) * (2 * len(self._table))
+                    for i, c in enumerate(self._crcs):
+                        table[self._slot(table, c, None)] = i
+                    self._table = table
+            return vid
+
+    def pack(self, lines: List[str]) -> bytes:
+        return array("I", [self.intern(line) for line in lines]).tobytes()
+
+    def unpack(self, packed: bytes) -> List[str]:
+        return [self.text(vid) for vid in memoryview(packed).cast("I")]
+
+    def dump(self) -> Tuple[bytes, bytes, bytes, bytes]:
+        with self._lock:
+            return bytes(self._blob), self._ends.tobytes(), self._crcs.tobytes(), self._table.tobytes()
+
+    def merge(self, state: Tuple[bytes, bytes, bytes, bytes]) -> Optional[array]:
+        # словарь из кэша старта: в пустой (обычный старт) — копированием массивов, номера не меняются;
+        # иначе — строки добавляются по одной, возвращается перевод номеров кэша в свои
+        blob, ends, crcs, table = state
+        with self._lock:
+            if not self._ends:
+                self._blob = bytearray(blob)
+                self._ends.frombytes(ends)
+                self._crcs.frombytes(crcs)
+                self._table = array("i")
+                self._table.frombytes(table)
+                return None
+        offsets = array("I")
+        offsets.frombytes(ends)
+        return array("I", [self.intern(blob[start:end].decode("utf-8"))
+                           for start, end in zip(itertools.chain((0,), offsets), offsets)])
+
+
+INGREDIENTS = IngredientVocab()
+
+
+class Recipe:
+    # Рецепт каталога — компактная запись без __dict__: ингредиенты — номера строк в INGREDIENTS,
+    # шаги — либо текст, либо источник (хранилище, кэш старта) с методом steps(id), откуда текст
+    # читается при каждом обращении и в памяти не остаётся. Поля снаружи прежние: id, title,
+    # ingredients, steps, photo_file_id. После создания рецепт не меняется.
+    __slots__ = ("id", "title", "_ingredients", "_steps", "photo_file_id")
+
+    def __init__(self, id: int, title: str, ingredients: List[str], steps, photo_file_id: Optional[str] = None):
+        self.id = id
+        self.title = title
+        self._ingredients = INGREDIENTS.pack(ingredients)
+        self._steps = steps
+        self.photo_file_id = photo_file_id
+
+    @classmethod
+    def packed(cls, id: int, title: str, ingredients: bytes, steps, photo_file_id: Optional[str]) -> "Recipe":
+        # ингредиенты уже номерами INGREDIENTS (кэш старта)
+        r = cls.__new__(cls)
+        r.id, r.title, r._ingredients, r._steps, r.photo_file_id = id, title, ingredients, steps, photo_file_id
+        return r
+
+    @property
+    def ingredients(self) -> List[str]:
+        return INGREDIENTS.unpack(self._ingredients)
+
+    @property
+    def steps(self) -> str:
+        steps = self._steps
+        return steps if type(steps) is str else steps.steps(self.id)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Recipe):
+            return NotImplemented
+        if (self.id, self.title, self._ingredients, self.photo_file_id) != \
+                (other.id, other.title, other._ingredients, other.photo_file_id):
+            return False
+        # две версии рецепта с шагами в одной базе сравнить по шагам нельзя — база уже отдаёт новые
+        if type(self._steps) is not str and self._steps is other._steps:
+            return self is other
+        return self.steps == other.steps
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return (f"Recipe(id={self.id!r}, title={self.title!r}, ingredients={self.ingredients!r}, "
+                f"steps={self.steps!r}, photo_file_id={self.photo_file_id!r})")
+
+
+def recipe_from_dict(item: dict) -> Recipe:
+    return Recipe(
+        id=int(item.get("id", 0)),
+        title=item.get("title", ""),
+        ingredients=item.get("ingredients", []),
+        steps=item.get("steps", ""),
+        photo_file_id=item.get("photo_file_id"),
+    )
+
+
+def recipe_to_dict(r: Recipe) -> dict:
+    # то же, что asdict(r), без глубокого копирования — на больших каталогах asdict заметно медленнее
+    return {"id": r.id, "title": r.title, "ingredients": r.ingredients, "steps": r.steps,
+            "photo_file_id": r.photo_file_id}
+
+
+@timed("load_recipes")
+def load_recipes(path: str = DATA_FILE) -> List[Recipe]:
+    if not os.path.exists(path):
+        return [
+            Recipe(
+                id=1,
+                title="Омлет",
+                ingredients=["Яйца (2 шт.)", "Молоко (50 мл)", "Соль", "Масло"],
+                steps="Взбей яйца с молоком и солью. Обжарь на сковороде 3–5 минут.",
+            ),
+            Recipe(
+                id=2,
+                title="Овсянка",
+                ingredients=["Овсяные хлопья (50 г)", "Вода/молоко (200 мл)", "Соль/сахар"],
+                steps="Доведи жидкость до кипения, всыпь хлопья и вари 3–5 минут.",
+            ),
+            Recipe(
+                id=3,
+                title="Гречка",
+                ingredients=["Гречка (1 стакан)", "Вода (2 стакана)", "Соль", "Масло (по желанию)"],
+                steps="Промой гречку. Залей водой, посоли, доведи до кипения и вари под крышкой 15–20 минут.",
+            ),
+            Recipe(
+                id=4,
+                title="Макароны с сыром",
+                ingredients=["Макароны (150 г)", "Сыр (50–80 г)", "Соль", "Масло (по желанию)"],
+                steps="Отвари макароны в подсоленной воде. Слей воду, добавь сыр, перемешай до расплавления.",
+            ),
+            Recipe(
+                id=5,
+                title="Салат из огурцов и помидоров",
+                ingredients=["Огурец (1–2 шт.)", "Помидор (1–2 шт.)", "Лук (по желанию)", "Соль", "Масло/сметана"],
+                steps="Нарежь овощи, посоли, заправь маслом или сметаной, перемешай.",
+            ),
+            Recipe(
+                id=6,
+                title="Картофельное пюре",
+                ingredients=["Картофель (500 г)", "Молоко (100 мл)", "Масло (30 г)", "Соль"],
+                steps="Отвари картофель до мягкости, слей воду. Разомни, добавь масло и горячее молоко, посоли.",
+            ),
+            Recipe(
+                id=7,
+                title="Курица на сковороде",
+                ingredients=["Куриное филе (300 г)", "Соль", "Перец", "Масло"],
+                steps="Нарежь филе, посоли/поперчи. Обжарь 8–12 минут до готовности.",
+            ),
+            Recipe(
+                id=8,
+                title="Рис с овощами",
+                ingredients=["Рис (1 стакан)", "Овощи замороженные (200 г)", "Соль", "Масло/соевый соус (по желанию)"],
+                steps="Отвари рис. Прогрей овощи 5–7 минут, смешай, посоли.",
+            ),
+            Recipe(
+                id=9,
+                title="Сырники (простые)",
+                ingredients=["Творог (300 г)", "Яйцо (1 шт.)", "Сахар (1–2 ст. л.)", "Мука (3–4 ст. л.)", "Масло"],
+                steps="Смешай всё, сформируй сырники и обжарь по 2–3 минуты с каждой стороны.",
+            ),
+            Recipe(
+                id=10,
+                title="Блины (базовые)",
+                ingredients=["Молоко (500 мл)", "Яйца (2 шт.)", "Мука (200–250 г)", "Сахар (1 ст. л.)", "Соль", "Масло"],
+                steps="Смешай, добавь муку, жарь тонкие блины на смазанной сковороде.",
+            ),
+        ]
+
+    # читаем потоком: в памяти сразу Recipe, без промежуточного списка словарей
+    with open(path, "r", encoding="utf-8") as f:
+        recipes: List[Recipe] = [recipe_from_dict(item) for _, item in iter_json_records(f)]
+
+    # совместимость со старым файлом без id
+    if any(r.id == 0 for r in recipes):
+        for i, r in enumerate(recipes, start=1):
+            r.id = i
+        save_recipes(recipes, path)
+
+    return recipes
+
+
+def atomic_write(path: str, write, mode: str = "w") -> None:
+    # пишем во временный файл рядом и подменяем одним rename — при падении старый файл остаётся целым
+    tmp = f"{path}.tmp"
+    with open(tmp, mode, encoding=None if "b" in mode else "utf-8") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def atomic_write_json(path: str, data, **dump_kwargs) -> None:
+    atomic_write(path, lambda f: json.dump(data, f, ensure_ascii=False, **dump_kwargs))
+
+
+_JSON_WS = re.compile(r"[ \t\n\r]*")
+
+
+def iter_json_records(f) -> Iterator[Tuple[int, object]]:
+    # Записи из JSON-массива или JSON Lines по одной: (номер записи / строки, значение).
+    # Массив разбираем raw_decode по кускам IMPORT_CHUNK, поэтому большой файл не читается целиком.
+    # Ошибка в структуре массива — ValueError; битая строка JSON Lines отдаётся как None.
+    first = f.read(1)
+    if first == "\ufeff":
+        first = f.read(1)
+    while first and first in " \t\r\n":
+        first = f.read(1)
+    if not first:
+        return
+    if first != "[":
+        for lineno, line in enumerate(itertools.chain([first + f.readline()], f), start=1):
+            if line.strip():
+                try:
+                    yield lineno, json.loads(line)
+                except ValueError:
+                    yield lineno, None
+        return
+
+    decoder = json.JSONDecoder()
+    buf, pos, index, expect_value = "", 0, 0, True
+    while True:
+        pos = _JSON_WS.match(buf, pos).end()
+        if pos == len(buf):
+            chunk = f.read(IMPORT_CHUNK)
+            if not chunk:
+                raise ValueError("файл оборвался: нет закрывающей ]")
+            buf, pos = chunk, 0
+            continue
+        ch = buf[pos]
+        if ch == "]" and (index == 0 or not expect_value):
+            return
+        if not expect_value:
+            if ch != ",":
+                raise ValueError(f"после записи {index} ожидалась запятая")
+            pos += 1
+            expect_value = True
+            continue
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except ValueError:
+            # запись не влезла в буфер целиком — дочитываем; если уже слишком длинная, файл битый
+            chunk = f.read(IMPORT_CHUNK) if len(buf) - pos < IMPORT_MAX_RECORD else ""
+            if not chunk:
+                raise ValueError(f"запись {index + 1}: некорректный JSON")
+            buf, pos = buf[pos:] + chunk, 0
+            continue
+        index += 1
+        yield index, item
+        pos, expect_value = end, False
+        if pos > IMPORT_CHUNK:
+            buf, pos = buf[pos:], 0
+
+
+def export_format(path: str) -> str:
+    return "jsonl" if path.endswith(".jsonl") else "json"
+
+
+def write_recipes(f, recipes, fmt: str = "json") -> None:
+    # по рецепту за раз; "json" даёт тот же текст, что json.dump(список, indent=2)
+    if fmt == "jsonl":
+        for r in recipes:
+            f.write(json.dumps(recipe_to_dict(r), ensure_ascii=False))
+            f.write("\n")
+        return
+    sep = "[\n  "
+    for r in recipes:
+        f.write(sep)
+        f.write(json.dumps(recipe_to_dict(r), ensure_ascii=False, indent=2).replace("\n", "\n  "))
+        sep = ",\n  "
+    f.write("[]" if sep.startswith("[") else "\n]")
+
+
+@timed("save_recipes")
+def save_recipes(recipes: List[Recipe], path: str = DATA_FILE, fmt: str = "json") -> None:
+    atomic_write(path, lambda f: write_recipes(f, recipes, fmt))
+
+
+def _file_sig(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+# ---- storage backends ----
+# Бэкенд знает, как прочитать каталог и как сохранить изменения.
+# prepare() вызывается в event loop и возвращает функцию записи, которая выполняется в потоке;
+# finish(ok) — снова в event loop, когда запись завершилась (или упала).
+# changed() — есть ли в хранилище то, чего нет в памяти (свои записи не в счёт);
+# changes() — что именно поменяли другие процессы (None — перечитать всё через load()).
+# reserve_ids(floor, n) — первый из n подряд идущих id не меньше floor, которые больше никому не выданы;
+# record_add(r, new=True) — рецепт с только что выданным id (никого не заменяет).
+# load(readonly=True) — только чтение, хранилище не трогаем (сборщик кэша старта рядом с живым ботом).
+# state() — метка того, что сейчас в памяти (mtime/size файлов, номер изменения); adopt(state) —
+# принять каталог с такой меткой как загруженный (кэш старта), после чего changed() сравнивает с ней.
+class JsonBackend:
+    # весь каталог в recipes.json + счётчик id в recipes_meta.json
+    def __init__(self, path: str = DATA_FILE, meta_path: str = META_FILE):
+        self.path = path
+        self.meta_path = meta_path
+        self._seen_sig = None   # mtime/size файла, который сейчас в памяти
+
+    def __str__(self) -> str:
+        return self.path
+
+    def changed(self) -> bool:
+        return _file_sig(self.path) != self._seen_sig
+
+    def state(self):
+        return self._seen_sig
+
+    def adopt(self, state) -> None:
+        self._seen_sig = state
+
+    def load(self, readonly: bool = False) -> Tuple[List[Recipe], int]:
+        try:
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                next_id = int(json.load(f).get("next_id", 1))
+        except (FileNotFoundError, ValueError, AttributeError):
+            next_id = 1
+        recipes = load_recipes(self.path)
+        self._seen_sig = _file_sig(self.path)
+        return recipes, next_id
+
+    def changes(self):
+        # поштучных изменений файл не хранит — если он поменялся, каталог перечитывается целиком
+        return None
+
+    def reserve_ids(self, floor: int, n: int) -> int:
+        # файл пишет один процесс — счётчика в памяти достаточно
+        return floor
+
+    def record_add(self, r: Recipe, new: bool = False) -> None:
+        pass
+
+    def record_delete(self, rid: int) -> None:
+        pass
+
+    def prepare(self, store: "RecipeStore"):
+        recipes, next_id = store.all(), store.next_id
+
+        def write() -> None:
+            save_recipes(recipes, self.path)
+            atomic_write_json(self.meta_path, {"next_id": next_id})
+        return write
+
+    def finish(self, ok: bool) -> None:
+        if ok:
+            # свою же запись не считаем внешним изменением
+            self._seen_sig = _file_sig(self.path)
+
+
+class JournalBackend:
+    # Компактный снимок + журнал добавлений/удалений (JSON Lines): каждое изменение — одна короткая
+    # дозапись в конец файла. При старте журнал проигрывается поверх снимка; когда он разрастается,
+    # сворачиваем его в новый снимок. Если снимка ещё нет — импортируем обычный recipes.json.
+    def __init__(self, snapshot_path: str = SNAPSHOT_FILE, journal_path: str = JOURNAL_FILE,
+                 import_path: str = DATA_FILE, import_meta_path: str = META_FILE):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.import_path = import_path
+        self.import_meta_path = import_meta_path
+        self._entries = 0
+        self._pending: List[str] = []
+        self._inflight: List[str] = []
+        self._compacting = False
+        self._overflow = False   # изменений больше, чем влезет в журнал: следующая запись — снимок
+        self._seen_sig = None
+
+    def __str__(self) -> str:
+        return self.journal_path
+
+    def _sig(self):
+        return _file_sig(self.snapshot_path), _file_sig(self.journal_path)
+
+    def changed(self) -> bool:
+        return self._sig() != self._seen_sig
+
+    def state(self):
+        return self._seen_sig
+
+    def adopt(self, state) -> None:
+        self._seen_sig = state
+        # журнал короткий (до JOURNAL_MAX_ENTRIES строк) — пересчитать дешевле, чем хранить
+        self._entries = 0
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                self._entries = sum(1 for _ in f)
+
+    def load(self, readonly: bool = False) -> Tuple[List[Recipe], int]:
+        # readonly: бот может дописывать журнал прямо сейчас — его недописанную строку не обрезаем,
+        # снимок не создаём, а метку берём до чтения: дописанное после неё бот увидит как изменение
+        sig = self._sig()
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                snap = json.load(f)
+            recipes = [recipe_from_dict(x) for x in snap.get("recipes", [])]
+            next_id = int(snap.get("next_id", 1))
+        else:
+            # счётчик id — из recipes_meta.json, как в режиме json: id удалённых рецептов не выдаём снова
+            recipes, next_id = JsonBackend(self.import_path, self.import_meta_path).load()
+
+        by_id = {r.id: r for r in recipes}
+        self._entries = 0
+        if os.path.exists(self.journal_path):
+            good = 0   # конец последней целой строки
+            with open(self.journal_path, "rb") as f:
+                for line in f:
+                    try:
+                        if not line.endswith(b"\n"):
+                            raise ValueError("строка без перевода строки")
+                        rec = json.loads(line)
+                    except ValueError:
+                        # недописанная строка после падения — дальше ничего нет
+                        break
+                    good += len(line)
+                    self._entries += 1
+                    # проигрывание идемпотентно: после падения посреди сворачивания журнал
+                    # может повторить то, что уже есть в снимке
+                    if rec.get("op") == "add":
+                        r = recipe_from_dict(rec["recipe"])
+                        by_id[r.id] = r
+                    elif rec.get("op") == "del":
+                        by_id.pop(int(rec["id"]), None)
+            if not readonly and good < os.path.getsize(self.journal_path):
+                # обрезаем оборванный хвост, иначе следующая дозапись приклеится к нему
+                # и при следующем старте пропадёт вместе со всем, что записано после
+                logger.warning("%s: отброшен недописанный хвост после %d записей", self.journal_path, self._entries)
+                with open(self.journal_path, "r+b") as f:
+                    f.truncate(good)
+                    os.fsync(f.fileno())
+        next_id = max(next_id, max(by_id, default=0) + 1)
+        recipes = list(by_id.values())
+        if readonly:
+            self._seen_sig = sig
+            return recipes, next_id
+        if not os.path.exists(self.snapshot_path):
+            self._write_snapshot(recipes, next_id)
+        self._seen_sig = self._sig()
+        return recipes, next_id
+
+    def _write_snapshot(self, recipes: List[Recipe], next_id: int) -> None:
+        # по рецепту за раз, как write_recipes: весь каталог списком словарей в памяти не собираем
+        def write(f) -> None:
+            f.write(f'{{"next_id":{next_id},"recipes":[')
+            sep = ""
+            for r in recipes:
+                f.write(sep)
+                f.write(json.dumps(recipe_to_dict(r), ensure_ascii=False, separators=(",", ":")))
+                sep = ","
+            f.write("]}")
+
+        atomic_write(self.snapshot_path, write)
+        with open(self.journal_path, "w", encoding="utf-8"):
+            pass
+
+    def changes(self):
+        return None
+
+    def reserve_ids(self, floor: int, n: int) -> int:
+        return floor
+
+    def _journal_full(self) -> bool:
+        # Столько изменений журнал всё равно не примет — запишется снимок из памяти. Строки для журнала
+        # дальше не копим: иначе большой импорт держал бы весь каталог ещё раз, сериализованным.
+        if not self._overflow and self._entries + len(self._inflight) + len(self._pending) >= JOURNAL_MAX_ENTRIES:
+            self._overflow = True
+            self._pending = []
+        return self._overflow
+
+    def record_add(self, r: Recipe, new: bool = False) -> None:
+        if not self._journal_full():
+            self._pending.append(json.dumps({"op": "add", "recipe": recipe_to_dict(r)}, ensure_ascii=False))
+
+    def record_delete(self, rid: int) -> None:
+        if not self._journal_full():
+            self._pending.append(json.dumps({"op": "del", "id": rid}))
+
+    def prepare(self, store: "RecipeStore"):
+        self._inflight, self._pending = self._pending, []
+        size = (_file_sig(self.journal_path) or (0, 0))[1]
+        self._compacting = (self._overflow or self._entries + len(self._inflight) > JOURNAL_MAX_ENTRIES
+                            or size > JOURNAL_MAX_BYTES)
+        # то, что накопится во время записи снимка, снова решит само, влезает ли оно в журнал
+        self._overflow = False
+        if self._compacting:
+            recipes, next_id = store.all(), store.next_id
+            return lambda: self._write_snapshot(recipes, next_id)
+
+        lines = self._inflight
+
+        def append() -> None:
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                f.write("".join(line + "\n" for line in lines))
+                f.flush()
+                os.fsync(f.fileno())
+        return append
+
+    def finish(self, ok: bool) -> None:
+        if not ok and self._compacting:
+            # снимок не записался — в следующий раз пишем его снова, строки журнала не нужны
+            self._overflow = True
+            self._pending = []
+        elif not ok:
+            self._pending[:0] = self._inflight
+        elif self._compacting:
+            self._entries = 0
+        else:
+            self._entries += len(self._inflight)
+        if ok:
+            self._seen_sig = self._sig()
+        self._inflight = []
+        self._compacting = False
+
+
+class SqliteDb:
+    # Одно соединение на файл; обращаются к нему из рабочих потоков по очереди (под замком).
+    def __init__(self, path: str, schema: str):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(schema)
+
+    def read(self, sql: str, params=()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def snapshot(self, fn):
+        # несколько SELECT в одной читающей транзакции: чужой коммит посередине их не разъедется
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                return fn(self._conn)
+            finally:
+                self._conn.execute("COMMIT")
+
+    def transaction(self, fn) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                fn(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS recipes (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    steps TEXT NOT NULL,
+    photo_file_id TEXT
+);
+CREATE TABLE IF NOT EXISTS ingredients (
+    recipe_id INTEGER NOT NULL,
+    pos INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    PRIMARY KEY (recipe_id, pos)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS favourites (
+    user_id INTEGER NOT NULL,
+    recipe_id INTEGER NOT NULL,
+    added_at INTEGER NOT NULL,
+    PRIMARY KEY (user_id, recipe_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS favourites_by_recipe ON favourites (recipe_id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS recipes_fts USING fts5(title, ingredients);
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    recipe_id INTEGER NOT NULL
+);
+"""
+
+
+class SqliteBackend:
+    # Рецепты, ингредиенты и избранное в SQLite (WAL). Изменения каталога пишутся построчно
+    # той же очередью, что и в других режимах; запросы идут из потоков, не из event loop.
+    # Каждая запись рецепта оставляет строку в changes: другие процессы с той же базой
+    # видят, что номер последнего изменения ушёл вперёд, и дочитывают только изменённые рецепты.
+    # Шаги рецептов в памяти не держим: Recipe.steps читает их отсюда (steps()) при обращении.
+    # Страницы каталога — keyset по id (catalog_page), текстовый поиск — FTS5 (search). В recipes_fts
+    # лежат уже нормализованные токены (tokenize), поэтому поиск по FTS5 ведёт себя так же, как SearchIndex.
+    def __init__(self, path: str = SQLITE_FILE):
+        self.path = path
+        self.db = SqliteDb(path, SQLITE_SCHEMA)
+        self._steps_conn: Optional[sqlite3.Connection] = None
+        self._steps_lock = threading.Lock()
+        self._pending: List[Tuple[str, object]] = []
+        self._inflight: List[Tuple[str, object]] = []
+        self._seen = 0                                   # последний учтённый seq из changes
+        self._written: Optional[Tuple[int, int]] = None  # (seq до, seq после) своей последней записи
+
+    def __str__(self) -> str:
+        return self.path
+
+    def changed(self) -> bool:
+        # избранное в changes не попадает, так что его правки из других процессов каталог не трогают
+        return self.db.read("SELECT COALESCE(MAX(seq), 0) FROM changes")[0][0] != self._seen
+
+    def state(self):
+        return self._seen
+
+    def adopt(self, state) -> None:
+        # отставание от базы дочитает changes(), если строки changes ещё не обрезаны
+        self._seen = state
+
+    def _read_recipes(self, conn: sqlite3.Connection, rids: Optional[List[int]] = None) -> List[Recipe]:
+        where, params = "", ()
+        if rids is not None:
+            where, params = f" WHERE {{}} IN ({','.join('?' * len(rids))})", tuple(rids)
+        ingredients: Dict[int, List[str]] = {}
+        sql = "SELECT recipe_id, text FROM ingredients" + where.format("recipe_id") + " ORDER BY recipe_id, pos"
+        for rid, text in conn.execute(sql, params):
+            ingredients.setdefault(rid, []).append(text)
+        sql = "SELECT id, title, photo_file_id FROM recipes" + where.format("id") + " ORDER BY id"
+        return [
+            Recipe(id=rid, title=title, ingredients=ingredients.get(rid, []), steps=self, photo_file_id=photo)
+            for rid, title, photo in conn.execute(sql, params)
+        ]
+
+    def steps(self, rid: int) -> str:
+        # точечное чтение по первичному ключу. Своё соединение: основное под замком держит
+        # пишущая транзакция из потока, а шаги нужны сразу (показ рецепта); в WAL чтению она не мешает
+        with self._steps_lock:
+            if self._steps_conn is None:
+                self._steps_conn = sqlite3.connect(self.path, check_same_thread=False)
+            row = self._steps_conn.execute("SELECT steps FROM recipes WHERE id = ?", (rid,)).fetchone()
+        return row[0] if row else ""
+
+    @staticmethod
+    def _last_change(conn: sqlite3.Connection) -> int:
+        return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+
+    @staticmethod
+    def _next_id(conn: sqlite3.Connection) -> int:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'next_id'").fetchone()
+        return row[0] if row else 1
+
+    def load(self, readonly: bool = False) -> Tuple[List[Recipe], int]:
+        def read(conn: sqlite3.Connection) -> Tuple[List[Recipe], int]:
+            self._seen = self._last_change(conn)
+            return self._read_recipes(conn), self._next_id(conn)
+        if not readonly and not self.db.read("SELECT 1 FROM meta WHERE key = 'fts'"):
+            self.db.transaction(self._fill_fts)
+        return self.db.snapshot(read)
+
+    def _fill_fts(self, conn: sqlite3.Connection) -> None:
+        # разово: база без recipes_fts (прежние версии) — заполняем по уже сохранённым рецептам
+        conn.execute("DELETE FROM recipes_fts")
+        for r in self._read_recipes(conn):
+            self._index_fts(conn, r)
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('fts', 1)")
+
+    @timed("changes")
+    def changes(self) -> Optional[Tuple[Dict[int, Optional[Recipe]], int]]:
+        # что поменяли другие процессы с прошлого load()/changes(): id -> новый рецепт (None — удалён);
+        # None — журнал изменений уже обрезан, нужен полный load()
+        def read(conn: sqlite3.Connection):
+            rows = conn.execute("SELECT seq, recipe_id FROM changes WHERE seq > ? ORDER BY seq", (self._seen,)).fetchall()
+            if (rows and rows[0][0] != self._seen + 1) or self._last_change(conn) < self._seen:
+                return None
+            rids = list(dict.fromkeys(rid for _, rid in rows))
+            changed: Dict[int, Optional[Recipe]] = dict.fromkeys(rids)
+            for r in self._read_recipes(conn, rids) if rids else []:
+                changed[r.id] = r
+            if rows:
+                self._seen = rows[-1][0]
+            return changed, self._next_id(conn)
+        return self.db.snapshot(read)
+
+    @staticmethod
+    def _insert(conn: sqlite3.Connection, r: Recipe, new: bool = False) -> None:
+        # новый рецепт не заменяет ничего: совпадение id — ошибка, а не тихая потеря чужого рецепта
+        conn.execute(
+            f"INSERT {'' if new else 'OR REPLACE '}INTO recipes (id, title, steps, photo_file_id) VALUES (?, ?, ?, ?)",
+            (r.id, r.title, r.steps, r.photo_file_id),
+        )
+        conn.execute("DELETE FROM ingredients WHERE recipe_id = ?", (r.id,))
+        conn.executemany(
+            "INSERT INTO ingredients (recipe_id, pos, text) VALUES (?, ?, ?)",
+            [(r.id, i, text) for i, text in enumerate(r.ingredients)],
+        )
+        conn.execute("DELETE FROM recipes_fts WHERE rowid = ?", (r.id,))
+        SqliteBackend._index_fts(conn, r)
+        conn.execute("INSERT INTO changes (recipe_id) VALUES (?)", (r.id,))
+
+    @staticmethod
+    def _index_fts(conn: sqlite3.Connection, r: Recipe) -> None:
+        conn.execute(
+            "INSERT INTO recipes_fts (rowid, title, ingredients) VALUES (?, ?, ?)",
+            (r.id, " ".join(tokenize(r.title)), " ".join(t for ing in r.ingredients for t in ingredient_tokens(ing))),
+        )
+
+    @staticmethod
+    def _delete(conn: sqlite3.Connection, rid: int) -> None:
+        conn.execute("DELETE FROM recipes WHERE id = ?", (rid,))
+        conn.execute("DELETE FROM ingredients WHERE recipe_id = ?", (rid,))
+        conn.execute("DELETE FROM recipes_fts WHERE rowid = ?", (rid,))
+        # по индексу favourites_by_recipe — трогаем только тех, у кого рецепт в избранном
+        conn.execute("DELETE FROM favourites WHERE recipe_id = ?", (rid,))
+        conn.execute("INSERT INTO changes (recipe_id) VALUES (?)", (rid,))
+
+    @classmethod
+    def _trim_changes(cls, conn: sqlite3.Connection) -> int:
+        last = cls._last_change(conn)
+        conn.execute("DELETE FROM changes WHERE seq <= ?", (last - CHANGES_KEEP,))
+        return last
+
+    @staticmethod
+    def _set_next_id(conn: sqlite3.Connection, next_id: int) -> None:
+        # счётчик только растёт: другой процесс мог уже выдать id дальше нашего next_id
+        conn.execute(
+            "INSERT INTO meta (key, value) VALUES ('next_id', ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = MAX(value, excluded.value)",
+            (next_id,),
+        )
+
+    def reserve_ids(self, floor: int, n: int) -> int:
+        # id выдаёт база одной транзакцией: воркеры с общей recipes.db не получат один и тот же id,
+        # даже если ещё не видели новых рецептов друг друга. Блокирующий вызов — из потока.
+        result = []
+
+        def apply(conn: sqlite3.Connection) -> None:
+            self._set_next_id(conn, floor)
+            result.append(conn.execute(
+                "UPDATE meta SET value = value + ? WHERE key = 'next_id' RETURNING value", (n,)
+            ).fetchone()[0] - n)
+        self.db.transaction(apply)
+        return result[0]
+
+    def record_add(self, r: Recipe, new: bool = False) -> None:
+        self._pending.append(("new" if new else "add", r))
+
+    def record_delete(self, rid: int) -> None:
+        self._pending.append(("del", rid))
+
+    def prepare(self, store: "RecipeStore"):
+        self._inflight, self._pending = self._pending, []
+        ops, next_id = self._inflight, store.next_id
+
+        def apply(conn: sqlite3.Connection) -> None:
+            before = self._last_change(conn)
+            for op, arg in ops:
+                if op == "del":
+                    self._delete(conn, arg)
+                else:
+                    self._insert(conn, arg, op == "new")
+            self._set_next_id(conn, next_id)
+            self._written = (before, self._trim_changes(conn))
+        return lambda: self.db.transaction(apply)
+
+    def finish(self, ok: bool) -> None:
+        if not ok:
+            self._pending[:0] = self._inflight
+        elif self._written and self._written[0] == self._seen:
+            # между нашими изменениями чужих не было — свои же строки из changes не перечитываем
+            self._seen = self._written[1]
+        self._inflight = []
+        self._written = None
+
+    # ---- запросы (синхронные, вызывать через asyncio.to_thread) ----
+    @timed("catalog_page")
+    def catalog_page(self, after: int = 0, before: Optional[int] = None,
+                     limit: int = CAT_PAGE_SIZE) -> Tuple[List[Tuple[int, str]], bool, int]:
+        # keyset-пагинация: страница после id after (или до id before), без OFFSET;
+        # -> [(id, title)], есть ли ещё страницы в ту же сторону, всего рецептов
+        def read(conn: sqlite3.Connection):
+            if before is None:
+                rows = conn.execute("SELECT id, title FROM recipes WHERE id > ? ORDER BY id LIMIT ?",
+                                    (after, limit + 1)).fetchall()
+            else:
+                rows = conn.execute("SELECT id, title FROM recipes WHERE id < ? ORDER BY id DESC LIMIT ?",
+                                    (before, limit + 1)).fetchall()
+            more = len(rows) > limit
+            rows = rows[:limit]
+            total = conn.execute("SELECT COUNT(*) FROM recipes").fetchone()[0]
+            return (rows if before is None else rows[::-1]), more, total
+        return self.db.snapshot(read)
+
+    @timed("fts_search")
+    def search(self, text: str) -> List[int]:
+        # все слова запроса (AND), каждое — и как начало слова; название весит больше ингредиентов
+        tokens = tokenize(text)
+        if not tokens:
+            return []
+        match = " AND ".join(f'"{t}"*' for t in tokens)
+        rows = self.db.read(
+            "SELECT rowid FROM recipes_fts WHERE recipes_fts MATCH ? ORDER BY bm25(recipes_fts, ?, ?), rowid",
+            (match, float(TITLE_WEIGHT), float(INGR_WEIGHT)),
+        )
+        return [rid for (rid,) in rows]
+
+    @timed("fav_ids")
+    def fav_ids(self, user_id: int) -> List[int]:
+        rows = self.db.read("SELECT recipe_id FROM favourites WHERE user_id = ? ORDER BY added_at", (user_id,))
+        return [rid for (rid,) in rows]
+
+    @timed("fav_has")
+    def fav_has(self, user_id: int, rid: int) -> bool:
+        return bool(self.db.read("SELECT 1 FROM favourites WHERE user_id = ? AND recipe_id = ?", (user_id, rid)))
+
+    @timed("fav_add")
+    def fav_add(self, user_id: int, rid: int) -> None:
+        self.db.transaction(lambda conn: conn.execute(
+            "INSERT OR IGNORE INTO favourites (user_id, recipe_id, added_at) VALUES (?, ?, ?)",
+            (user_id, rid, time.time_ns()),
+        ))
+
+    @timed("fav_remove")
+    def fav_remove(self, user_id: int, rid: int) -> None:
+        self.db.transaction(lambda conn: conn.execute(
+            "DELETE FROM favourites WHERE user_id = ? AND recipe_id = ?", (user_id, rid)
+        ))
+
+    @timed("fav_purge")
+    def fav_purge(self, rid: int) -> None:
+        self.db.transaction(lambda conn: conn.execute("DELETE FROM favourites WHERE recipe_id = ?", (rid,)))
+
+    def import_catalog(self, recipes: List[Recipe], next_id: int, favs: Dict[int, List[int]]) -> None:
+        def apply(conn: sqlite3.Connection) -> None:
+            for r in recipes:
+                self._insert(conn, r)
+            self._set_next_id(conn, next_id)
+            self._trim_changes(conn)
+            now = time.time_ns()
+            conn.executemany(
+                "INSERT OR IGNORE INTO favourites (user_id, recipe_id, added_at) VALUES (?, ?, ?)",
+                [(uid, rid, now + i) for uid, ids in favs.items() for i, rid in enumerate(ids)],
+            )
+        self.db.transaction(apply)
+
+
+def make_backend(mode: str = STORAGE_MODE):
+    if mode == "journal":
+        return JournalBackend()
+    if mode == "sqlite":
+        return SqliteBackend()
+    return JsonBackend()
+
+
+def migrate_to_sqlite(db_path: str = SQLITE_FILE, data_path: str = DATA_FILE,
+                      meta_path: str = META_FILE, state_path: str = STATE_FILE,
+                      persistence_path: str = PERSISTENCE_FILE) -> Tuple[int, int]:
+    # разовый перенос: recipes.json (+ счётчик id) и избранное из user_data
+    # (bot_state.db, а если его ещё нет — старый pickle-файл)
+    recipes, next_id = JsonBackend(data_path, meta_path).load()
+    next_id = max(next_id, max((r.id for r in recipes), default=0) + 1)
+    favs: Dict[int, List[int]] = {}
+    state = SqlitePersistence(state_path, persistence_path)
+    for uid, udata in state.load_table("user_data").items():
+        ids = udata.get("favs") if isinstance(udata, dict) else None
+        if ids:
+            favs[int(uid)] = [int(x) for x in ids]
+    state.db.close()
+    SqliteBackend(db_path).import_catalog(recipes, next_id, favs)
+    return len(recipes), sum(len(v) for v in favs.values())
+
+
+class _LiveSlots:
+    # Дерево Фенвика над слотами каталога: 1 — рецепт на месте, 0 — удалён.
+    # Удаление и поиск k-го живого рецепта (для страниц каталога) — O(log n), без пересборки списка.
+    def __init__(self, n: int = 0):
+        self.n = n
+        self.tree = [0] * (n + 1)
+        for i in range(1, n + 1):
+            self.tree[i] += 1
+            j = i + (i & -i)
+            if j <= n:
+                self.tree[j] += self.tree[i]
+
+    def _prefix(self, i: int) -> int:
+        total = 0
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def append(self) -> None:
+        self.n += 1
+        i = self.n
+        self.tree.append(1 + self._prefix(i - 1) - self._prefix(i - (i & -i)))
+
+    def remove(self, slot: int) -> None:
+        i = slot + 1
+        while i <= self.n:
+            self.tree[i] -= 1
+            i += i & -i
+
+    def select(self, k: int) -> int:
+        # слот k-го (с нуля) живого элемента
+        pos = 0
+        rem = k + 1
+        step = 1 << self.n.bit_length()
+        while step:
+            nxt = pos + step
+            if nxt <= self.n and self.tree[nxt] < rem:
+                pos = nxt
+                rem -= self.tree[nxt]
+            step >>= 1
+        return pos
+
+
+class RecipeStore:
+    # Рецепты в памяти: файл читается один раз при старте и перечитывается,
+    # только если у него поменялись mtime/size (правка руками, выкладка нового файла);
+    # из recipes.db дочитываются только рецепты, изменённые другими процессами.
+    # version растёт при каждом изменении — по нему производные структуры понимают, что устарели.
+    # Внутри: индекс id -> Recipe и слоты в порядке каталога; удалённые слоты — None,
+    # их вычищаем пачкой, когда мёртвых становится больше половины.
+    # С кэшем старта (cache) load() берёт каталог и состояние индексов из него, если кэш не устарел.
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else JsonBackend()
+        self.version = 0
+        self.next_id = 1
+        self._by_id: Dict[int, Recipe] = {}
+        self._slots: List[Optional[Recipe]] = []
+        self._slot_of: Dict[int, int] = {}
+        self._live = _LiveSlots()
+        self._checked_at = 0.0
+        self._listeners: list = []
+        self.writer: Optional["RecipeWriter"] = None   # без writer'а (скрипты, тесты) пишем сразу
+        self._writing = False
+        self.cache: Optional["StartupCache"] = None
+        self.source = ""   # откуда последний load(): "storage" или "cache"
+        self._ids_lock = threading.Lock()   # allocate_ids зовут и из потоков
+        self._generation = 0   # растёт, когда каталог перечитан целиком (load)
+        self._touched: List[Set[int]] = []   # id, изменённые за время идущих перестроек (см. _rebuild)
+        self._reloading: Optional[asyncio.Task] = None
+
+    def subscribe(self, listener) -> None:
+        # listener — производная структура (поиск, кэши): on_reload(store), on_add(r), on_delete(r)
+        self._listeners.append(listener)
+        if self.version:
+            listener.on_reload(self)
+
+    def _reindex(self, recipes: List[Recipe]) -> None:
+        self._by_id = {}
+        self._slots = []
+        for r in recipes:
+            if r.id in self._by_id:
+                continue
+            self._by_id[r.id] = r
+            self._slots.append(r)
+        self._slot_of = {r.id: i for i, r in enumerate(self._slots)}
+        self._live = _LiveSlots(len(self._slots))
+
+    def _compact(self) -> None:
+        self._reindex([r for r in self._slots if r is not None])
+
+    @timed("store_load")
+    def load(self, readonly: bool = False) -> None:
+        # readonly — см. backend.load
+        image = self.cache.open(self._listeners) if self.cache is not None else None
+        delta = None
+        if image is not None:
+            self.backend.adopt(image.state)
+            if self.backend.changed():
+                # кэш отстал: recipes.db дочитает изменения поверх него, файлы — только целиком
+                delta = self.backend.changes()
+                if delta is None:
+                    image = None
+        if image is not None:
+            recipes, next_id = image.recipes(), image.next_id
+        else:
+            recipes, next_id = self.backend.load(readonly)
+        self._reindex(recipes)
+        # id удалённых рецептов не переиспользуем: счётчик хранится отдельно от самих рецептов
+        top = max(self._by_id, default=0) + 1
+        self.next_id = max(self.next_id, next_id, top)
+        self._checked_at = time.monotonic()
+        self.version += 1
+        self._generation += 1
+        for listener in self._listeners:
+            if image is not None:
+                image.restore(listener)
+            else:
+                listener.on_reload(self)
+        self.source = "cache" if image is not None else "storage"
+        if delta is not None:
+            changed, next_id = delta
+            self.next_id = max(self.next_id, next_id)
+            for rid, r in changed.items():
+                self._apply(rid, r)
+        if self.cache is not None and (image is None or delta):
+            self.cache.schedule()
+
+    @timed("refresh")
+    def refresh(self) -> bool:
+        now = time.monotonic()
+        if self._writing or now - self._checked_at < RELOAD_CHECK_INTERVAL:
+            return False
+        if self._reloading is not None and not self._reloading.done():
+            return False
+        self._checked_at = now
+        if not self.backend.changed():
+            return False
+        delta = self.backend.changes()
+        if delta is None:
+            # полное перечитывание (после большого импорта в другом воркере строки changes уже обрезаны) —
+            # в фоне, см. reload(); до его конца отвечаем по прежнему каталогу
+            try:
+                self._reloading = self.reload()
+            except RuntimeError:
+                self.load()
+            return True
+        changed, next_id = delta
+        self.next_id = max(self.next_id, next_id)
+        for rid, r in changed.items():
+            self._apply(rid, r)
+        return bool(changed)
+
+    def _apply(self, rid: int, r: Optional[Recipe]) -> None:
+        # чужое изменение: применяем к памяти и производным структурам, но не пишем обратно в хранилище
+        old = self._by_id.get(rid)
+        if r is None:
+            if old is not None:
+                self._remove(rid)
+        elif old != r:
+            self._upsert(r)
+
+    def all(self) -> List[Recipe]:
+        return [r for r in self._slots if r is not None]
+
+    def __iter__(self) -> Iterator[Recipe]:
+        return (r for r in self._slots if r is not None)
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def get(self, rid: int) -> Optional[Recipe]:
+        return self._by_id.get(rid)
+
+    def at(self, k: int) -> Recipe:
+        # k-й рецепт в порядке каталога
+        return self._slots[self._live.select(k)]
+
+    def page(self, page: int, page_size: int) -> Tuple[List[Recipe], int, int]:
+        total = len(self._by_id)
+        total_pages = max(1, (total + page_size - 1) // page_size)
+        page = min(max(page, 1), total_pages)
+        start = (page - 1) * page_size
+        return [self.at(k) for k in range(start, min(start + page_size, total))], total_pages, page
+
+    def random(self) -> Recipe:
+        return self.at(random.randrange(len(self._by_id)))
+
+    def allocate_ids(self, n: int, floor: int = 0) -> int:
+        # n новых id подряд (не меньше floor), возвращает первый; с recipes.db — блокирующий вызов,
+        # из потока (см. reserve_new_ids)
+        with self._ids_lock:
+            first = self.backend.reserve_ids(max(self.next_id, floor), n)
+            self.next_id = max(self.next_id, first + n)
+            return first
+
+    def allocate_id(self) -> int:
+        return self.allocate_ids(1)
+
+    def _place(self, r: Recipe) -> Optional[Recipe]:
+        # новый рецепт — в конец каталога, существующий id — на прежнее место; возвращает старую версию
+        old = self._by_id.get(r.id)
+        self._by_id[r.id] = r
+        for touched in self._touched:
+            touched.add(r.id)
+        if old is None:
+            self.next_id = max(self.next_id, r.id + 1)
+            self._slot_of[r.id] = len(self._slots)
+            self._slots.append(r)
+            self._live.append()
+        else:
+            self._slots[self._slot_of[r.id]] = r
+        return old
+
+    def _upsert(self, r: Recipe) -> None:
+        old = self._place(r)
+        self.version += 1
+        for listener in self._listeners:
+            if old is not None:
+                listener.on_delete(old)
+            listener.on_add(r)
+
+    def _remove(self, rid: int) -> Recipe:
+        r = self._by_id.pop(rid)
+        for touched in self._touched:
+            touched.add(rid)
+        slot = self._slot_of.pop(rid)
+        self._slots[slot] = None
+        self._live.remove(slot)
+        if len(self._slots) - len(self._by_id) > max(32, len(self._slots) // 2):
+            self._compact()
+        self.version += 1
+        for listener in self._listeners:
+            listener.on_delete(r)
+        return r
+
+    def add(self, r: Recipe, new: bool = False) -> None:
+        # new — id только что выдан allocate_id(): запись не может ничего заменить
+        self._upsert(r)
+        self.backend.record_add(r, new)
+        self._changed()
+
+    def _place_many(self, recipes: List[Recipe], new: Set[int]) -> bool:
+        # пачка добавлений/замен (импорт): версия и запись — один раз на пачку. Большую пачку проще
+        # переиндексировать целиком, чем прогонять on_add по каждому рецепту: тогда возвращает True,
+        # и производные структуры перестраивает вызывающий
+        rebuild = len(recipes) > max(1000, len(self._by_id) // 4)
+        for r in recipes:
+            old = self._place(r)
+            if not rebuild:
+                for listener in self._listeners:
+                    if old is not None:
+                        listener.on_delete(old)
+                    listener.on_add(r)
+            self.backend.record_add(r, r.id in new)
+        self.version += 1
+        return rebuild
+
+    def add_many(self, recipes: List[Recipe], new: Set[int] = frozenset()) -> None:
+        if not recipes:
+            return
+        if self._place_many(recipes, new):
+            for listener in self._listeners:
+                listener.on_reload(self)
+        self._changed()
+
+    async def add_many_async(self, recipes: List[Recipe], new: Set[int] = frozenset()) -> None:
+        # то же из event loop: перестройка большой пачки — в потоке (_rebuild)
+        if not recipes:
+            return
+        if self._place_many(recipes, new):
+            await self._rebuild(load=False)
+        self._changed()
+
+    def reload(self) -> asyncio.Task:
+        # load() без остановки loop: чтение хранилища и сборка индексов — в потоке (_rebuild);
+        # без event loop — RuntimeError
+        loop = asyncio.get_running_loop()
+        rebuild = self._rebuild(load=True)
+
+        async def run() -> None:
+            try:
+                await rebuild
+            except STORAGE_ERRORS + (ValueError,):
+                logger.exception("Не удалось перечитать %s", self.backend)
+        return loop.create_task(run())
+
+    def _build(self, recipes: Optional[List[Recipe]], fresh: list) -> "RecipeStore":
+        # в потоке: отдельный RecipeStore по списку рецептов (None — заново из хранилища)
+        # и пустые копии структур, собранные по нему
+        shadow = RecipeStore(self.backend)
+        if recipes is None:
+            recipes, shadow.next_id = self.backend.load()
+        shadow._reindex(recipes)
+        for listener in fresh:
+            listener.on_reload(shadow)
+        return shadow
+
+    def _rebuild(self, load: bool):
+        # Полная перестройка без остановки loop (20 тыс. рецептов — секунды): копии производных структур
+        # собираются в потоке по снимку каталога (load — по каталогу, заново прочитанному из хранилища)
+        # и подменяют рабочие. Что поменялось в каталоге за время сборки, доигрывается поверх через
+        # on_delete/on_add. До подмены поиск работает по старым структурам: новых рецептов в нём ещё нет,
+        # но и ошибок нет. copy.copy сохраняет настройки структуры (k и т.п.), данные on_reload заводит заново.
+        # Снимок и учёт изменений — сразу, при вызове: задача с корутиной может стартовать позже.
+        fresh = [copy.copy(listener) for listener in self._listeners]
+        touched: Set[int] = set()
+        self._touched.append(touched)
+        return self._swap_in(None if load else self.all(), fresh, touched, self._generation)
+
+    async def _swap_in(self, recipes: Optional[List[Recipe]], fresh: list, touched: Set[int], generation: int) -> None:
+        load = recipes is None
+        try:
+            if load and self.writer is not None:
+                # чтение хранилища не пересекается с фоновой записью
+                async with self.writer._lock:
+                    shadow = await asyncio.to_thread(self._build, recipes, fresh)
+            else:
+                shadow = await asyncio.to_thread(self._build, recipes, fresh)
+        finally:
+            self._touched.remove(touched)
+        if generation != self._generation:
+            return   # каталог за это время перечитан целиком, структуры уже собраны по нему
+        changes = [(shadow.get(rid), self._by_id.get(rid)) for rid in touched]
+        changes = [(old, r) for old, r in changes if old is not r]
+        if load:
+            # свои изменения за время чтения новее прочитанного
+            for old, r in changes:
+                if r is None:
+                    shadow._remove(old.id)
+                else:
+                    shadow._place(r)
+            self._by_id, self._slots, self._slot_of, self._live = (
+                shadow._by_id, shadow._slots, shadow._slot_of, shadow._live)
+            self.next_id = max(self.next_id, shadow.next_id, max(self._by_id, default=0) + 1)
+            self.version += 1
+            self._generation += 1
+            self.source = "storage"
+            self._changed()
+        for listener, built in zip(self._listeners, fresh):
+            vars(listener).update(vars(built))
+            for old, r in changes:
+                if old is not None:
+                    listener.on_delete(old)
+                if r is not None:
+                    listener.on_add(r)
+
+    def delete(self, rid: int) -> Optional[Recipe]:
+        if rid not in self._by_id:
+            return None
+        r = self._remove(rid)
+        self.backend.record_delete(rid)
+        self._changed()
+        return r
+
+    def _changed(self) -> None:
+        if self.cache is not None:
+            self.cache.schedule()
+        if self.writer is not None:
+            self.writer.schedule()
+        else:
+            self.save()
+
+    @timed("save")
+    def save(self) -> None:
+        write = self.backend.prepare(self)
+        try:
+            write()
+        except STORAGE_ERRORS:
+            self.backend.finish(False)
+            raise
+        self.backend.finish(True)
+
+    def export(self, path: str = DATA_FILE, fmt: Optional[str] = None) -> None:
+        # выгрузка в формат recipes.json или JSON Lines (по расширению .jsonl), в любом режиме хранения
+        save_recipes(self.all(), path, fmt or export_format(path))
+
+
+class RecipeWriter:
+    # Фоновая запись каталога: сериализация и запись идут в отдельном потоке, а не в event loop.
+    # Пачка изменений за SAVE_DEBOUNCE секунд превращается в одну запись; на выключении — flush().
+    def __init__(self, store: RecipeStore, delay: float = SAVE_DEBOUNCE):
+        self.store = store
+        self.delay = delay
+        self._dirty = False
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    def schedule(self) -> None:
+        self._dirty = True
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self) -> None:
+        while self._dirty:
+            await asyncio.sleep(self.delay)
+            try:
+                await self.flush()
+            except STORAGE_ERRORS:
+                logger.exception("Не удалось сохранить %s, повторю позже", self.store.backend)
+
+    @timed("flush")
+    async def flush(self) -> None:
+        async with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            # снимок берём в event loop (Recipe после создания не меняются), пишем — в потоке
+            backend = self.store.backend
+            write = backend.prepare(self.store)
+            self.store._writing = True
+            try:
+                await asyncio.to_thread(write)
+            except STORAGE_ERRORS:
+                backend.finish(False)
+                self._dirty = True
+                raise
+            else:
+                backend.finish(True)
+            finally:
+                self.store._writing = False
+
+    async def close(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        await self.flush()
+
+
+# ---- startup ----
+# Кэш холодного старта. Полная загрузка — это разбор каталога и пересборка индексов заново
+# (на 100 тыс. рецептов — токенизация на десятки секунд). Кэш — бинарный файл с таблицей рецептов
+# и состоянием производных структур (поиск, похожие, "что приготовить"); файл открывается через
+# mmap, большие словари индексов остаются в нём и читаются по ключу при первом обращении.
+# Кэш годен, пока совпадают метка хранилища (backend.state()), код бота и версия Python;
+# иначе — обычная загрузка, а новый кэш собирает отдельный процесс (python botAdmin.py startup-cache).
+# Формат: CACHE_MAGIC, смещение и длина заголовка (marshal: метки, где лежат секции), дальше секции.
+CACHE_MAGIC = b"RCPCACHE"
+_CACHE_HEAD = struct.Struct("<8sQQ")
+_OFFSETS = struct.Struct("<2Q")
+_KEY_INT_BIAS = 1 << 63   # int-ключи — 8 байт big-endian со сдвигом, чтобы байтовый порядок совпадал с числовым
+_ABSENT = object()
+
+
+def _code_checksum() -> int:
+    # индексы зависят от кода (токенизация, веса) — кэш, собранный другой версией бота, не годится
+    with open(os.path.abspath(__file__), "rb") as f:
+        return zlib.crc32(f.read())
+
+
+def _encode_key(key) -> bytes:
+    if type(key) is int:
+        return (key + _KEY_INT_BIAS).to_bytes(8, "big")
+    return key.encode("utf-8")
+
+
+def _write_table(f, items: List[bytes]) -> Tuple[int, int]:
+    # n байтовых строк подряд: n+1 смещений u64, за ними сами строки
+    pos = f.tell()
+    offsets = list(itertools.accumulate((len(x) for x in items), initial=0))
+    f.write(struct.pack(f"<{len(offsets)}Q", *offsets))
+    f.writelines(items)
+    return pos, len(items)
+
+
+class _Table:
+    # таблица _write_table внутри mmap; i-я строка читается с диска только при обращении
+    __slots__ = ("_mm", "_pos", "_data", "n")
+
+    def __init__(self, mm: mmap.mmap, pos: int, n: int):
+        self._mm = mm
+        self._pos = pos
+        self._data = pos + 8 * (n + 1)
+        self.n = n
+
+    def __len__(self) -> int:
+        return self.n
+
+    def __getitem__(self, i: int) -> bytes:
+        start, end = _OFFSETS.unpack_from(self._mm, self._pos + 8 * i)
+        return self._mm[self._data + start:self._data + end]
+
+
+def _table_find(keys: _Table, raw: bytes) -> int:
+    # номер строки raw в отсортированной таблице или -1
+    lo, hi = 0, len(keys)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if keys[mid] < raw:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo if lo < len(keys) and keys[lo] == raw else -1
+
+
+class _CachedSteps:
+    # источник Recipe.steps для рецептов из кэша старта: текст читается из mmap при каждом обращении
+    def __init__(self, ids: _Table, texts: _Table):
+        self._ids = ids
+        self._texts = texts
+
+    def steps(self, rid: int) -> str:
+        i = _table_find(self._ids, _encode_key(rid))
+        return self._texts[i].decode("utf-8") if i >= 0 else ""
+
+
+class FrozenMap(MutableMapping):
+    # Словарь индекса из кэша старта. Ключи — отсортированная таблица в mmap (поиск делением пополам),
+    # значение разбирается marshal'ом при первом обращении и дальше живёт в обычном dict — его можно
+    # менять на месте, как и раньше. Новые ключи и удаления — только в памяти, файл не меняется.
+    # Промахи не запоминаем: их ключи приходят из запросов пользователей и копились бы без предела.
+    def __init__(self, keys: _Table, values: _Table, int_keys: bool):
+        self._keys = keys
+        self._values = values
+        self._key_type = int if int_keys else str
+        self._items: dict = {}   # прочитанные, новые и удалённые (_ABSENT) ключи
+        self._len = len(keys)
+
+    def _decode_key(self, raw: bytes):
+        if self._key_type is int:
+            return int.from_bytes(raw, "big") - _KEY_INT_BIAS
+        return raw.decode("utf-8")
+
+    def _lookup(self, key):
+        if type(key) is not self._key_type:
+            return _ABSENT
+        i = _table_find(self._keys, _encode_key(key))
+        return marshal.loads(self._values[i]) if i >= 0 else _ABSENT
+
+    def __getitem__(self, key):
+        value = self._items.get(key, self)
+        if value is self:
+            value = self._lookup(key)
+            if value is not _ABSENT:
+                self._items[key] = value
+        if value is _ABSENT:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value) -> None:
+        if key not in self:
+            self._len += 1
+        self._items[key] = value
+
+    def __delitem__(self, key) -> None:
+        self[key]
+        self._items[key] = _ABSENT
+        self._len -= 1
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator:
+        items = self._items
+        for i in range(len(self._keys)):
+            key = self._decode_key(self._keys[i])
+            if key not in items:
+                yield key
+        for key, value in list(items.items()):
+            if value is not _ABSENT:
+                yield key
+
+
+def _dump_state(f, obj) -> Dict[str, tuple]:
+    # атрибуты структуры: большой словарь с ключами одного типа — таблицами ключей и значений,
+    # остальное — целиком одним marshal
+    attrs = {}
+    for name, value in vars(obj).items():
+        if isinstance(value, FrozenMap):
+            value = dict(value)
+        key_type = type(next(iter(value))) if type(value) is dict and len(value) >= STARTUP_CACHE_EAGER else None
+        if key_type in (int, str) and all(type(k) is key_type for k in value):
+            keys = sorted(value, key=_encode_key)
+            attrs[name] = ("map", key_type is int,
+                           _write_table(f, [_encode_key(k) for k in keys]),
+                           _write_table(f, [marshal.dumps(value[k]) for k in keys]))
+        else:
+            data = marshal.dumps(value)
+            attrs[name] = ("value", f.tell(), len(data))
+            f.write(data)
+    return attrs
+
+
+def write_startup_cache(store: RecipeStore, path: str) -> None:
+    def write(f) -> None:
+        f.write(_CACHE_HEAD.pack(CACHE_MAGIC, 0, 0))
+        # рецепты — в порядке каталога, ингредиенты номерами INGREDIENTS; шаги — отдельно по id
+        data = marshal.dumps([(r.id, r.title, r._ingredients, r.photo_file_id) for r in store])
+        meta = {
+            "python": sys.version,
+            "code": _code_checksum(),
+            "state": store.backend.state(),
+            "next_id": store.next_id,
+            "recipes": (f.tell(), len(data)),
+        }
+        f.write(data)
+        vocab = marshal.dumps(INGREDIENTS.dump())
+        meta["ingredients"] = (f.tell(), len(vocab))
+        f.write(vocab)
+        by_id = sorted(store, key=lambda r: r.id)
+        meta["steps"] = (_write_table(f, [_encode_key(r.id) for r in by_id]),
+                         _write_table(f, [r.steps.encode("utf-8") for r in by_id]))
+        del by_id
+        meta["indexes"] = {type(listener).__name__: _dump_state(f, listener) for listener in store._listeners}
+        head = marshal.dumps(meta)
+        pos = f.tell()
+        f.write(head)
+        f.seek(0)
+        f.write(_CACHE_HEAD.pack(CACHE_MAGIC, pos, len(head)))
+    atomic_write(path, write, "wb")
+
+
+class CacheImage:
+    # открытый кэш старта: метка хранилища, таблица рецептов, состояние индексов
+    def __init__(self, mm: mmap.mmap, meta: dict):
+        self._mm = mm
+        self.meta = meta
+        self.state = meta["state"]
+        self.next_id = meta["next_id"]
+
+    def _section(self, name: str):
+        pos, size = self.meta[name]
+        return marshal.loads(self._mm[pos:pos + size])
+
+    def recipes(self) -> List[Recipe]:
+        # шаги остаются в файле — Recipe.steps читает их оттуда
+        (ids_pos, n), (texts_pos, _) = self.meta["steps"]
+        steps = _CachedSteps(_Table(self._mm, ids_pos, n), _Table(self._mm, texts_pos, n))
+        remap = INGREDIENTS.merge(self._section("ingredients"))
+        rows = self._section("recipes")
+        if remap is not None:
+            rows = [(rid, title, array("I", [remap[v] for v in memoryview(ingr).cast("I")]).tobytes(), photo)
+                    for rid, title, ingr, photo in rows]
+        return [Recipe.packed(rid, title, ingr, steps, photo) for rid, title, ingr, photo in rows]
+
+    def restore(self, listener) -> None:
+        # вместо on_reload: атрибуты структуры подменяются сохранёнными, код индексов не меняется
+        state = {}
+        for name, spec in self.meta["indexes"][type(listener).__name__].items():
+            if spec[0] == "map":
+                _, int_keys, (keys_pos, n), (values_pos, _) = spec
+                state[name] = FrozenMap(_Table(self._mm, keys_pos, n), _Table(self._mm, values_pos, n), int_keys)
+            else:
+                _, pos, size = spec
+                state[name] = marshal.loads(self._mm[pos:pos + size])
+        vars(listener).update(state)
+
+
+class StartupCache:
+    # Файл кэша старта: open() при загрузке каталога, schedule() после изменений каталога —
+    # пересборка отдельным процессом, когда изменения затихнут на delay секунд (сборка — это полная
+    # загрузка каталога, в event loop бота ей не место). Без event loop (скрипты) не пересобираем.
+    def __init__(self, path: str, delay: float = STARTUP_CACHE_DELAY):
+        self.path = path
+        self.delay = delay
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._task: Optional[asyncio.Task] = None
+        self._again = False
+
+    def __str__(self) -> str:
+        return self.path
+
+    def open(self, listeners: list) -> Optional[CacheImage]:
+        try:
+            with open(self.path, "rb") as f:
+                magic, pos, size = _CACHE_HEAD.unpack(f.read(_CACHE_HEAD.size))
+                if magic != CACHE_MAGIC or not pos:
+                    return None
+                f.seek(pos)
+                meta = marshal.loads(f.read(size))
+                if meta["python"] != sys.version or meta["code"] != _code_checksum():
+                    return None
+                if any(type(listener).__name__ not in meta["indexes"] for listener in listeners):
+                    return None
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, EOFError, KeyError, TypeError, struct.error):
+            logger.warning("Кэш старта %s не читается, загружаю каталог из хранилища", self.path, exc_info=True)
+            return None
+        return CacheImage(mm, meta)
+
+    def schedule(self) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = loop.call_later(self.delay, self._start)
+
+    def _start(self) -> None:
+        self._timer = None
+        if self._task is not None and not self._task.done():
+            self._again = True
+            return
+        self._task = asyncio.get_running_loop().create_task(self._rebuild())
+
+    async def _rebuild(self) -> None:
+        self._again = True
+        while self._again:
+            self._again = False
+            proc = await asyncio.create_subprocess_exec(sys.executable, os.path.abspath(__file__), "startup-cache")
+            code = await proc.wait()
+            if code:
+                logger.warning("Кэш старта %s не пересобран (код выхода %s)", self.path, code)
+
+
+def build_startup_cache(store: RecipeStore, path: str) -> bool:
+    # полная загрузка из хранилища и запись кэша; несколько воркеров не собирают его одновременно
+    lock = f"{path}.lock"
+    try:
+        if time.time() - os.path.getmtime(lock) > STARTUP_CACHE_LOCK_TTL:
+            os.unlink(lock)
+    except FileNotFoundError:
+        pass
+    try:
+        os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        return False
+    try:
+        store.cache = None
+        store.load(readonly=True)
+        write_startup_cache(store, path)
+    finally:
+        os.unlink(lock)
+    return True
+
+
+class StartupReport:
+    # Сколько занял старт, по фазам: импорт модулей, инициализация приложения (persistence, getMe),
+    # загрузка каталога, остальное до готовности — и время до первого ответа пользователю.
+    # В лог, в метрики (bot_startup_seconds) и, если задан STARTUP_LOG, строкой JSON в файл —
+    # чтобы сравнивать релизы (BOT_VERSION) между собой.
+    def __init__(self, started: float):
+        self.started = started
+        self.phases: Dict[str, float] = {}
+        self.answered = False
+        self._last = started
+
+    def mark(self, phase: str) -> None:
+        now = time.perf_counter()
+        self.phases[phase] = now - self._last
+        self._last = now
+
+    def ready(self) -> None:
+        self.mark("ready")
+        logger.info("Старт за %.2f с (каталог: %s, %d рецептов): %s", self._last - self.started,
+                    STORE.source, len(STORE), ", ".join(f"{k} {v:.3f}" for k, v in self.phases.items()))
+
+    def first_response(self) -> None:
+        # апдейты, накопившиеся за время рестарта, приходят сразу — это время и видят пользователи
+        self.answered = True
+        self.phases["first_response"] = time.perf_counter() - self._last
+        self.write()
+
+    def write(self) -> None:
+        if not STARTUP_LOG:
+            return
+        record = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "version": BOT_VERSION,
+            "catalog": STORE.source,
+            "recipes": len(STORE),
+            "ready": round(self._last - self.started, 4),
+            "phases": {k: round(v, 4) for k, v in self.phases.items()},
+        }
+        try:
+            with open(STARTUP_LOG, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError:
+            logger.warning("Не удалось дописать отчёт о старте в %s", STARTUP_LOG, exc_info=True)
+
+
+def startup_summary(path: str) -> str:
+    # медианы по релизам из файла STARTUP_LOG: сколько до готовности и до первого ответа
+    runs: Dict[Tuple[str, str], List[dict]] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            runs.setdefault((record.get("version") or "-", record.get("catalog", "")), []).append(record)
+
+    def median(values: List[float]) -> str:
+        values = sorted(values)
+        return f"{values[len(values) // 2]:.2f}" if values else "-"
+
+    lines = ["версия\tкаталог\tстартов\tготов, с\tпервый ответ, с"]
+    for (version, catalog), records in runs.items():
+        first = [r["ready"] + r["phases"]["first_response"] for r in records if "first_response" in r["phases"]]
+        lines.append(f"{version}\t{catalog}\t{len(records)}\t{median([r['ready'] for r in records])}\t{median(first)}")
+    return "\n".join(lines)
+
+
+STARTUP = StartupReport(STARTED_AT)
+METRICS.describe("bot_startup_seconds", "gauge", "Время старта по фазам (first_response — от готовности до первого ответа)")
+METRICS.collect(lambda: [("bot_startup_seconds", (("phase", k),), v) for k, v in STARTUP.phases.items()])
+
+
+# ---- search ----
+# количества и пояснения не ищем: "(2 шт.)", "(по желанию)", числа
+_QTY_RE = re.compile(r"\([^)]*\)|\d[\d.,/–-]*")
+# в строке ингредиента после тире — количество ("Тунец - 200 г"); в названии это часть имени ("Суп — грибной")
+_DASH_TAIL_RE = re.compile(r"\s[-–—]\s[^\n]*")
+_WORD_RE = re.compile(r"[^\W\d_]+")
+UNIT_WORDS = frozenset({"гр", "кг", "мл", "шт", "ст", "ч"})
+
+TITLE_WEIGHT = 3      # совпадение в названии весит больше, чем в ингредиентах
+INGR_WEIGHT = 1
+FUZZY_WEIGHT = 0.3    # множитель для совпадений "с опечаткой"
+FUZZY_MAX_TERMS = 20  # сколько ближайших слов словаря брать на одно слово запроса
+
+SIMILAR_TOP_K = 5         # сколько похожих рецептов хранить и показывать
+SIMILAR_COMMON_DF = 200   # слово из стольких рецептов (соль, вода) кандидатов не даёт, только уточняет оценку
+SIMILAR_COMMON_SCAN = 2000  # ...если редких слов не хватило: столько рецептов добираем из самых редких частых
+RANDOM_FROM_FAVS = 0.5    # доля "случайных" рецептов, подобранных по избранному (если оно есть)
+
+PANTRY_RESULTS = 10       # сколько рецептов показывать в "Что приготовить?"
+PANTRY_DENSE_MIN = 64     # ингредиент из стольких рецептов держим готовым битсетом, более редкие — множеством
+PANTRY_MISSING_SHOWN = 5
+OPTIONAL_RE = re.compile(r"по\s+вкусу|по\s+желанию|для\s+подачи|для\s+украшения|необязательно|опционально")
+MEASURE_STEMS = frozenset({"ложк", "ложек", "стакан", "пучок", "пучк", "щепотк", "зубчик", "зубчк", "банк", "упаковк", "г", "л"})
+
+
+def normalize_text(text: str) -> str:
+    return text.casefold().replace("ё", "е")
+
+
+def tokenize(text: str) -> List[str]:
+    words = _WORD_RE.findall(_QTY_RE.sub(" ", normalize_text(text)))
+    return list(dict.fromkeys(w for w in words if len(w) > 1 and w not in UNIT_WORDS))
+
+
+def ingredient_tokens(line: str) -> List[str]:
+    return tokenize(_DASH_TAIL_RE.sub(" ", line))
+
+
+def typo_budget(word: str) -> int:
+    # сколько опечаток прощаем в зависимости от длины слова
+    if len(word) < 4:
+        return 0
+    if len(word) < 8:
+        return 1
+    return 2
+
+
+class SearchIndex:
+    # Обратный индекс: токен -> {rid: вес}. Строится один раз из STORE и дальше
+    # обновляется на добавлении/удалении. Словарь токенов отсортирован — префиксы ищем bisect'ом.
+    def __init__(self):
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._terms_of: Dict[int, List[str]] = {}
+        self._vocab: List[str] = []
+
+    def _add_term(self, t: str) -> None:
+        bisect.insort(self._vocab, t)
+
+    def _drop_term(self, t: str) -> None:
+        del self._vocab[bisect.bisect_left(self._vocab, t)]
+
+    def _recipe_terms(self, r: Recipe) -> Dict[str, int]:
+        terms: Dict[str, int] = {}
+        for ing in r.ingredients:
+            for t in ingredient_tokens(ing):
+                terms[t] = INGR_WEIGHT
+        for t in tokenize(r.title):
+            terms[t] = terms.get(t, 0) + TITLE_WEIGHT
+        return terms
+
+    def _index(self, r: Recipe) -> None:
+        terms = self._recipe_terms(r)
+        for t, w in terms.items():
+            postings = self._postings.get(t)
+            if postings is None:
+                postings = self._postings[t] = {}
+                self._add_term(t)
+            postings[r.id] = w
+        self._terms_of[r.id] = list(terms)
+
+    def _unindex(self, rid: int) -> None:
+        for t in self._terms_of.pop(rid, []):
+            postings = self._postings[t]
+            postings.pop(rid, None)
+            if not postings:
+                del self._postings[t]
+                self._drop_term(t)
+
+    def on_reload(self, store: "RecipeStore") -> None:
+        self._postings = {}
+        self._terms_of = {}
+        self._vocab = []
+        for r in store:
+            terms = self._recipe_terms(r)
+            for t, w in terms.items():
+                self._postings.setdefault(t, {})[r.id] = w
+            self._terms_of[r.id] = list(terms)
+        self._vocab = sorted(self._postings)
+
+    def on_add(self, r: Recipe) -> None:
+        self._index(r)
+
+    def on_delete(self, r: Recipe) -> None:
+        self._unindex(r.id)
+
+    def _prefix_terms(self, prefix: str) -> Iterator[str]:
+        i = bisect.bisect_left(self._vocab, prefix)
+        while i < len(self._vocab) and self._vocab[i].startswith(prefix):
+            yield self._vocab[i]
+            i += 1
+
+    def _fuzzy_walk(self, qt: str, limit: int, found: Dict[str, int]) -> None:
+        # Обходим отсортированный словарь как префиксное дерево (узел — диапазон слов
+        # с общим префиксом, дети — bisect'ом) и ведём строку таблицы Левенштейна,
+        # считая только полосу |j - depth| <= limit. Ветку бросаем, как только вся
+        # строка > limit. Если запаса правок в узле уже нет, дальше годятся только
+        # буквы самого запроса — их и ищем, а не перебираем всех детей.
+        # Две опечатки прощаем, только если в первой половине запроса не больше одной:
+        # иначе у корня пришлось бы обойти почти весь словарь.
+        vocab = self._vocab
+        n = len(qt)
+        far = limit + 1
+        half = n // 2
+        stack = [("", [min(j, far) for j in range(n + 1)], limit, 0, len(vocab))]
+        while stack:
+            prefix, row, bound, lo, hi = stack.pop()
+            depth = len(prefix)
+            d = row[n]
+            if d <= bound:
+                if depth == n:
+                    # префикс длины запроса подошёл — подходит всё поддерево; слова в нём
+                    # по алфавиту, так что дальше первых FUZZY_MAX_TERMS в ответ не попадёт
+                    # ничего. Глубже ищем только слова, которые целиком ближе своего префикса.
+                    for t in vocab[lo:min(hi, lo + FUZZY_MAX_TERMS)]:
+                        if found.get(t, far) > d:
+                            found[t] = d
+                    bound = d - 1
+                elif vocab[lo] == prefix and found.get(prefix, far) > d:
+                    found[prefix] = d
+            if depth >= n + bound:
+                continue
+            cap = bound if depth + 1 > half else min(bound, (limit + 1) // 2)
+            first, last = max(1, depth + 1 - bound), min(n, depth + 1 + bound)
+            if hi - lo == 1:
+                # в поддереве одно слово — просто идём по его буквам
+                t = vocab[lo]
+                children = [(t[depth], lo, hi)] if len(t) > depth else []
+            elif min(row) < cap:
+                children = []
+                i = lo + (vocab[lo] == prefix)
+                while i < hi:
+                    c = vocab[i][depth]
+                    j = bisect.bisect_left(vocab, prefix + chr(ord(c) + 1), i, hi)
+                    children.append((c, i, j))
+                    i = j
+            else:
+                children = []
+                for c in {qt[k - 1] for k in range(first, last + 1) if row[k - 1] <= cap}:
+                    i = bisect.bisect_left(vocab, prefix + c, lo, hi)
+                    if i < hi and vocab[i].startswith(prefix + c):
+                        children.append((c, i, bisect.bisect_left(vocab, prefix + chr(ord(c) + 1), i, hi)))
+            for c, i, j in children:
+                cur = [far] * (n + 1)
+                cur[0] = best = min(depth + 1, far)
+                for k in range(first, last + 1):
+                    v = row[k - 1] + (qt[k - 1] != c)
+                    if row[k] < v:
+                        v = row[k] + 1
+                    if cur[k - 1] < v:
+                        v = cur[k - 1] + 1
+                    if v < far:
+                        cur[k] = v
+                        if v < best:
+                            best = v
+                if best <= cap:
+                    stack.append((prefix + c, cur, bound, i, j))
+
+    def _fuzzy_terms(self, qt: str) -> List[Tuple[int, str]]:
+        # Слова словаря не дальше typo_budget правок — от слова целиком или от его
+        # префикса длины запроса ("гречу" -> "гречк(а)"). Сначала ищем с одной
+        # опечаткой: если ближайших уже хватает, дальний (и самый дорогой) обход не нужен.
+        budget = typo_budget(qt)
+        if not self._vocab:
+            return []
+        found: Dict[str, int] = {}
+        for limit in range(1, budget + 1):
+            self._fuzzy_walk(qt, limit, found)
+            if len(found) >= FUZZY_MAX_TERMS:
+                break
+        return sorted((d, t) for t, d in found.items())[:FUZZY_MAX_TERMS]
+
+    def _match(self, qt: str) -> Dict[int, float]:
+        # точное совпадение токена — полный вес, совпадение по префиксу — половина
+        scores: Dict[int, float] = {}
+        for term in self._prefix_terms(qt):
+            k = 1.0 if term == qt else 0.5
+            for rid, w in self._postings[term].items():
+                if w * k > scores.get(rid, 0):
+                    scores[rid] = w * k
+        if scores:
+            return scores
+        # ничего не нашли — пробуем с опечатками; чем дальше слово, тем меньше вес
+        for d, term in self._fuzzy_terms(qt):
+            k = FUZZY_WEIGHT / d
+            for rid, w in self._postings[term].items():
+                if w * k > scores.get(rid, 0):
+                    scores[rid] = w * k
+        return scores
+
+    @timed("search")
+    def query(self, text: str) -> List[int]:
+        qtokens = tokenize(text)
+        if not qtokens:
+            return []
+        # все слова запроса должны найтись (AND); пересекаем начиная с самого редкого
+        per_token = sorted((self._match(qt) for qt in qtokens), key=len)
+        result = dict(per_token[0])
+        for scores in per_token[1:]:
+            if not result:
+                break
+            result = {rid: sc + scores[rid] for rid, sc in result.items() if rid in scores}
+        return sorted(result, key=lambda rid: (-result[rid], rid))
+
+
+class SimilarIndex:
+    # Похожие рецепты по ингредиентам. У рецепта — вектор слов ингредиентов с весами idf
+    # (редкое слово важнее "соли"), нормированный; сходство — косинус. Кандидатов перебираем
+    # по обратному индексу, частые слова пропускаем. Список соседей (top-k) считается при первом
+    # запросе рецепта и дальше поддерживается на добавлении/удалении: новый рецепт вставляется
+    # в готовые списки своих кандидатов, удалённый — вызывает пересчёт списков, где он стоял.
+    # Считать все списки на старте дорого (100 тыс. рецептов — полминуты), поэтому лениво.
+    # idf нового рецепта — по текущему каталогу; точнее станет при следующей полной перестройке.
+    def __init__(self, k: int = SIMILAR_TOP_K):
+        self.k = k
+        self._vectors: Dict[int, Dict[str, float]] = {}
+        self._postings: Dict[str, Set[int]] = {}
+        self._neighbours: Dict[int, List[Tuple[float, int]]] = {}
+        self._listed_in: Dict[int, Set[int]] = {}   # rid -> в чьих списках соседей он стоит
+
+    @staticmethod
+    def _terms(r: Recipe) -> List[str]:
+        return list(dict.fromkeys(t for ing in r.ingredients for t in ingredient_tokens(ing)))
+
+    def _vector(self, terms: List[str], n: int) -> Dict[str, float]:
+        weights = {t: math.log((n + 1) / (len(self._postings.get(t, ())) + 1)) + 1.0 for t in terms}
+        norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+        return {t: w / norm for t, w in weights.items()}
+
+    def _scores(self, rid: int) -> Dict[int, float]:
+        vec = self._vectors[rid]
+        scores: Dict[int, float] = {}
+        common = []
+        for t, w in vec.items():
+            postings = self._postings[t]
+            if len(postings) > SIMILAR_COMMON_DF:
+                common.append((t, w))
+                continue
+            for c in postings:
+                if c != rid:
+                    scores[c] = scores.get(c, 0.0) + w * self._vectors[c][t]
+        if len(scores) < self.k and common:
+            # рецепт из одних частых слов (блины, омлет) иначе остался бы без соседей:
+            # кандидатов берём из самых редких его слов, но не больше SIMILAR_COMMON_SCAN
+            budget = SIMILAR_COMMON_SCAN
+            for t, _ in sorted(common, key=lambda x: len(self._postings[x[0]])):
+                for c in itertools.islice(self._postings[t], budget):
+                    if c != rid:
+                        scores.setdefault(c, 0.0)
+                budget -= len(self._postings[t])
+                if budget <= 0:
+                    break
+        if common:
+            for c in scores:
+                other = self._vectors[c]
+                scores[c] += sum(w * other.get(t, 0.0) for t, w in common)
+        return scores
+
+    def _top(self, scores: Dict[int, float]) -> List[Tuple[float, int]]:
+        return [(sc, c) for c, sc in heapq.nsmallest(self.k, scores.items(), key=lambda x: (-x[1], x[0]))]
+
+    def _set_list(self, rid: int, ranked: List[Tuple[float, int]]) -> None:
+        for _, c in self._neighbours.get(rid, ()):
+            listed = self._listed_in.get(c)
+            if listed is not None:   # None — c только что удалён
+                listed.discard(rid)
+        self._neighbours[rid] = ranked
+        for _, c in ranked:
+            self._listed_in.setdefault(c, set()).add(rid)
+
+    def on_reload(self, store: "RecipeStore") -> None:
+        self._vectors = {}
+        self._postings = {}
+        self._neighbours = {}
+        self._listed_in = {}
+        terms_of = {r.id: self._terms(r) for r in store}
+        for rid, terms in terms_of.items():
+            for t in terms:
+                self._postings.setdefault(t, set()).add(rid)
+        for rid, terms in terms_of.items():
+            self._vectors[rid] = self._vector(terms, len(terms_of))
+
+    def on_add(self, r: Recipe) -> None:
+        terms = self._terms(r)
+        self._vectors[r.id] = self._vector(terms, len(self._vectors) + 1)
+        for t in terms:
+            self._postings.setdefault(t, set()).add(r.id)
+        if not self._neighbours:
+            return
+        # сходство симметрично: новый рецепт может вытеснить последнего соседа у своих кандидатов
+        for c, sc in self._scores(r.id).items():
+            ranked = self._neighbours.get(c)
+            if ranked is None:
+                continue
+            if len(ranked) < self.k or (sc, -r.id) > (ranked[-1][0], -ranked[-1][1]):
+                ranked = sorted(ranked + [(sc, r.id)], key=lambda x: (-x[0], x[1]))[:self.k]
+                self._set_list(c, ranked)
+
+    def on_delete(self, r: Recipe) -> None:
+        vec = self._vectors.pop(r.id, None)
+        if vec is None:
+            return
+        for t in vec:
+            postings = self._postings[t]
+            postings.discard(r.id)
+            if not postings:
+                del self._postings[t]
+        if r.id in self._neighbours:
+            self._set_list(r.id, [])
+            del self._neighbours[r.id]
+        # у кого он был соседом — тем список пересчитываем заново
+        for c in self._listed_in.pop(r.id, ()):
+            self._set_list(c, self._top(self._scores(c)))
+
+    def similar(self, rid: int) -> List[int]:
+        ranked = self._neighbours.get(rid)
+        if ranked is None:
+            if rid not in self._vectors:
+                return []
+            ranked = self._top(self._scores(rid))
+            self._set_list(rid, ranked)
+        return [c for _, c in ranked]
+
+    def suggest(self, fav_ids: List[int]) -> Optional[int]:
+        # "случайный, но в твоём вкусе": сосед случайного рецепта из избранного, которого там ещё нет
+        favs = set(fav_ids)
+        for rid in random.sample(fav_ids, min(len(fav_ids), 5)):
+            fresh = [c for c in self.similar(rid) if c not in favs]
+            if fresh:
+                return random.choice(fresh)
+        return None
+
+
+def stem(word: str) -> str:
+    # грубая основа, чтобы "яйца"/"яйцо" и "мука"/"муки" совпадали
+    return word[:-1] if len(word) > 3 and word[-1] in "аеиоуыэюяьй" else word
+
+
+def ingredient_name(text: str) -> Tuple[str, bool]:
+    # "Яйца (2 шт.)" -> ("яйц", False); "Сметана (для подачи) - по вкусу" -> ("сметан", True).
+    # Количества и единицы выбрасываются, порядок слов не важен ("лук репчатый" = "репчатый лук").
+    text = normalize_text(text)
+    optional = OPTIONAL_RE.search(text) is not None
+    if optional:
+        text = OPTIONAL_RE.sub(" ", text)
+    stems = sorted({stem(w) for w in ingredient_tokens(text)} - MEASURE_STEMS)
+    return " ".join(stems), optional
+
+
+def recipe_ingredients(r: Recipe) -> Iterator[Tuple[str, str, bool]]:
+    # (название, как показывать, по желанию ли); в одной строке бывает несколько ингредиентов построчно
+    for ing in r.ingredients:
+        for line in ing.splitlines():
+            name, optional = ingredient_name(line)
+            if name:
+                shown = _QTY_RE.sub(" ", _DASH_TAIL_RE.sub(" ", line))
+                yield name, " ".join(shown.split()).strip(" -–—,.;:"), optional
+
+
+def _bitset(slots) -> int:
+    buf = bytearray((max(slots) >> 3) + 1 if slots else 0)
+    for slot in slots:
+        buf[slot >> 3] |= 1 << (slot & 7)
+    return int.from_bytes(buf, "little")
+
+
+class PantryIndex:
+    # "Что приготовить из того, что есть". Словарь нормализованных ингредиентов (id по названию),
+    # у каждого ингредиента — битсет рецептов, где он обязателен (бит = слот рецепта в индексе).
+    # Запрос складывает битсеты всех ингредиентов, покрытых продуктами пользователя, в побитовых
+    # счётчиках (bit-sliced): несколько операций над целым int на ингредиент — и у каждого
+    # рецепта каталога есть число покрытых ингредиентов. Дальше группы "покрыто c из n" берутся
+    # по убыванию доли c/n. Редкие ингредиенты хранятся множеством слотов, в битсет — на запросе.
+    def __init__(self):
+        self._vocab: Dict[str, int] = {}
+        self._stems_of: List[frozenset] = []
+        self._with_stem: Dict[str, Set[int]] = {}
+        self._slots_of: Dict[int, Set[int]] = {}
+        self._bits: Dict[int, int] = {}
+        self._by_count: Dict[int, int] = {}              # n обязательных ингредиентов -> битсет рецептов
+        self._required: Dict[int, Tuple[int, ...]] = {}
+        self._slot_of: Dict[int, int] = {}
+        self._rid_at: List[Optional[int]] = []
+        self._free: List[int] = []
+
+    def _name_id(self, name: str) -> int:
+        vid = self._vocab.get(name)
+        if vid is None:
+            vid = self._vocab[name] = len(self._stems_of)
+            stems = frozenset(name.split())
+            self._stems_of.append(stems)
+            for st in stems:
+                self._with_stem.setdefault(st, set()).add(vid)
+        return vid
+
+    def _insert(self, r: Recipe, incremental: bool) -> None:
+        names = dict.fromkeys(name for name, _, optional in recipe_ingredients(r) if not optional)
+        vids = tuple(self._name_id(name) for name in names)
+        if self._free:
+            slot = self._free.pop()
+            self._rid_at[slot] = r.id
+        else:
+            slot = len(self._rid_at)
+            self._rid_at.append(r.id)
+        self._slot_of[r.id] = slot
+        self._required[r.id] = vids
+        for vid in vids:
+            slots = self._slots_of.setdefault(vid, set())
+            slots.add(slot)
+            if not incremental:
+                continue
+            if vid in self._bits:
+                self._bits[vid] |= 1 << slot
+            elif len(slots) >= PANTRY_DENSE_MIN:
+                self._bits[vid] = _bitset(slots)
+        if incremental and vids:
+            self._by_count[len(vids)] = self._by_count.get(len(vids), 0) | 1 << slot
+
+    def on_reload(self, store: "RecipeStore") -> None:
+        self.__init__()
+        for r in store:
+            self._insert(r, incremental=False)
+        self._bits = {vid: _bitset(slots) for vid, slots in self._slots_of.items() if len(slots) >= PANTRY_DENSE_MIN}
+        groups: Dict[int, List[int]] = {}
+        for rid, vids in self._required.items():
+            if vids:
+                groups.setdefault(len(vids), []).append(self._slot_of[rid])
+        self._by_count = {n: _bitset(slots) for n, slots in groups.items()}
+
+    def on_add(self, r: Recipe) -> None:
+        self._insert(r, incremental=True)
+
+    def on_delete(self, r: Recipe) -> None:
+        slot = self._slot_of.pop(r.id, None)
+        if slot is None:
+            return
+        vids = self._required.pop(r.id)
+        keep = ~(1 << slot)
+        for vid in vids:
+            self._slots_of[vid].discard(slot)
+            if vid in self._bits:
+                self._bits[vid] &= keep
+        if vids:
+            self._by_count[len(vids)] &= keep
+        self._rid_at[slot] = None
+        self._free.append(slot)
+
+    def match(self, items: List[str]) -> Set[int]:
+        # продукт "лук" покрывает "лук репчатый", а "лук репчатый" — рецептный "лук"
+        covered: Set[int] = set()
+        for item in items:
+            name, _ = ingredient_name(item)
+            stems = set(name.split())
+            if not stems:
+                continue
+            pools = [self._with_stem.get(st, set()) for st in stems]
+            covered |= set.intersection(*pools)
+            covered.update(vid for vid in set().union(*pools) if self._stems_of[vid] <= stems)
+        return covered
+
+    def query(self, covered: Set[int], limit: int = PANTRY_RESULTS) -> List[Tuple[int, int, int]]:
+        # -> [(rid, покрыто, всего обязательных)], лучшие первыми
+        planes: List[int] = []   # planes[i] — i-й разряд счётчика каждого рецепта
+        for vid in covered:
+            carry = self._bits.get(vid)
+            if carry is None:
+                slots = self._slots_of.get(vid)
+                if not slots:
+                    continue
+                carry = _bitset(slots)
+            for i in range(len(planes)):
+                planes[i], carry = planes[i] ^ carry, planes[i] & carry
+                if not carry:
+                    break
+            if carry:
+                planes.append(carry)
+        if not planes:
+            return []
+        combos = sorted(
+            ((c, n) for n in self._by_count for c in range(1, min(n, (1 << len(planes)) - 1) + 1)),
+            key=lambda cn: (-cn[0] / cn[1], cn[1] - cn[0]),
+        )
+        results: List[Tuple[int, int, int]] = []
+        for c, n in combos:
+            group = self._by_count[n]
+            for i, plane in enumerate(planes):
+                group &= plane if (c >> i) & 1 else ~plane
+                if not group:
+                    break
+            while group and len(results) < limit:
+                low = group & -group
+                results.append((self._rid_at[low.bit_length() - 1], c, n))
+                group ^= low
+            if len(results) >= limit:
+                break
+        return results
+
+    def missing(self, r: Recipe, covered: Set[int]) -> List[str]:
+        shown: Dict[str, str] = {}
+        for name, display, optional in recipe_ingredients(r):
+            if not optional and self._vocab.get(name) not in covered:
+                shown.setdefault(name, display)
+        return list(shown.values())
+
+
+# ---- bulk import ----
+@dataclass
+class ImportReport:
+    added: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    duplicates: int = 0
+    invalid: int = 0
+    problems: List[str] = field(default_factory=list)
+
+    def problem(self, where: int, text: str) -> None:
+        self.invalid += 1
+        if len(self.problems) < IMPORT_MAX_ERRORS:
+            self.problems.append(f"#{where}: {text}")
+
+    def summary(self) -> str:
+        lines = [
+            f"Добавлено: {self.added}, обновлено: {self.updated}, без изменений: {self.unchanged}.",
+            f"Пропущено дубликатов: {self.duplicates}, с ошибками: {self.invalid}.",
+        ]
+        lines += self.problems
+        if self.invalid > len(self.problems):
+            lines.append(f"… и ещё {self.invalid - len(self.problems)}")
+        return "\n".join(lines)
+
+
+def validate_record(item) -> Recipe:
+    # те же правила, что у диалога добавления: название, хотя бы один ингредиент и шаги обязательны
+    if not isinstance(item, dict):
+        raise ValueError("ожидался объект с полями title, ingredients, steps")
+    title = item.get("title")
+    if not isinstance(title, str) or not title.strip():
+        raise ValueError("нет названия")
+    ingredients = item.get("ingredients")
+    if isinstance(ingredients, str):
+        ingredients = ingredients.split(",")
+    if not isinstance(ingredients, list) or not all(isinstance(x, str) for x in ingredients):
+        raise ValueError("ingredients — список строк")
+    ingredients = [x.strip() for x in ingredients if x.strip()]
+    if not ingredients:
+        raise ValueError("нет ингредиентов")
+    steps = item.get("steps")
+    if not isinstance(steps, str) or not steps.strip():
+        raise ValueError("нет шагов")
+    rid = item.get("id", 0)
+    if isinstance(rid, bool) or not isinstance(rid, int) or rid < 0:
+        raise ValueError("id — целое число >= 0")
+    photo = item.get("photo_file_id")
+    if photo is not None and not isinstance(photo, str):
+        raise ValueError("photo_file_id — строка")
+    return Recipe(id=rid, title=title.strip(), ingredients=ingredients, steps=steps.strip(), photo_file_id=photo or None)
+
+
+def recipe_key(r: Recipe) -> int:
+    # "тот же рецепт" без учёта регистра и пунктуации: название + ингредиенты
+    return hash((normalize_text(r.title), tuple(normalize_text(x) for x in r.ingredients)))
+
+
+def read_import(store: RecipeStore, f) -> Tuple[List[Recipe], ImportReport]:
+    # Проход по файлу: проверка и дедупликация. Рецепты с id заменяют рецепт с тем же id,
+    # без id — добавляются, если такого же (recipe_key) ещё нет в каталоге и в файле.
+    # Из каталога только читаем, поэтому можно звать в потоке (asyncio.to_thread).
+    report = ImportReport()
+    batch: List[Recipe] = []
+    seen_ids: Set[int] = set()
+    keys: Optional[Set[int]] = None   # строим, только когда встретится первая запись без id
+    for where, item in iter_json_records(f):
+        try:
+            r = validate_record(item)
+        except ValueError as e:
+            report.problem(where, str(e) if item is not None else "некорректный JSON")
+            continue
+        if r.id:
+            if r.id in seen_ids:
+                report.duplicates += 1
+                continue
+            seen_ids.add(r.id)
+            if store.get(r.id) == r:
+                report.unchanged += 1
+                continue
+        else:
+            if keys is None:
+                keys = {recipe_key(x) for x in store.all()}
+                keys.update(recipe_key(x) for x in batch)
+            key = recipe_key(r)
+            if key in keys:
+                report.duplicates += 1
+                continue
+            keys.add(key)
+        if keys is not None and r.id:
+            keys.add(recipe_key(r))
+        batch.append(r)
+    return batch, report
+
+
+def assign_import_ids(store: RecipeStore, batch: List[Recipe]) -> Set[int]:
+    # id рецептам без id; возвращает выданные. Новые id — после всех явных id из файла,
+    # чтобы не занять чужой. С recipes.db — блокирующий вызов (см. reserve_new_ids)
+    fresh = [r for r in batch if not r.id]
+    if not fresh:
+        return set()
+    rid = store.allocate_ids(len(fresh), floor=max(r.id for r in batch) + 1)
+    for r in fresh:
+        r.id = rid
+        rid += 1
+    return {r.id for r in fresh}
+
+
+def count_import(store: RecipeStore, batch: List[Recipe], report: ImportReport, new: Set[int]) -> None:
+    # до add_many: new — id из assign_import_ids, остальные id либо заменяют рецепт, либо новые
+    for r in batch:
+        if r.id in new or store.get(r.id) is None:
+            report.added += 1
+        else:
+            report.updated += 1
+
+
+def import_file(store: RecipeStore, path: str) -> ImportReport:
+    with open(path, "r", encoding="utf-8") as f:
+        batch, report = read_import(store, f)
+    new = assign_import_ids(store, batch)
+    count_import(store, batch, report, new)
+    store.add_many(batch, new)
+    return report
+
+
+STORE = RecipeStore(make_backend())
+if STARTUP_CACHE:
+    STORE.cache = StartupCache(STARTUP_CACHE)
+WRITER = RecipeWriter(STORE)
+SEARCH = SearchIndex()
+STORE.subscribe(SEARCH)
+SIMILAR = SimilarIndex()
+STORE.subscribe(SIMILAR)
+PANTRY = PantryIndex()
+STORE.subscribe(PANTRY)
+
+
+def ensure_favs(context: ContextTypes.DEFAULT_TYPE) -> Dict[int, None]:
+    # favs — упорядоченное множество id (dict в порядке добавления); старые версии хранили list
+    favs = context.user_data.get("favs")
+    if not isinstance(favs, dict):
+        favs = context.user_data["favs"] = dict.fromkeys(favs if isinstance(favs, list) else [])
+    return favs
+
+
+class UserDataFavourites:
+    # Избранное в user_data["favs"] (на диск его сохраняет persistence) + обратный индекс
+    # rid -> пользователи. Добавить/убрать/проверить — O(1), удаление рецепта админом
+    # трогает только тех, у кого он в избранном, а не всех, кто когда-либо писал боту.
+    def __init__(self):
+        self._fans: Dict[int, Set[int]] = {}
+
+    async def attach(self, app: Application) -> None:
+        self._fans = {}
+        for uid, udata in app.user_data.items():
+            favs = udata.get("favs")
+            if isinstance(favs, list):
+                favs = udata["favs"] = dict.fromkeys(favs)
+            for rid in favs or ():
+                self._fans.setdefault(rid, set()).add(uid)
+
+    async def ids(self, context: ContextTypes.DEFAULT_TYPE, user_id: int) -> List[int]:
+        return list(ensure_favs(context))
+
+    async def has(self, context: ContextTypes.DEFAULT_TYPE, user_id: int, rid: int) -> bool:
+        return rid in ensure_favs(context)
+
+    async def add(self, context: ContextTypes.DEFAULT_TYPE, user_id: int, rid: int) -> None:
+        ensure_favs(context)[rid] = None
+        self._fans.setdefault(rid, set()).add(user_id)
+
+    async def remove(self, context: ContextTypes.DEFAULT_TYPE, user_id: int, rid: int) -> None:
+        ensure_favs(context).pop(rid, None)
+        fans = self._fans.get(rid)
+        if fans is not None:
+            fans.discard(user_id)
+            if not fans:
+                del self._fans[rid]
+
+    async def purge(self, app: Application, rid: int) -> None:
+        fans = self._fans.pop(rid, set())
+        for uid in fans:
+            favs = app.user_data.get(uid, {}).get("favs")
+            if favs:
+                favs.pop(rid, None)
+        # чужие user_data persistence сама не сохранит — помечаем их явно
+        if fans:
+            app.mark_data_for_update_persistence(user_ids=fans)
+
+
+class SqliteFavourites:
+    # избранное в таблице favourites
+    def __init__(self, backend: SqliteBackend):
+        self.backend = backend
+
+    async def attach(self, app: Application) -> None:
+        pass
+
+    async def ids(self, context: ContextTypes.DEFAULT_TYPE, user_id: int) -> List[int]:
+        return await asyncio.to_thread(self.backend.fav_ids, user_id)
+
+    async def has(self, context: ContextTypes.DEFAULT_TYPE, user_id: int, rid: int) -> bool:
+        return await asyncio.to_thread(self.backend.fav_has, user_id, rid)
+
+    async def add(self, context: ContextTypes.DEFAULT_TYPE, user_id: int, rid: int) -> None:
+        await asyncio.to_thread(self.backend.fav_add, user_id, rid)
+
+    async def remove(self, context: ContextTypes.DEFAULT_TYPE, user_id: int, rid: int) -> None:
+        await asyncio.to_thread(self.backend.fav_remove, user_id, rid)
+
+    async def purge(self, app: Application, rid: int) -> None:
+        # не ждём отложенной записи удаления рецепта — избранное чистим сразу
+        await asyncio.to_thread(self.backend.fav_purge, rid)
+
+
+def make_favourites(backend):
+    if isinstance(backend, SqliteBackend):
+        return SqliteFavourites(backend)
+    return UserDataFavourites()
+
+
+FAVS = make_favourites(STORE.backend)
+
+
+# ---- persistence ----
+STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_data (user_id INTEGER PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS chat_data (chat_id INTEGER PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS bot_data (id INTEGER PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS conversations (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    state BLOB NOT NULL,
+    PRIMARY KEY (name, key)
+) WITHOUT ROWID;
+"""
+
+
+class SqlitePersistence(BasePersistence):
+    # Замена PicklePersistence: каждая запись user_data/chat_data — отдельная строка в bot_state.db,
+    # а не один большой pickle на всех. PTB передаёт сюда только пользователей/чаты, которые
+    # участвовали в апдейтах за интервал; из них пишем только тех, чьи данные реально поменялись.
+    # Рецепты в bot_data не сохраняем — они живут в своём хранилище.
+    def __init__(self, path: str = STATE_FILE, legacy_path: str = PERSISTENCE_FILE, update_interval: float = 60):
+        super().__init__(store_data=PersistenceInput(callback_data=False), update_interval=update_interval)
+        self.path = path
+        self.db = SqliteDb(path, STATE_SCHEMA)
+        self._written: Dict[Tuple[str, object], int] = {}   # (таблица, ключ) -> хэш последней записи
+        if os.path.exists(legacy_path) and not self.db.read("SELECT 1 FROM bot_data"):
+            self._import_legacy(legacy_path)
+
+    def _import_legacy(self, legacy_path: str) -> None:
+        with open(legacy_path, "rb") as f:
+            data = pickle.load(f)
+        bot_data = dict(data.get("bot_data") or {})
+        bot_data.pop("recipes", None)
+
+        def apply(conn: sqlite3.Connection) -> None:
+            for table, rows in (("user_data", data.get("user_data")), ("chat_data", data.get("chat_data"))):
+                conn.executemany(
+                    f"INSERT OR REPLACE INTO {table} VALUES (?, ?)",
+                    [(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL)) for key, value in (rows or {}).items()],
+                )
+            conn.execute("INSERT OR REPLACE INTO bot_data VALUES (0, ?)", (pickle.dumps(bot_data, pickle.HIGHEST_PROTOCOL),))
+            for name, states in (data.get("conversations") or {}).items():
+                conn.executemany(
+                    "INSERT OR REPLACE INTO conversations VALUES (?, ?, ?)",
+                    [(name, json.dumps(list(key)), pickle.dumps(state)) for key, state in states.items()],
+                )
+        self.db.transaction(apply)
+
+    def load_table(self, table: str) -> dict:
+        result = {}
+        for key, blob in self.db.read(f"SELECT * FROM {table}"):
+            self._written[(table, key)] = hash(blob)
+            result[key] = pickle.loads(blob)
+        return result
+
+    @timed("persistence_put")
+    def _put(self, table: str, key, data) -> None:
+        # выполняется в потоке; неизменившиеся данные не пишем
+        blob = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+        digest = hash(blob)
+        if self._written.get((table, key)) == digest:
+            return
+        self.db.transaction(lambda conn: conn.execute(f"INSERT OR REPLACE INTO {table} VALUES (?, ?)", (key, blob)))
+        self._written[(table, key)] = digest
+
+    def _drop(self, table: str, key) -> None:
+        self.db.transaction(lambda conn: conn.execute(f"DELETE FROM {table} WHERE rowid = ?", (key,)))
+        self._written.pop((table, key), None)
+
+    async def get_user_data(self) -> Dict[int, dict]:
+        return await asyncio.to_thread(self.load_table, "user_data")
+
+    async def get_chat_data(self) -> Dict[int, dict]:
+        return await asyncio.to_thread(self.load_table, "chat_data")
+
+    async def get_bot_data(self) -> dict:
+        return (await asyncio.to_thread(self.load_table, "bot_data")).get(0, {})
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        rows = await asyncio.to_thread(self.db.read, "SELECT key, state FROM conversations WHERE name = ?", (name,))
+        return {tuple(json.loads(key)): pickle.loads(state) for key, state in rows}
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        await asyncio.to_thread(self._put, "user_data", user_id, data)
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        await asyncio.to_thread(self._put, "chat_data", chat_id, data)
+
+    async def update_bot_data(self, data: dict) -> None:
+        data = {k: v for k, v in data.items() if k != "recipes"}
+        await asyncio.to_thread(self._put, "bot_data", 0, data)
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def update_conversation(self, name: str, key: tuple, new_state) -> None:
+        key_json = json.dumps(list(key))
+        if new_state is None:
+            sql, params = "DELETE FROM conversations WHERE name = ? AND key = ?", (name, key_json)
+        else:
+            sql, params = "INSERT OR REPLACE INTO conversations VALUES (?, ?, ?)", (name, key_json, pickle.dumps(new_state))
+        await asyncio.to_thread(self.db.transaction, lambda conn: conn.execute(sql, params))
+
+    async def drop_user_data(self, user_id: int) -> None:
+        await asyncio.to_thread(self._drop, "user_data", user_id)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        await asyncio.to_thread(self._drop, "chat_data", chat_id)
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    async def flush(self) -> None:
+        await asyncio.to_thread(self.db.close)
+
+
+def format_recipe(r: Recipe) -> str:
+    ingr = "\n".join(f"• {x}" for x in r.ingredients)
+    return f"🍽 {r.title}\n\n🧾 Ингредиенты:\n{ingr}\n\n👩‍🍳 Шаги:\n{r.steps}"
+
+
+T = TypeVar("T")
+
+
+def paginate(items: List[T], page: int, page_size: int) -> Tuple[List[T], int, int]:
+    if page < 1:
+        page = 1
+    total_pages = max(1, (len(items) + page_size - 1) // page_size)
+    if page > total_pages:
+        page = total_pages
+    start = (page - 1) * page_size
+    end = start + page_size
+    return items[start:end], total_pages, page
+
+
+def recipe_actions_keyboard(recipe_id: int, is_fav: bool, is_admin: bool) -> InlineKeyboardMarkup:
+    fav_btn = (
+        InlineKeyboardButton("❌ Убрать из избранного", callback_data=f"{CB_FAV_DEL}{recipe_id}")
+        if is_fav
+        else InlineKeyboardButton("⭐ В избранное", callback_data=f"{CB_FAV_ADD}{recipe_id}")
+    )
+
+    rows = [[fav_btn], [InlineKeyboardButton("🔗 Похожие рецепты", callback_data=f"{CB_SIMILAR}{recipe_id}")]]
+
+    if is_admin:
+        rows.append([InlineKeyboardButton("🗑 Удалить рецепт", callback_data=f"{CB_DEL_ASK}{recipe_id}")])
+
+    rows.append([
+        InlineKeyboardButton("📚 Каталог", callback_data=f"{CB_CAT_PAGE}1"),
+        InlineKeyboardButton("⭐ Избранное", callback_data=f"{CB_FAV_SHOW_PAGE}1"),
+    ])
+    return InlineKeyboardMarkup(rows)
+
+
+def catalog_keyboard(store: RecipeStore, page: int) -> InlineKeyboardMarkup:
+    page_items, total_pages, page = store.page(page, CAT_PAGE_SIZE)
+
+    rows = []
+    for r in page_items:
+        rows.append([InlineKeyboardButton(r.title, callback_data=f"{CB_CAT_SHOW}{r.id}")])
+
+    nav = []
+    if page > 1:
+        nav.append(InlineKeyboardButton("⬅️", callback_data=f"{CB_CAT_PAGE}{page-1}"))
+    nav.append(InlineKeyboardButton(f"{page}/{total_pages}", callback_data="noop"))
+    if page < total_pages:
+        nav.append(InlineKeyboardButton("➡️", callback_data=f"{CB_CAT_PAGE}{page+1}"))
+    rows.append(nav)
+
+    return InlineKeyboardMarkup(rows)
+
+
+def keyset_catalog_keyboard(rows: List[Tuple[int, str]], page: int, total_pages: int,
+                            has_prev: bool, has_next: bool) -> InlineKeyboardMarkup:
+    # страница из SqliteBackend.catalog_page: стрелки несут id крайних рецептов страницы
+    buttons = [[InlineKeyboardButton(title, callback_data=f"{CB_CAT_SHOW}{rid}")] for rid, title in rows]
+
+    nav = []
+    if has_prev and rows:
+        nav.append(InlineKeyboardButton("⬅️", callback_data=f"{CB_CAT_PAGE}{page-1}<{rows[0][0]}"))
+    nav.append(InlineKeyboardButton(f"{page}/{total_pages}", callback_data="noop"))
+    if has_next and rows:
+        nav.append(InlineKeyboardButton("➡️", callback_data=f"{CB_CAT_PAGE}{page+1}>{rows[-1][0]}"))
+    buttons.append(nav)
+
+    return InlineKeyboardMarkup(buttons)
+
+
+def favs_keyboard(store: RecipeStore, fav_ids: List[int], page: int) -> InlineKeyboardMarkup:
+    # id удалённых (или пропавших после перезагрузки каталога) рецептов не показываем и страницы
+    # по ним не считаем — иначе страницы выходят короткими или пустыми
+    recipes = [r for r in map(store.get, fav_ids) if r]
+    page_recipes, total_pages, page = paginate(recipes, page, FAV_PAGE_SIZE)
+
+    rows = [[InlineKeyboardButton(r.title, callback_data=f"{CB_FAV_SHOW_ITEM}{r.id}")] for r in page_recipes]
+
+    nav = []
+    if page > 1:
+        nav.append(InlineKeyboardButton("⬅️", callback_data=f"{CB_FAV_SHOW_PAGE}{page-1}"))
+    nav.append(InlineKeyboardButton(f"{page}/{total_pages}", callback_data="noop"))
+    if page < total_pages:
+        nav.append(InlineKeyboardButton("➡️", callback_data=f"{CB_FAV_SHOW_PAGE}{page+1}"))
+    rows.append(nav)
+
+    rows.append([InlineKeyboardButton("📚 Каталог", callback_data=f"{CB_CAT_PAGE}1")])
+    return InlineKeyboardMarkup(rows)
+
+
+def search_keyboard(hits: List[int], page: int) -> InlineKeyboardMarkup:
+    page_ids, total_pages, page = paginate(hits, page, SEARCH_PAGE_SIZE)
+
+    rows = []
+    for rid in page_ids:
+        r = STORE.get(rid)
+        if r:
+            rows.append([InlineKeyboardButton(r.title, callback_data=f"{CB_CAT_SHOW}{r.id}")])
+
+    nav = []
+    if page > 1:
+        nav.append(InlineKeyboardButton("⬅️", callback_data=f"{CB_SEARCH_PAGE}{page-1}"))
+    nav.append(InlineKeyboardButton(f"{page}/{total_pages}", callback_data="noop"))
+    if page < total_pages:
+        nav.append(InlineKeyboardButton("➡️", callback_data=f"{CB_SEARCH_PAGE}{page+1}"))
+    rows.append(nav)
+
+    return InlineKeyboardMarkup(rows)
+
+
+def similar_keyboard(rids: List[int]) -> InlineKeyboardMarkup:
+    rows = []
+    for rid in rids:
+        r = STORE.get(rid)
+        if r:
+            rows.append([InlineKeyboardButton(r.title, callback_data=f"{CB_CAT_SHOW}{r.id}")])
+    rows.append([InlineKeyboardButton("📚 Каталог", callback_data=f"{CB_CAT_PAGE}1")])
+    return InlineKeyboardMarkup(rows)
+
+
+class RenderCache:
+    # LRU готовых текстов рецептов и клавиатур. Они одинаковы для всех, пока не поменялся каталог,
+    # поэтому при смене STORE.version кэш сбрасывается целиком.
+    # Ключи: ("text", rid), ("cat", page), ("actions", rid, is_fav, is_admin), ("similar", rid).
+    # С ttl запись ещё и живёт не дольше ttl секунд (inline-результаты: горячие запросы, короткая жизнь).
+    def __init__(self, store: RecipeStore, maxsize: int = RENDER_CACHE_SIZE, ttl: Optional[float] = None):
+        self.store = store
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items: "OrderedDict[tuple, Tuple[object, float]]" = OrderedDict()
+        self._version = store.version
+
+    def _lookup(self, key: tuple):
+        # значение или _ABSENT (нет или устарело)
+        if self._version != self.store.version:
+            self._items.clear()
+            self._version = self.store.version
+        item = self._items.get(key)
+        if item is None or (self.ttl is not None and time.monotonic() - item[1] > self.ttl):
+            self.misses += 1
+            return _ABSENT
+        self.hits += 1
+        self._items.move_to_end(key)
+        return item[0]
+
+    def _put(self, key: tuple, value) -> None:
+        self._items[key] = (value, time.monotonic() if self.ttl is not None else 0.0)
+        self._items.move_to_end(key)
+        if len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def get(self, key: tuple, build):
+        value = self._lookup(key)
+        if value is _ABSENT:
+            value = build()
+            self._put(key, value)
+        return value
+
+    async def get_async(self, key: tuple, build):
+        # build() — корутина (запрос к базе в потоке); если каталог за это время поменялся,
+        # результат отдаём, но не кэшируем
+        value = self._lookup(key)
+        if value is _ABSENT:
+            version = self.store.version
+            value = await build()
+            if self.store.version == version:
+                self._put(key, value)
+        return value
+
+
+RENDER = RenderCache(STORE)
+INLINE_CACHE = RenderCache(STORE, INLINE_CACHE_SIZE, ttl=INLINE_CACHE_TTL)
+METRICS.collect(lambda: [
+    ("bot_cache_requests_total", (("cache", "render"), ("result", "hit")), RENDER.hits),
+    ("bot_cache_requests_total", (("cache", "render"), ("result", "miss")), RENDER.misses),
+    ("bot_cache_requests_total", (("cache", "inline"), ("result", "hit")), INLINE_CACHE.hits),
+    ("bot_cache_requests_total", (("cache", "inline"), ("result", "miss")), INLINE_CACHE.misses),
+    ("bot_recipes", (), len(STORE)),
+])
+
+
+def cached_catalog_keyboard(page: int) -> InlineKeyboardMarkup:
+    return RENDER.get(("cat", page), lambda: catalog_keyboard(STORE, page))
+
+
+_CAT_CURSOR_RE = re.compile(r"(\d+)(?:([<>])(\d+))?")
+
+
+async def catalog_markup(arg: str) -> InlineKeyboardMarkup:
+    # arg — callback_data после "cp:". С recipes.db — keyset-страница из базы (запрос в потоке),
+    # иначе — страница каталога в памяти
+    m = _CAT_CURSOR_RE.fullmatch(arg)
+    page = int(m.group(1)) if m else 1
+    backend = STORE.backend
+    if not isinstance(backend, SqliteBackend):
+        return cached_catalog_keyboard(page)
+
+    async def build() -> InlineKeyboardMarkup:
+        nonlocal page
+        sign, rid = (m.group(2), int(m.group(3))) if m and m.group(2) else (None, 0)
+        if sign == "<":
+            rows, more, total = await asyncio.to_thread(backend.catalog_page, before=rid)
+            has_prev, has_next = more, True
+            if not more:
+                page = 1
+        else:
+            # без курсора ("📚 Каталог", кнопки до перехода на recipes.db) — с начала
+            page = page if sign else 1
+            rows, more, total = await asyncio.to_thread(backend.catalog_page, after=rid)
+            has_prev, has_next = page > 1, more
+            if not rows and rid:
+                # листали за конец (хвост каталога удалили) — последняя страница
+                rows, has_prev, total = await asyncio.to_thread(backend.catalog_page, before=sys.maxsize)
+                page, has_next = max(1, (total + CAT_PAGE_SIZE - 1) // CAT_PAGE_SIZE), False
+        total_pages = max(page, (total + CAT_PAGE_SIZE - 1) // CAT_PAGE_SIZE)
+        return keyset_catalog_keyboard(rows, page, total_pages, has_prev, has_next)
+
+    return await RENDER.get_async(("cat", arg), build)
+
+
+async def search_recipes(q: str) -> List[int]:
+    # С recipes.db — FTS5 (запрос в потоке); опечаток FTS не прощает, тогда — нечёткий поиск по памяти.
+    # id, которых в памяти ещё (или уже) нет, пропускаем: их покажем после refresh
+    if isinstance(STORE.backend, SqliteBackend):
+        hits = [rid for rid in await asyncio.to_thread(STORE.backend.search, q) if STORE.get(rid) is not None]
+        if hits:
+            return hits
+    return SEARCH.query(q)
+
+
+async def recipe_text(r: Recipe) -> str:
+    # с recipes.db шаги (Recipe.steps) — запрос к базе: текст собираем в потоке, не в event loop
+    if isinstance(STORE.backend, SqliteBackend):
+        return await RENDER.get_async(("text", r.id), lambda: asyncio.to_thread(format_recipe, r))
+    return RENDER.get(("text", r.id), lambda: format_recipe(r))
+
+
+def actions_keyboard(rid: int, is_fav: bool, is_admin: bool) -> InlineKeyboardMarkup:
+    return RENDER.get(("actions", rid, is_fav, is_admin), lambda: recipe_actions_keyboard(rid, is_fav, is_admin))
+
+
+def inline_result(r: Recipe, text: str):
+    # с фото — фото из уже загруженного file_id, если текст влезает в подпись; иначе — текстовая статья
+    if r.photo_file_id and len(text) <= MessageLimit.CAPTION_LENGTH:
+        return InlineQueryResultCachedPhoto(
+            id=str(r.id), photo_file_id=r.photo_file_id, title=r.title, caption=text,
+        )
+    if len(text) > MessageLimit.MAX_TEXT_LENGTH:
+        text = text[:MessageLimit.MAX_TEXT_LENGTH - 1] + "…"
+    return InlineQueryResultArticle(
+        id=str(r.id),
+        title=r.title,
+        description=", ".join(r.ingredients)[:100],
+        input_message_content=InputTextMessageContent(text),
+    )
+
+
+async def inline_page(query: str, offset: int) -> Tuple[list, str]:
+    # Ключ — нормализованный запрос ("Курица  Рис" и "курица рис" — одно и то же) и смещение.
+    # Сам список найденных id тоже кэшируется, так что следующие порции не повторяют поиск.
+    q = " ".join(tokenize(query))
+
+    async def find() -> List[int]:
+        return (await search_recipes(q))[:INLINE_MAX_RESULTS]
+
+    async def build() -> Tuple[list, str]:
+        if q:
+            hits = await INLINE_CACHE.get_async(("hits", q), find)
+            ids = hits[offset:offset + INLINE_PAGE_SIZE]
+            total = len(hits)
+        else:
+            # пустой запрос — каталог по порядку
+            total = len(STORE)
+            ids = [STORE.at(k).id for k in range(offset, min(offset + INLINE_PAGE_SIZE, total))]
+        recipes = [r for r in map(STORE.get, ids) if r is not None]
+        texts = await asyncio.gather(*map(recipe_text, recipes))
+        results = [inline_result(r, text) for r, text in zip(recipes, texts)]
+        end = offset + len(ids)
+        return results, (str(end) if end < total else "")
+
+    return await INLINE_CACHE.get_async(("page", q, offset), build)
+
+
+async def send_recipe_message(chat_id: int, context: ContextTypes.DEFAULT_TYPE, r: Recipe, user_id: int) -> None:
+    is_fav = await FAVS.has(context, user_id, r.id)
+    kb = actions_keyboard(r.id, is_fav, is_admin=(user_id == ADMIN_ID))
+    text = await recipe_text(r)
+
+    # Влезает в подпись — одно фото с подписью и кнопками; длинный текст — фото отдельно,
+    # текст отдельно (из-за лимита caption у медиа) [web:9]
+    if r.photo_file_id and len(text) <= MessageLimit.CAPTION_LENGTH:
+        await context.bot.send_photo(chat_id=chat_id, photo=r.photo_file_id, caption=text, reply_markup=kb)
+        return
+    if r.photo_file_id:
+        await context.bot.send_photo(chat_id=chat_id, photo=r.photo_file_id)
+    await context.bot.send_message(chat_id=chat_id, text=text, reply_markup=kb)
+
+
+async def edit_reply_markup(query, kb: InlineKeyboardMarkup, notice: str) -> None:
+    try:
+        await query.edit_message_reply_markup(reply_markup=kb)
+    except BadRequest as e:
+        # двойное нажатие: клавиатура уже такая
+        if "not modified" in str(e).lower():
+            return
+        # сообщение уже не отредактировать (старое или удалено) — сообщаем новым, с теми же кнопками
+        logger.info("Не удалось обновить кнопки (%s), отвечаем новым сообщением", e)
+        await query.get_bot().send_message(chat_id=query.message.chat_id, text=notice, reply_markup=kb)
+
+
+# ---- outbound ----
+class _TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()   # очередь FIFO, чтобы сообщения в чат уходили по порядку
+
+    def delay(self, now: float) -> float:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+class SendScheduler(BaseRateLimiter):
+    # Все исходящие вызовы Bot API проходят здесь. Сообщения и правки ждут токен в общем ведре
+    # (лимит бота) и в ведре своего чата; при 429 все запросы ждут retry_after и повторяются.
+    def __init__(self, global_rate: float = GLOBAL_SEND_RATE):
+        self._global = _TokenBucket(global_rate, global_rate)
+        self._chats: Dict[object, _TokenBucket] = {}
+        self._blocked_until = 0.0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _chat_bucket(self, chat_id) -> _TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                # забываем чаты, чьи ведра давно снова полные
+                now = time.monotonic()
+                self._chats = {k: b for k, b in self._chats.items() if now - b.updated < 60 or b.lock.locked()}
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            bucket = self._chats[chat_id] = (
+                _TokenBucket(GROUP_SEND_RATE, 1) if is_group else _TokenBucket(CHAT_SEND_RATE, CHAT_SEND_BURST)
+            )
+        return bucket
+
+    async def _acquire_global(self) -> None:
+        while True:
+            now = time.monotonic()
+            wait = max(self._blocked_until - now, self._global.delay(now))
+            if wait <= 0:
+                self._global.tokens -= 1
+                return
+            await asyncio.sleep(wait)
+
+    async def _acquire(self, chat_id) -> None:
+        if chat_id is None:
+            await self._acquire_global()
+            return
+        chat = self._chat_bucket(chat_id)
+        async with chat.lock:
+            while True:
+                wait = chat.delay(time.monotonic())
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            await self._acquire_global()
+            chat.tokens -= 1
+
+    @staticmethod
+    async def _timed_call(callback, args, kwargs, endpoint: str):
+        started = time.perf_counter()
+        result = "error"
+        try:
+            response = await callback(*args, **kwargs)
+            result = "ok"
+            return response
+        except RetryAfter:
+            result = "retry_after"
+            raise
+        finally:
+            labels = (("method", endpoint),)
+            METRICS.observe("bot_api_seconds", labels, time.perf_counter() - started, f"api:{endpoint}")
+            METRICS.inc("bot_api_calls_total", labels + (("result", result),))
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        limited = endpoint.startswith(("send", "edit", "copy", "forward"))
+        for attempt in range(SEND_MAX_RETRIES + 1):
+            if limited:
+                if METRICS_ENABLED:
+                    started = time.perf_counter()
+                    await self._acquire(data.get("chat_id"))
+                    METRICS.observe("bot_send_wait_seconds", (), time.perf_counter() - started, "send_wait")
+                else:
+                    await self._acquire(data.get("chat_id"))
+            try:
+                if METRICS_ENABLED:
+                    return await self._timed_call(callback, args, kwargs, endpoint)
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == SEND_MAX_RETRIES:
+                    raise
+                retry = e.retry_after
+                seconds = retry.total_seconds() if isinstance(retry, timedelta) else float(retry)
+                self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+                logger.warning("Flood control: %s, ждём %.0f сек", endpoint, seconds)
+                await asyncio.sleep(seconds)
+
+
+# ---- handlers ----
+async def reserve_new_ids(allocate, *args):
+    # С recipes.db выдача id — транзакция (BEGIN IMMEDIATE), её — в поток. В режимах json/journal
+    # это счётчик в памяти: зовём сразу, чтобы между выдачей id и добавлением рецепта не было await
+    if isinstance(STORE.backend, SqliteBackend):
+        return await asyncio.to_thread(allocate, *args)
+    return allocate(*args)
+
+
+@instrumented
+async def refresh_store(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # дешёвая проверка раз в RELOAD_CHECK_INTERVAL (stat() файла или номер последнего изменения в базе)
+    STORE.refresh()
+
+
+@instrumented
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    ensure_favs(context)
+    await update.message.reply_text("Привет! Выбирай действие 👇", reply_markup=MAIN_KB)
+
+
+@instrumented
+async def myid(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await update.message.reply_text(f"Ваш user_id: {update.effective_user.id}")
+
+
+@instrumented
+async def random_recipe(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not len(STORE):
+        await update.message.reply_text("Рецептов пока нет.", reply_markup=MAIN_KB)
+        return
+    r = None
+    if random.random() < RANDOM_FROM_FAVS:
+        favs = await FAVS.ids(context, update.effective_user.id)
+        if favs:
+            rid = SIMILAR.suggest(favs)
+            r = STORE.get(rid) if rid is not None else None
+    if r is None:
+        r = STORE.random()
+    await send_recipe_message(update.effective_chat.id, context, r, update.effective_user.id)
+    await update.message.reply_text("Что дальше?", reply_markup=MAIN_KB)
+
+
+@instrumented
+async def show_catalog(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await update.message.reply_text(
+        "📚 Каталог рецептов: выбери рецепт или листай страницы.",
+        reply_markup=await catalog_markup("1"),
+    )
+
+
+@instrumented
+async def show_favs(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    favs = await FAVS.ids(context, update.effective_user.id)
+    if not any(map(STORE.get, favs)):
+        await update.message.reply_text("Избранное пустое. Добавь рецепт кнопкой ⭐.", reply_markup=MAIN_KB)
+        return
+    await update.message.reply_text("⭐ Избранное:", reply_markup=favs_keyboard(STORE, favs, page=1))
+
+
+@instrumented
+async def inline_search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.inline_query
+    offset = int(query.offset) if query.offset.isdigit() else 0
+    results, next_offset = await inline_page(query.query, offset)
+    await query.answer(results, cache_time=INLINE_CACHE_TIME, next_offset=next_offset)
+
+
+@instrumented
+async def search_hint(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await update.message.reply_text(
+        "Напиши запрос: название или ингредиент (например: 'курица' или 'омлет').",
+        reply_markup=ReplyKeyboardRemove(),
+    )
+
+
+@instrumented
+async def search_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    q = (update.message.text or "").strip()
+    hits = await search_recipes(q)
+
+    if not hits:
+        await update.message.reply_text("Ничего не нашлось. Попробуй другой запрос.", reply_markup=MAIN_KB)
+        return
+
+    if len(hits) == 1:
+        r = STORE.get(hits[0])
+        await send_recipe_message(update.effective_chat.id, context, r, update.effective_user.id)
+    else:
+        context.user_data["search_q"] = q
+        await update.message.reply_text(f"🔎 Результаты по запросу «{q}»:", reply_markup=search_keyboard(hits, page=1))
+    await update.message.reply_text(f"Нашлось: {len(hits)}.", reply_markup=MAIN_KB)
+
+
+# ---- "что приготовить?" ----
+def pantry_answer(text: str) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    items = [x.strip() for x in re.split(r"[,;\n]+", text) if x.strip()]
+    covered = PANTRY.match(items)
+    hits = PANTRY.query(covered)
+    if not hits:
+        return "Ничего не подобралось. Перечисли продукты через запятую: яйца, молоко, мука.", None
+    lines = ["🧺 Что можно приготовить:"]
+    rows = []
+    for k, (rid, have, total) in enumerate(hits, start=1):
+        r = STORE.get(rid)
+        missing = PANTRY.missing(r, covered)
+        if missing:
+            more = f" и ещё {len(missing) - PANTRY_MISSING_SHOWN}" if len(missing) > PANTRY_MISSING_SHOWN else ""
+            lines.append(f"{k}. {r.title} — есть {have} из {total}, не хватает: "
+                         f"{', '.join(missing[:PANTRY_MISSING_SHOWN])}{more}")
+        else:
+            lines.append(f"{k}. {r.title} — всё есть ✅")
+        rows.append([InlineKeyboardButton(f"{r.title} ({have}/{total})", callback_data=f"{CB_CAT_SHOW}{rid}")])
+    return "\n".join(lines), InlineKeyboardMarkup(rows)
+
+
+@instrumented
+async def cook_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    if context.args:
+        # /cook яйца, молоко, мука — сразу ответ
+        text, kb = pantry_answer(" ".join(context.args))
+        await update.message.reply_text(text, reply_markup=kb or MAIN_KB)
+        return ConversationHandler.END
+    await update.message.reply_text(
+        "Какие продукты есть? Перечисли через запятую (например: яйца, молоко, мука).",
+        reply_markup=ReplyKeyboardRemove(),
+    )
+    return COOK_ITEMS
+
+
+@instrumented
+async def cook_items(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    text, kb = pantry_answer(update.message.text or "")
+    await update.message.reply_text(text, reply_markup=kb)
+    await update.message.reply_text("Что дальше?", reply_markup=MAIN_KB)
+    return ConversationHandler.END
+
+
+# ---- add recipe conversation ----
+@instrumented
+async def add_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    await update.message.reply_text("Название рецепта?", reply_markup=ReplyKeyboardRemove())
+    return ADD_TITLE
+
+
+@instrumented
+async def add_title(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    context.user_data["new_recipe_title"] = (update.message.text or "").strip()
+    await update.message.reply_text("Ингредиенты через запятую:")
+    return ADD_INGR
+
+
+@instrumented
+async def add_ingredients(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    text = (update.message.text or "").strip()
+    context.user_data["new_recipe_ingredients"] = [x.strip() for x in text.split(",") if x.strip()]
+    await update.message.reply_text("Шаги приготовления (текстом):")
+    return ADD_STEPS
+
+
+@instrumented
+async def add_steps(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    context.user_data["new_recipe_steps"] = (update.message.text or "").strip()
+    await update.message.reply_text("Пришли фото блюда (или напиши '-' чтобы пропустить):")
+    return ADD_PHOTO
+
+
+@instrumented
+async def add_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    title = context.user_data.get("new_recipe_title", "").strip()
+    ingredients = context.user_data.get("new_recipe_ingredients", [])
+    steps = context.user_data.get("new_recipe_steps", "").strip()
+
+    if not title or not ingredients or not steps:
+        await update.message.reply_text("Не хватает данных. Начни заново: /start", reply_markup=MAIN_KB)
+        return ConversationHandler.END
+
+    photo_file_id = None
+    if update.message.photo:
+        photo_file_id = update.message.photo[-1].file_id
+    else:
+        text = (update.message.text or "").strip()
+        if text != "-":
+            await update.message.reply_text("Пришли именно фото, или '-' чтобы пропустить.")
+            return ADD_PHOTO
+
+    rid = await reserve_new_ids(STORE.allocate_id)
+    STORE.add(Recipe(id=rid, title=title, ingredients=ingredients, steps=steps, photo_file_id=photo_file_id), new=True)
+
+    await update.message.reply_text("Рецепт добавлен ✅", reply_markup=MAIN_KB)
+    return ConversationHandler.END
+
+
+@instrumented
+async def add_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    await update.message.reply_text("Отменено.", reply_markup=MAIN_KB)
+    return ConversationHandler.END
+
+
+# ---- callbacks ----
+@instrumented
+async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    await query.answer()
+
+    data = query.data or ""
+    chat_id = query.message.chat_id if query.message else None
+    if chat_id is None:
+        return
+
+    user_id = query.from_user.id
+
+    if data == "noop":
+        return
+
+    # ---- Каталог ----
+    if data.startswith(CB_CAT_PAGE):
+        await query.edit_message_text(
+            text="📚 Каталог рецептов: выбери рецепт или листай страницы.",
+            reply_markup=await catalog_markup(data[len(CB_CAT_PAGE):]),
+        )
+        return
+
+    if data.startswith(CB_CAT_SHOW):
+        rid = int(data.replace(CB_CAT_SHOW, ""))
+        r = STORE.get(rid)
+        if r:
+            await send_recipe_message(chat_id, context, r, query.from_user.id)
+        else:
+            await context.bot.send_message(chat_id=chat_id, text="Рецепт не найден (возможно удалён).")
+        return
+
+    if data.startswith(CB_SIMILAR):
+        rid = int(data.replace(CB_SIMILAR, ""))
+        r = STORE.get(rid)
+        if not r:
+            await context.bot.send_message(chat_id=chat_id, text="Рецепт не найден (возможно удалён).")
+            return
+        similar = SIMILAR.similar(rid)
+        if not similar:
+            await context.bot.send_message(chat_id=chat_id, text="Похожих рецептов пока нет.")
+            return
+        kb = RENDER.get(("similar", rid), lambda: similar_keyboard(similar))
+        await context.bot.send_message(chat_id=chat_id, text=f"🔗 Похоже на «{r.title}»:", reply_markup=kb)
+        return
+
+    # ---- Поиск ----
+    if data.startswith(CB_SEARCH_PAGE):
+        page = int(data.replace(CB_SEARCH_PAGE, "") or "1")
+        q = context.user_data.get("search_q", "")
+        hits = await search_recipes(q)
+        if not hits:
+            await context.bot.send_message(chat_id=chat_id, text="Результаты поиска устарели, повтори запрос.")
+            return
+        await query.edit_message_text(text=f"🔎 Результаты по запросу «{q}»:", reply_markup=search_keyboard(hits, page=page))
+        return
+
+    # ---- Избранное ----
+    if data.startswith(CB_FAV_SHOW_PAGE):
+        page = int(data.replace(CB_FAV_SHOW_PAGE, "") or "1")
+        favs = await FAVS.ids(context, user_id)
+        if not any(map(STORE.get, favs)):
+            await context.bot.send_message(chat_id=chat_id, text="Избранное пустое.")
+            return
+        await query.edit_message_text(text="⭐ Избранное:", reply_markup=favs_keyboard(STORE, favs, page=page))
+        return
+
+    if data.startswith(CB_FAV_SHOW_ITEM):
+        rid = int(data.replace(CB_FAV_SHOW_ITEM, ""))
+        r = STORE.get(rid)
+        if r:
+            await send_recipe_message(chat_id, context, r, query.from_user.id)
+        else:
+            await context.bot.send_message(chat_id=chat_id, text="Рецепт не найден (возможно удалён).")
+        return
+
+    # ---- Добавить/убрать избранное ----
+    if data.startswith(CB_FAV_ADD):
+        # меняем кнопку под рецептом вместо отдельного сообщения-подтверждения
+        rid = int(data.replace(CB_FAV_ADD, ""))
+        await FAVS.add(context, user_id, rid)
+        await edit_reply_markup(query, actions_keyboard(rid, True, is_admin=(user_id == ADMIN_ID)), "⭐ Рецепт в избранном.")
+        return
+
+    if data.startswith(CB_FAV_DEL):
+        rid = int(data.replace(CB_FAV_DEL, ""))
+        await FAVS.remove(context, user_id, rid)
+        await edit_reply_markup(query, actions_keyboard(rid, False, is_admin=(user_id == ADMIN_ID)), "Рецепт убран из избранного.")
+        return
+
+    # ---- Удаление (только админ) ----
+    if data.startswith(CB_DEL_ASK):
+        if query.from_user.id != ADMIN_ID:
+            await context.bot.send_message(chat_id=chat_id, text="Нет прав (только админ).")
+            return
+
+        rid = int(data.replace(CB_DEL_ASK, ""))
+        r = STORE.get(rid)
+        if not r:
+            await context.bot.send_message(chat_id=chat_id, text="Рецепт уже удалён.")
+            return
+
+        confirm_kb = InlineKeyboardMarkup([
+            [
+                InlineKeyboardButton("✅ Да, удалить", callback_data=f"{CB_DEL_OK}{rid}"),
+                InlineKeyboardButton("❌ Отмена", callback_data=f"{CB_DEL_NO}{rid}"),
+            ]
+        ])
+        await context.bot.send_message(chat_id=chat_id, text=f"Удалить рецепт «{r.title}»?", reply_markup=confirm_kb)
+        return
+
+    if data.startswith(CB_DEL_NO):
+        await query.edit_message_text(text="Ок, не удаляю.")
+        return
+
+    if data.startswith(CB_DEL_OK):
+        if query.from_user.id != ADMIN_ID:
+            await context.bot.send_message(chat_id=chat_id, text="Нет прав (только админ).")
+            return
+
+        rid = int(data.replace(CB_DEL_OK, ""))
+        r = STORE.get(rid)
+        if not r:
+            await context.bot.send_message(chat_id=chat_id, text="Рецепт уже удалён.")
+            return
+
+        # Удаляем рецепт и сохраняем, потом вычищаем его из избранного
+        STORE.delete(rid)
+        await FAVS.purge(context.application, rid)
+
+        await query.edit_message_text(text=f"Удалено ✅: {r.title}")
+        return
+
+
+# ---- import / export (только админ) ----
+@instrumented
+async def import_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("Нет прав (только админ).")
+        return
+    context.user_data["import_pending"] = True
+    await update.message.reply_text(
+        "Пришли файл с рецептами документом: JSON-массив (как recipes.json) или JSON Lines (.jsonl).\n"
+        "Рецепты с id заменяют существующие, без id — добавляются, повторы пропускаются."
+    )
+
+
+@instrumented
+async def import_document(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    caption = (update.message.caption or "").strip()
+    if not context.user_data.pop("import_pending", False) and not caption.startswith("/import"):
+        await update.message.reply_text("Чтобы загрузить рецепты, сначала отправь /import.", reply_markup=MAIN_KB)
+        return
+    doc = update.message.document
+    if doc.file_size and doc.file_size > FileSizeLimit.FILESIZE_DOWNLOAD:
+        await update.message.reply_text(
+            "Файл больше 20 МБ — бот не может его скачать. Загрузи на сервере: python botAdmin.py import <файл>"
+        )
+        return
+
+    fd, path = tempfile.mkstemp(suffix=".import")
+    os.close(fd)
+    try:
+        tg_file = await context.bot.get_file(doc.file_id)
+        await tg_file.download_to_drive(path)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                batch, report = await asyncio.to_thread(read_import, STORE, f)
+        except (ValueError, UnicodeDecodeError) as e:
+            await update.message.reply_text(f"Не удалось прочитать файл: {e}", reply_markup=MAIN_KB)
+            return
+        new = await reserve_new_ids(assign_import_ids, STORE, batch)
+        count_import(STORE, batch, report, new)
+        await STORE.add_many_async(batch, new)
+    finally:
+        os.remove(path)
+    await update.message.reply_text("Импорт завершён ✅\n" + report.summary(), reply_markup=MAIN_KB)
+
+
+@instrumented
+async def export_catalog(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("Нет прав (только админ).")
+        return
+    fmt = "jsonl" if context.args and context.args[0].lower() == "jsonl" else "json"
+    fd, path = tempfile.mkstemp(suffix="." + fmt)
+    os.close(fd)
+    try:
+        # снимок списка берём в loop, сериализуем и пишем в потоке
+        await asyncio.to_thread(save_recipes, STORE.all(), path, fmt)
+        if os.path.getsize(path) > FileSizeLimit.FILESIZE_UPLOAD:
+            await update.message.reply_text(
+                "Каталог больше 50 МБ — Telegram его не примет. Выгрузи на сервере: python botAdmin.py export <файл>"
+            )
+            return
+        with open(path, "rb") as f:
+            await context.bot.send_document(
+                chat_id=update.effective_chat.id, document=f, filename=f"recipes.{fmt}",
+                caption=f"Рецептов: {len(STORE)}",
+            )
+    finally:
+        os.remove(path)
+
+
+@instrumented
+async def unknown(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await update.message.reply_text("Не понял. Нажми кнопку или /start.", reply_markup=MAIN_KB)
+
+
+def _update_owner(update: object) -> Optional[int]:
+    if isinstance(update, Update):
+        if update.effective_user:
+            return update.effective_user.id
+        if update.effective_chat:
+            return update.effective_chat.id
+    return None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    # Апдейты разных пользователей обрабатываются параллельно, не больше workers одновременно,
+    # а апдейты одного пользователя — строго по очереди: на этом держатся диалог добавления
+    # рецепта (ConversationHandler), переключение избранного и user_data["search_q"].
+    # Общие структуры (STORE, SEARCH, RENDER, избранное) меняются синхронно, без await посередине,
+    # поэтому параллельные обработчики в одном event loop их не рвут; запись на диск —
+    # под замками RecipeWriter/SqliteDb.
+    # Свой семафор берём уже после очереди пользователя: иначе один пользователь, заваливший бота
+    # сообщениями, занял бы все рабочие места, просто ожидая своей очереди.
+    def __init__(self, workers: int = UPDATE_WORKERS):
+        super().__init__(max_concurrent_updates=workers * 16)
+        self._workers = asyncio.BoundedSemaphore(workers)
+        self._queues: Dict[int, Tuple[asyncio.Lock, int]] = {}
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        if not METRICS_ENABLED:
+            await self._process(update, coroutine)
+        else:
+            await self._traced(update, coroutine)
+        if not STARTUP.answered:
+            STARTUP.first_response()
+
+    async def _traced(self, update: object, coroutine) -> None:
+        # фазы апдейта (ожидание очереди, обработчики, хранилище, API) собираются в trace через contextvar
+        trace: List[Tuple[str, float]] = []
+        token = _TRACE.set(trace)
+        started = time.perf_counter()
+        try:
+            await self._process(update, coroutine)
+        finally:
+            total = time.perf_counter() - started
+            _TRACE.reset(token)
+            METRICS.observe("bot_update_seconds", (("type", update_kind(update)),), total)
+            if SLOW_UPDATE_MS and total * 1000 >= SLOW_UPDATE_MS:
+                log_slow_update(update, total, trace)
+
+    async def _process(self, update: object, coroutine) -> None:
+        queued = time.perf_counter()
+        owner = _update_owner(update)
+        if owner is None:
+            async with self._workers:
+                trace_phase("queue", time.perf_counter() - queued)
+                await coroutine
+            return
+
+        lock, waiting = self._queues.get(owner, (None, 0))
+        if lock is None:
+            lock = asyncio.Lock()
+        self._queues[owner] = (lock, waiting + 1)
+        try:
+            async with lock, self._workers:
+                trace_phase("queue", time.perf_counter() - queued)
+                await coroutine
+        finally:
+            lock, waiting = self._queues[owner]
+            if waiting == 1:
+                del self._queues[owner]
+            else:
+                self._queues[owner] = (lock, waiting - 1)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
+async def on_startup(app: Application) -> None:
+    # рецепты грузим один раз; старые версии бота клали весь список в bot_data — он больше не нужен
+    STARTUP.mark("init")
+    STORE.load()
+    STARTUP.mark("catalog")
+    STORE.writer = WRITER
+    app.bot_data.pop("recipes", None)
+    await FAVS.attach(app)
+    if METRICS_PORT:
+        await METRICS.start_server(METRICS_LISTEN, METRICS_PORT)
+    STARTUP.ready()
+
+
+async def on_shutdown(app: Application) -> None:
+    # дописываем на диск то, что ещё ждёт в очереди записи
+    await WRITER.close()
+    METRICS.stop_server()
+    if not STARTUP.answered:
+        STARTUP.write()
+
+
+def read_token() -> str:
+    return os.environ.get("8282470852:AAGrIZ0tO9fRrLlocqO50EF-unbHoJ4taC4") or "8282470852:AAGrIZ0tO9fRrLlocqO50EF-unbHoJ4taC4"
+
+
+def build_application(send_rate: float = GLOBAL_SEND_RATE, updater: bool = True) -> Application:
+    persistence = SqlitePersistence()
+    builder = (
+        Application.builder()
+        .token(read_token())
+        .persistence(persistence)
+        .concurrent_updates(PerUserUpdateProcessor(UPDATE_WORKERS))
+        .rate_limiter(SendScheduler(send_rate))
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    if not updater:
+        builder = builder.updater(None)
+    app = builder.build()
+
+    add_conv = ConversationHandler(
+        entry_points=[MessageHandler(filters.Regex("^➕ Добавить рецепт$"), add_start)],
+        states={
+            ADD_TITLE: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_title)],
+            ADD_INGR: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_ingredients)],
+            ADD_STEPS: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_steps)],
+            ADD_PHOTO: [
+                MessageHandler(filters.PHOTO, add_photo),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, add_photo),
+            ],
+        },
+        fallbacks=[CommandHandler("cancel", add_cancel)],
+    )
+
+    cook_conv = ConversationHandler(
+        entry_points=[
+            MessageHandler(filters.Regex("^🧺 Что приготовить\\?$"), cook_start),
+            CommandHandler("cook", cook_start),
+        ],
+        states={COOK_ITEMS: [MessageHandler(filters.TEXT & ~filters.COMMAND, cook_items)]},
+        fallbacks=[CommandHandler("cancel", add_cancel)],
+    )
+
+    app.add_handler(TypeHandler(Update, refresh_store), group=-1)
+
+    app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("myid", myid))
+
+    app.add_handler(MessageHandler(filters.Regex("^📚 Каталог$"), show_catalog))
+    app.add_handler(CommandHandler("catalog", show_catalog))
+
+    app.add_handler(MessageHandler(filters.Regex("^🍲 Случайный рецепт$"), random_recipe))
+    app.add_handler(CommandHandler("random", random_recipe))
+
+    app.add_handler(MessageHandler(filters.Regex("^⭐ Избранное$"), show_favs))
+    app.add_handler(CommandHandler("favs", show_favs))
+
+    app.add_handler(MessageHandler(filters.Regex("^🔎 Поиск$"), search_hint))
+    app.add_handler(add_conv)
+    app.add_handler(cook_conv)
+
+    app.add_handler(CallbackQueryHandler(on_callback))
+    app.add_handler(InlineQueryHandler(inline_search))
+
+    app.add_handler(CommandHandler("import", import_start))
+    app.add_handler(CommandHandler("export", export_catalog))
+    app.add_handler(MessageHandler(filters.Document.ALL & filters.User(user_id=ADMIN_ID), import_document))
+
+    # Поиск по любому тексту
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, search_text))
+    app.add_handler(MessageHandler(filters.COMMAND, unknown))
+    return app
+
+
+def main() -> None:
+    app = build_application()
+    if BOT_MODE == "webhook":
+        app.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=urlparse(WEBHOOK_URL).path.lstrip("/"),
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+        )
+    else:
+        app.run_polling()
+
+
+
+# ---- scale-out ----
+# front: принимает webhook от Telegram и раздаёт апдейты воркерам по user id (один пользователь —
+# всегда один воркер, поэтому диалоги и user_data остаются в одном процессе). Воркеры — обычный бот
+# без своего Updater'а: апдейты приходят построчным JSON через unix-сокет, и на каждый обработанный
+# воркер отвечает строкой с его номером — только тогда front отвечает Telegram'у 200. Рецепты и избранное все
+# воркеры берут из одной recipes.db, bot_state.db тоже общая (строки разных пользователей не пересекаются).
+# Правки каталога из одного воркера остальные подхватывают через таблицу changes (RecipeStore.refresh).
+def raw_update_owner(data: dict) -> int:
+    # то же, что _update_owner, но по сырому JSON — front апдейт целиком не разбирает
+    for key, value in data.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        user = value.get("from") or value.get("user")
+        if user:
+            return user["id"]
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+    return 0
+
+
+def worker_socket(index: int) -> str:
+    return os.path.join(WORKER_SOCKET_DIR, f"worker-{index}.sock")
+
+
+class UpdateRouter:
+    def __init__(self, workers: int, path: str = ""):
+        self.workers = workers
+        self.path = path
+        self._conns: Dict[int, asyncio.StreamWriter] = {}
+        self._acks: Dict[int, Dict[int, asyncio.Future]] = {}   # воркер -> номер апдейта -> ждущий ответа
+        self._readers: Set[asyncio.Task] = set()
+        self._seq = itertools.count(1)
+        self._locks = [asyncio.Lock() for _ in range(workers)]
+        self._procs: Dict[int, asyncio.subprocess.Process] = {}
+        self._stopping = False
+
+    async def _connect(self, index: int) -> asyncio.StreamWriter:
+        reader, conn = await asyncio.open_unix_connection(worker_socket(index))
+        acks: Dict[int, asyncio.Future] = {}
+        self._conns[index], self._acks[index] = conn, acks
+        task = asyncio.create_task(self._read_acks(index, reader, conn, acks))
+        self._readers.add(task)
+        task.add_done_callback(self._readers.discard)
+        return conn
+
+    async def _read_acks(self, index: int, reader: asyncio.StreamReader, conn: asyncio.StreamWriter,
+                         acks: Dict[int, asyncio.Future]) -> None:
+        try:
+            async for line in reader:
+                done = acks.pop(int(line), None)
+                if done is not None and not done.done():
+                    done.set_result(None)
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            # воркер упал или закрыл сокет — неподтверждённые апдейты получат 503 и придут снова
+            if self._conns.get(index) is conn:
+                del self._conns[index]
+            conn.close()
+            for done in acks.values():
+                if not done.done():
+                    done.set_exception(ConnectionError(f"воркер {index} отключился"))
+            acks.clear()
+
+    async def route(self, data: dict) -> None:
+        index = raw_update_owner(data) % self.workers
+        seq = next(self._seq)
+        line = json.dumps({"seq": seq, "update": data}, ensure_ascii=False).encode("utf-8") + b"\n"
+        # по одному соединению на воркер и под замком — апдейты пользователя приходят в том же порядке
+        async with self._locks[index]:
+            for attempt in range(2):
+                conn = self._conns.get(index)
+                try:
+                    if conn is None:
+                        conn = await self._connect(index)
+                    done = self._acks[index][seq] = asyncio.get_running_loop().create_future()
+                    conn.write(line)
+                    await conn.drain()
+                    break
+                except OSError:
+                    # воркер перезапустился — переподключаемся один раз
+                    if conn is not None:
+                        self._acks.get(index, {}).pop(seq, None)
+                        conn.close()
+                        if self._conns.get(index) is conn:
+                            del self._conns[index]
+                    if attempt:
+                        raise
+        # ответа ждём уже без замка: апдейты других пользователей этого воркера за нами не стоят
+        try:
+            await asyncio.wait_for(done, WORKER_ACK_TIMEOUT)
+        finally:
+            self._acks.get(index, {}).pop(seq, None)
+
+    async def handle(self, method: str, target: str, headers: Dict[str, str], body: bytes) -> Tuple[str, bytes]:
+        if method != "POST" or (self.path and urlparse(target).path != self.path):
+            return "404 Not Found", b""
+        import hmac   # нужен только front'у — воркерам и обычному боту на старте не грузим
+        secret = headers.get("x-telegram-bot-api-secret-token", "")
+        if WEBHOOK_SECRET and not hmac.compare_digest(secret, WEBHOOK_SECRET):
+            return "403 Forbidden", b""
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return "400 Bad Request", b""
+        if not isinstance(data, dict):
+            return "400 Bad Request", b""
+        try:
+            await self.route(data)
+        except (OSError, asyncio.TimeoutError):
+            # воркер недоступен, упал посреди обработки или не уложился в WORKER_ACK_TIMEOUT;
+            # не ответили 200 — Telegram пришлёт этот апдейт ещё раз
+            logger.warning("Воркер не подтвердил апдейт %s, Telegram повторит его", data.get("update_id"))
+            return "503 Service Unavailable", b""
+        return "200 OK", b""
+
+    async def supervise(self, index: int) -> None:
+        # воркер упал — поднимаем заново; его апдейты тем временем получают 503 и повторяются Telegram'ом
+        while not self._stopping:
+            proc = await asyncio.create_subprocess_exec(
+                sys.executable, os.path.abspath(__file__), "worker", str(index), str(self.workers)
+            )
+            self._procs[index] = proc
+            code = await proc.wait()
+            if self._stopping:
+                return
+            logger.warning("Воркер %d завершился с кодом %s, перезапускаю", index, code)
+            await asyncio.sleep(1)
+
+    async def stop(self) -> None:
+        self._stopping = True
+        for conn in list(self._conns.values()):
+            conn.close()
+        for proc in self._procs.values():
+            if proc.returncode is None:
+                proc.terminate()
+        await asyncio.gather(*(proc.wait() for proc in self._procs.values()))
+
+
+def _stop_event() -> asyncio.Event:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    return stop
+
+
+async def run_front(workers: int = BOT_WORKERS) -> None:
+    if STORAGE_MODE != "sqlite":
+        raise SystemExit("Несколько воркеров работают только с общей базой: RECIPES_STORAGE=sqlite")
+    os.makedirs(WORKER_SOCKET_DIR, exist_ok=True)
+    # схемы баз и импорт старого pickle — один раз здесь, а не наперегонки в воркерах
+    STORE.backend.db.close()
+    SqlitePersistence().db.close()
+
+    router = UpdateRouter(workers, urlparse(WEBHOOK_URL).path)
+    stop = _stop_event()
+    supervisors = [asyncio.create_task(router.supervise(i)) for i in range(workers)]
+    server = await asyncio.start_server(lambda r, w: serve_http(r, w, router.handle), WEBHOOK_LISTEN, WEBHOOK_PORT)
+    if WEBHOOK_URL:
+        async with Bot(read_token()) as bot:
+            await bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET, allowed_updates=Update.ALL_TYPES)
+    logger.info("front: %s:%d -> %d воркеров", WEBHOOK_LISTEN, WEBHOOK_PORT, workers)
+    await stop.wait()
+    server.close()
+    await router.stop()
+    await asyncio.gather(*supervisors, return_exceptions=True)
+
+
+async def run_worker(index: int, workers: int) -> None:
+    global METRICS_PORT
+    if METRICS_PORT:
+        METRICS_PORT += index
+    # общий лимит исходящих сообщений бота делим между воркерами
+    app = build_application(GLOBAL_SEND_RATE / workers, updater=False)
+    stop = _stop_event()
+    tasks: Set[asyncio.Task] = set()
+
+    async def process(seq: int, update: Update, writer: asyncio.StreamWriter) -> None:
+        # тот же путь, что и у апдейтов из update_queue (PerUserUpdateProcessor), но front узнаёт,
+        # когда апдейт обработан; ошибки обработчиков Application уже передал в error handler
+        await app.update_processor.process_update(update, app.process_update(update))
+        if not writer.is_closing():
+            writer.write(f"{seq}\n".encode("ascii"))
+
+    async def receive(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            async for line in reader:
+                try:
+                    envelope = json.loads(line)
+                    seq = envelope["seq"]
+                    update = Update.de_json(envelope["update"], app.bot)
+                except (ValueError, KeyError, TypeError):
+                    logger.warning("Воркер %d: битая строка апдейта пропущена", index)
+                    continue
+                # апдейты разных пользователей обрабатываются параллельно; порядок задач — порядок строк
+                task = asyncio.create_task(process(seq, update, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    await app.initialize()
+    await app.post_init(app)
+    await app.start()
+    path = worker_socket(index)
+    if os.path.exists(path):
+        os.unlink(path)
+    server = await asyncio.start_unix_server(receive, path, limit=1 << 20)
+    try:
+        await stop.wait()
+    finally:
+        server.close()
+        await app.stop()
+        await app.shutdown()
+        await app.post_shutdown(app)
+
+
+STARTUP.mark("import")
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "export":
+        # python botAdmin.py export recipes.json — выгрузить каталог в обычный JSON (recipes.jsonl — в JSON Lines)
+        STORE.load()
+        STORE.export(sys.argv[2])
+    elif len(sys.argv) == 3 and sys.argv[1] == "import":
+        # python botAdmin.py import big.jsonl — потоковый импорт файла любого размера (бот должен быть остановлен,
+        # если хранилище json/journal; с sqlite работающие процессы подхватят изменения сами)
+        STORE.load()
+        print(import_file(STORE, sys.argv[2]).summary())
+        if STORE.cache is not None:
+            write_startup_cache(STORE, STARTUP_CACHE)
+    elif len(sys.argv) == 2 and sys.argv[1] == "startup-cache":
+        # python botAdmin.py startup-cache — собрать кэш старта (STARTUP_CACHE) сейчас; бот делает это сам
+        if not STARTUP_CACHE:
+            sys.exit("Задай путь к кэшу в STARTUP_CACHE")
+        if not build_startup_cache(STORE, STARTUP_CACHE):
+            print(f"{STARTUP_CACHE} уже собирает другой процесс")
+    elif len(sys.argv) == 3 and sys.argv[1] == "startup-report":
+        # python botAdmin.py startup-report startup.jsonl — время старта по релизам (BOT_VERSION)
+        print(startup_summary(sys.argv[2]))
+    elif len(sys.argv) == 2 and sys.argv[1] == "front":
+        # python botAdmin.py front — webhook + BOT_WORKERS процессов-воркеров (нужен RECIPES_STORAGE=sqlite)
+        asyncio.run(run_front())
+    elif len(sys.argv) == 4 and sys.argv[1] == "worker":
+        # запускается front'ом: python botAdmin.py worker <номер> <всего>
+        asyncio.run(run_worker(int(sys.argv[2]), int(sys.argv[3])))
+    elif len(sys.argv) == 2 and sys.argv[1] == "migrate-sqlite":
+        # python botAdmin.py migrate-sqlite — перенести recipes.json и избранное из pickle в recipes.db
+        n_recipes, n_favs = migrate_to_sqlite()
+        print(f"Перенесено рецептов: {n_recipes}, записей избранного: {n_favs} -> {SQLITE_FILE}")
+    else:
+        main()